@@ -1,7 +1,7 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import sqlite3
-from backend.db import get_conn
+from backend.principal import PRINCIPALS
 
 security = HTTPBearer(auto_error=False)
 
@@ -9,11 +9,9 @@ security = HTTPBearer(auto_error=False)
 def require_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
     # ⚠️ Тут можно потом сделать полноценную JWT-проверку
     # Пока просто костыль: пропускаем всех пользователей с ролью admin/superadmin из таблицы users
-    conn = get_conn()
-    cur = conn.cursor()
-    row = cur.execute("SELECT role FROM users ORDER BY id LIMIT 1").fetchone()
-    conn.close()
+    # роль первого пользователя — из индекса users в памяти, без запроса в базу
+    role = PRINCIPALS.users.first_role()
 
-    if not row or row[0] not in ("admin", "superadmin"):
+    if role not in ("admin", "superadmin"):
         raise HTTPException(status_code=401, detail="Недостаточно прав")
-    return {"role": row[0]}
+    return {"role": role}
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+import time
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+from backend.search import index_new_rows
+from backend.stats import add_new_rows
+from backend.sync import number_new_rows
+
+# === Массовый импорт защит из CSV / XLSX ===
+# Здесь только чтение файла: строки отдаются по одной как (номер строки,
+# {поле ProtectionCreate: значение}), целиком файл в память не читается.
+# Проверки, дубли, TTL и запись пачками — main.import_protections.
+#
+# Заголовки узнаются и по-русски (как в выгрузке /api/export), и по именам
+# полей: «Менеджер» / manager, «Артикул» / sku, «Площадь, м²» / area_m2 ...
+# Колонка «Тип» (type) превращает строку в sku_data из одного артикула —
+# как при создании из формы. Лишние колонки (ID, Статус, даты) игнорируются.
+
+FIELD_ALIASES = {
+    "manager": ("manager", "менеджер"),
+    "client": ("client", "клиент"),
+    "partner": ("partner", "партнёр", "партнер"),
+    "partner_city": ("partner_city", "город партнёра", "город партнера"),
+    "sku": ("sku", "артикул"),
+    "type": ("type", "тип"),
+    "area_m2": ("area_m2", "area", "площадь", "площадь, м²", "площадь, м2", "метраж"),
+    "last4": ("last4", "последние 4 цифры"),
+    "object_city": ("object_city", "город объекта"),
+    "address": ("address", "адрес"),
+    "comment": ("comment", "комментарий"),
+}
+_HEADER_TO_FIELD = {alias: field for field, aliases in FIELD_ALIASES.items() for alias in aliases}
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_CELL_REF = re.compile(r"([A-Z]+)")
+
+
+def detect_format(head: bytes) -> str:
+    return "xlsx" if head.startswith(b"PK\x03\x04") else "csv"
+
+
+def _column_map(header: list) -> dict:
+    """индекс колонки -> поле"""
+    out = {}
+    for i, title in enumerate(header):
+        field = _HEADER_TO_FIELD.get(str(title or "").strip().lower())
+        if field and field not in out.values():
+            out[i] = field
+    if "manager" not in out.values():
+        raise ValueError("В файле нет колонки «Менеджер» (manager)")
+    return out
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)   # артикул 12345 из Excel приходит числом
+    return str(value).strip()
+
+
+def to_fields(values: list, columns: dict):
+    """Строка файла -> kwargs для ProtectionCreate; None — пустая строка"""
+    n = len(values)
+    fields = {field: _text(values[i]) if i < n else "" for i, field in columns.items()}
+    if not any(fields.values()):
+        return None
+    area = fields.pop("area_m2", "")
+    area = area.replace(",", ".").replace(" ", "") or None
+    kind = fields.pop("type", "")
+    if kind:
+        fields["sku_data"] = [{"sku": fields.pop("sku", ""), "type": kind, "area": area}]
+    else:
+        fields["area_m2"] = area
+    return fields
+
+
+# --- CSV ---
+def iter_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    delimiter = max((";", ",", "\t"), key=first.count)
+    reader = csv.reader(io.StringIO(first), delimiter=delimiter)
+    columns = _column_map(next(reader, []))
+    for line_no, values in enumerate(csv.reader(text, delimiter=delimiter), start=2):
+        fields = to_fields(values, columns)
+        if fields is not None:
+            yield line_no, fields
+
+
+# --- XLSX ---
+def _col_index(ref: str) -> int:
+    n = 0
+    for ch in _CELL_REF.match(ref).group(1):
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _shared_strings(zf) -> list:
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    out = []
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, el in iterparse(f):
+            if el.tag == SHEET_NS + "si":
+                out.append("".join(t.text or "" for t in el.iter(SHEET_NS + "t")))
+                el.clear()
+    return out
+
+
+def _cell_value(c, shared: list):
+    kind = c.get("t")
+    if kind == "inlineStr":
+        return "".join(t.text or "" for t in c.iter(SHEET_NS + "t"))
+    v = c.find(SHEET_NS + "v")
+    if v is None or v.text is None:
+        return None
+    if kind == "s":
+        return shared[int(v.text)]
+    if kind in ("str", "e"):
+        return v.text
+    if kind == "b":
+        return v.text == "1"
+    number = float(v.text)
+    return int(number) if number.is_integer() else number
+
+
+def iter_xlsx(fileobj):
+    """Первый лист книги; строки разбираются потоково и сразу выбрасываются"""
+    with zipfile.ZipFile(fileobj) as zf:
+        shared = _shared_strings(zf)
+        sheets = sorted(n for n in zf.namelist() if n.startswith("xl/worksheets/sheet"))
+        if not sheets:
+            raise ValueError("В книге нет листов")
+        name = "xl/worksheets/sheet1.xml" if "xl/worksheets/sheet1.xml" in sheets else sheets[0]
+        columns = None
+        with zf.open(name) as f:
+            sheet_data = None
+            for event, el in iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if el.tag == SHEET_NS + "sheetData":
+                        sheet_data = el
+                    continue
+                if el.tag != SHEET_NS + "row":
+                    continue
+                values, pos = [], 0
+                for c in el.iter(SHEET_NS + "c"):
+                    ref = c.get("r")
+                    idx = _col_index(ref) if ref else pos
+                    values.extend([None] * (idx - len(values)))
+                    values.append(_cell_value(c, shared))
+                    pos = idx + 1
+                line_no = int(el.get("r") or 0)
+                if sheet_data is not None:
+                    sheet_data.clear()   # разобранные строки не копим
+                if columns is None:
+                    columns = _column_map(values)
+                    continue
+                fields = to_fields(values, columns)
+                if fields is not None:
+                    yield line_no, fields
+
+
+def iter_rows(fileobj, fmt: str = None):
+    """(номер строки в файле, поля) из CSV или XLSX; формат по сигнатуре, если не задан"""
+    if fmt is None:
+        head = fileobj.read(4)
+        fileobj.seek(0)
+        fmt = detect_format(head)
+    return iter_xlsx(fileobj) if fmt == "xlsx" else iter_csv(fileobj)
+
+
+# === Запись пачкой ===
+# Триггеры AFTER INSERT на protections (FTS, свёртка статистики, номера
+# синхронизации) построчно обходятся в ~90 мкс на строку, причём FTS — почти
+# всё это время. Одним INSERT ... SELECT на пачку то же самое в разы дешевле.
+# Поэтому на время пачки эти триггеры снимаются и создаются заново из их же
+# SQL в sqlite_master — внутри той же транзакции (DDL в SQLite
+# транзакционный, BEGIN IMMEDIATE не пускает других писателей), так что
+# снаружи схема не меняется ни на миг. Триггер без записи здесь остаётся и
+# срабатывает как обычно.
+BULK_INSERT_HOOKS = {
+    "protections_fts_ai": index_new_rows,
+    "manager_stats_ai": add_new_rows,
+    "protections_sync_ai": number_new_rows,
+}
+
+
+def bulk_insert(cur, sql: str, rows: list) -> list:
+    """
+    executemany(sql, rows) в protections внутри уже открытой BEGIN IMMEDIATE
+    транзакции; возвращает новые id по порядку rows.
+    """
+    before = cur.execute("SELECT IFNULL(MAX(id), 0) FROM protections").fetchone()[0]
+    triggers = cur.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name='protections'"
+    ).fetchall()
+    suspended = [(name, ddl) for name, ddl in triggers if name in BULK_INSERT_HOOKS]
+    for name, _ in suspended:
+        cur.execute(f"DROP TRIGGER {name}")
+    cur.executemany(sql, rows)
+    ids = [r[0] for r in cur.execute("SELECT id FROM protections WHERE id > ? ORDER BY id", (before,))]
+    if len(ids) != len(rows) or (ids and ids[-1] - ids[0] + 1 != len(ids)):
+        raise RuntimeError(f"импорт: ожидали {len(rows)} новых id подряд, получили {len(ids)}")
+    for name, ddl in suspended:
+        BULK_INSERT_HOOKS[name](cur, before)
+        cur.execute(ddl)
+    return ids
+
+
+# === CLI ===
+# python -m backend.bulk_import регионы.xlsx [--dry-run] [--report отчёт.json]
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Импорт защит из CSV/XLSX в data.sqlite3")
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=("csv", "xlsx"))
+    ap.add_argument("--dry-run", action="store_true", help="только проверить, ничего не записывать")
+    ap.add_argument("--report", help="куда сохранить построчный отчёт (JSON)")
+    args = ap.parse_args(argv)
+
+    from backend import main as api
+
+    api.init_storage()
+    t0 = time.perf_counter()
+    with open(args.path, "rb") as f:
+        report = api.import_protections(iter_rows(f, args.format), dry_run=args.dry_run, actor="import")
+    took = time.perf_counter() - t0
+    print(
+        f"{'🧪 Проверено' if args.dry_run else '✅ Импортировано'}: {report['created']} из {report['total']}, "
+        f"дублей {report['duplicates']}, с ошибками {report['invalid']} — {took:.1f} с"
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as out:
+            json.dump(report, out, ensure_ascii=False, indent=1)
+    else:
+        for r in report["rows"]:
+            if r["status"] not in ("created", "ok"):
+                print(f"  строка {r['row']}: {r['status']} — {r.get('error', '')}")
+    return 0 if not report["invalid"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
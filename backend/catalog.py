@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import backend.db as db
+from backend.dup_index import normalize_sku
+
+# === Каталог артикулов (backend/skus.csv) ===
+# Снимок каталога неизменяемый: индекс по нормализованному SKU, префиксное
+# дерево для автодополнения и заранее готовый ответ /api/skus (JSON, gzip и
+# ETag). При изменении mtime CSV снимок пересобирается и подменяется целиком.
+
+MTIME_CHECK_INTERVAL = 1.0  # сек; чаще stat() делать незачем
+SEARCH_LIMIT = 20
+
+
+def sku_key(raw: str) -> str:
+    return normalize_sku(raw).lower()
+
+
+class _Snapshot:
+    def __init__(self, items: list, mtime_ns: int):
+        self.items = items
+        self.mtime_ns = mtime_ns
+        self.by_sku = {}   # sku_key -> [индексы в items]
+        self.trie = {}     # символ -> узел; в узле "" -> индексы всех SKU с этим префиксом
+        for i, it in enumerate(items):
+            key = sku_key(it["sku"])
+            self.by_sku.setdefault(key, []).append(i)
+            node = self.trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+                node.setdefault("", []).append(i)
+
+        self.body = json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode()
+        self.body_gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        # сильный валидатор, отдельный для каждого кодирования
+        self.etag = f'"{digest}"'
+        self.etag_gzip = f'"{digest}-gz"'
+
+    def prefix(self, key: str) -> list:
+        node = self.trie
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return node.get("", list(range(len(self.items))))
+
+
+class SkuCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def _mtime_ns(self) -> int:
+        try:
+            return os.stat(db.SKUS_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def snapshot(self) -> _Snapshot:
+        """Текущий снимок; раз в MTIME_CHECK_INTERVAL сверяет mtime CSV"""
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is not None and now - self._checked_at < MTIME_CHECK_INTERVAL:
+            return snap
+        with self._lock:
+            self._checked_at = now
+            mtime = self._mtime_ns()
+            if self._snapshot is None or self._snapshot.mtime_ns != mtime:
+                self._snapshot = _Snapshot(db.load_skus(), mtime)
+                self.reloads += 1
+                if self.reloads > 1:
+                    print(f"🔄 Каталог артикулов перечитан: {len(self._snapshot.items)} шт.")
+            return self._snapshot
+
+    @property
+    def items(self) -> list:
+        return self.snapshot().items
+
+    def get(self, sku: str) -> list:
+        """Все записи каталога с таким артикулом (он бывает в нескольких коллекциях)"""
+        snap = self.snapshot()
+        return [snap.items[i] for i in snap.by_sku.get(sku_key(sku), [])]
+
+    def search(self, q: str, collection: str = None, type_: str = None, limit: int = SEARCH_LIMIT) -> list:
+        """Автодополнение: сначала точное совпадение, потом по префиксу в порядке каталога"""
+        snap = self.snapshot()
+        key = sku_key(q)
+        exact = snap.by_sku.get(key, []) if key else []
+        collection = (collection or "").strip().casefold()
+        type_ = (type_ or "").strip().casefold()
+        out = []
+        seen = set()
+        for i in exact + snap.prefix(key):
+            if i in seen:
+                continue
+            seen.add(i)
+            it = snap.items[i]
+            if collection and it["collection"].casefold() != collection:
+                continue
+            if type_ and it["type"].casefold() != type_:
+                continue
+            out.append(it)
+            if len(out) >= limit:
+                break
+        return out
+
+
+CATALOG = SkuCatalog()
@@ -0,0 +1,72 @@
+import hashlib
+import time
+
+from backend.db import DATA_EPOCH, data_version
+
+# === Условные GET (ETag / 304) для часто перезапрашиваемых списков ===
+# ETag = эпоха процесса + версия данных (db.data_version) + путь и query.
+# Пока никто ничего не коммитил, повторный запрос с If-None-Match получает
+# 304 прямо здесь — без обработчика и без базы. ETag слабый (W/): один и тот
+# же ответ может уйти и как gzip, и без сжатия.
+
+# путь -> секунды, на которые ответ зависит от текущего времени (None — не зависит).
+# В /api/protections есть days_left, поэтому ETag там ещё и меняется раз в минуту.
+CONDITIONAL_PATHS = {
+    "/api/protections": 60,
+    "/api/protections/changes": 60,
+    "/api/stats": None,
+    "/api/managers": None,
+    "/api/history": None,
+}
+
+
+def make_etag(path: str, query: bytes, time_bucket) -> str:
+    key = hashlib.sha1(path.encode() + b"?" + query).hexdigest()[:12]
+    tag = f"{DATA_EPOCH}-{data_version()}-{key}"
+    if time_bucket:
+        tag += f"-{int(time.time() // time_bucket)}"
+    return f'W/"{tag}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:]  # слабое сравнение: W/ не учитываем
+    return any(t.strip().removeprefix("W/") == bare for t in if_none_match.split(","))
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app, paths: dict = None):
+        self.app = app
+        self.paths = CONDITIONAL_PATHS if paths is None else paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # версию берём до обработчика: если данные поменяются во время ответа,
+        # клиент получит старый ETag и следующий запрос просто не совпадёт
+        etag = make_etag(scope["path"], scope.get("query_string", b""), self.paths[scope["path"]])
+        headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+
+        if_none_match = ""
+        for name, value in scope["headers"]:
+            if name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+                break
+        if if_none_match and _matches(if_none_match, etag):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
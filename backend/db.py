@@ -1,5 +1,12 @@
 import sqlite3
+import asyncio
 import csv
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, timedelta
 
@@ -82,12 +89,193 @@ def load_skus():
     items.sort(key=lambda x: (x["sku"], x["collection"] or "", x["type"] or ""))
     return items
 
-# === Подключение и работа с базой ===
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# === Пул соединений ===
+# Соединение открывается один раз, PRAGMA применяются при открытии, а
+# conn.close() в обработчиках просто возвращает его в пул.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))      # сколько простаивающих держим
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+STATEMENT_CACHE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA mmap_size=268435456",   # 256 МБ
+    "PRAGMA cache_size=-16000",     # ~16 МБ на соединение
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection, у которого close() возвращает его в пул"""
+
+    def on_commit(self, fn):
+        """fn() выполнится сразу после ближайшего успешного commit; при откате — отбрасывается"""
+        callbacks = getattr(self, "_on_commit", None)
+        if callbacks is None:
+            callbacks = self._on_commit = []
+        callbacks.append(fn)
+
+    def on_rollback(self, fn):
+        """fn() выполнится, если транзакция (или текущий savepoint) откатится; после commit — отбрасывается"""
+        callbacks = getattr(self, "_on_rollback", None)
+        if callbacks is None:
+            callbacks = self._on_rollback = []
+        callbacks.append(fn)
+
+    @contextmanager
+    def savepoint(self):
+        """
+        with conn.savepoint(): ... — вложенная транзакция. Исключение откатывает
+        только её: её on_commit отбрасываются, её on_rollback выполняются.
+        """
+        commits = len(getattr(self, "_on_commit", None) or ())
+        rollbacks = len(getattr(self, "_on_rollback", None) or ())
+        self.execute("SAVEPOINT sp")
+        try:
+            yield self
+        except BaseException:
+            self.execute("ROLLBACK TO sp")
+            self.execute("RELEASE sp")
+            if commits < len(getattr(self, "_on_commit", None) or ()):
+                del self._on_commit[commits:]
+            undo = (getattr(self, "_on_rollback", None) or [])[rollbacks:]
+            if undo:
+                del self._on_rollback[rollbacks:]
+                _run_callbacks(reversed(undo), "on_rollback")
+            raise
+        self.execute("RELEASE sp")
+
+    def commit(self):
+        super().commit()
+        self._on_rollback = []
+        # версия данных растёт, только если соединение что-то меняло
+        changes = self.total_changes
+        if changes != getattr(self, "_committed_changes", 0):
+            self._committed_changes = changes
+            bump_data_version()
+        callbacks = getattr(self, "_on_commit", None)
+        if callbacks:
+            self._on_commit = []
+            _run_callbacks(callbacks, "on_commit")
+
+    def rollback(self):
+        super().rollback()
+        self._on_commit = []
+        callbacks = getattr(self, "_on_rollback", None)
+        if callbacks:
+            self._on_rollback = []
+            _run_callbacks(reversed(callbacks), "on_rollback")
+
+    def close(self):
+        _release(self)
+
+    def close_for_real(self):
+        super().close()
+
+
+def _run_callbacks(callbacks, kind: str):
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception as e:
+            print(f"⚠️ Ошибка в {kind}:", e)
+
+
+_pool_lock = threading.Lock()
+_idle: list = []
+_pool_path = None
+
+
+# === Версия данных ===
+# Счётчик в памяти процесса, растёт при каждом commit с изменениями (см.
+# PooledConnection.commit). По нему строятся ETag ответов (backend/conditional.py):
+# узнать, изменились ли данные, можно без запроса в базу. DATA_EPOCH отличает
+# запуски процесса — после рестарта счётчик начинается заново.
+DATA_EPOCH = format(time.time_ns() // 1_000_000, "x")
+_data_version = 0
+_version_lock = threading.Lock()
+
+
+def data_version() -> int:
+    return _data_version
+
+
+def bump_data_version():
+    global _data_version
+    with _version_lock:
+        _data_version += 1
+
+
+def _connect() -> PooledConnection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        factory=PooledConnection,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,   # соединение переходит между потоками threadpool
+        cached_statements=STATEMENT_CACHE,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+
+def _release(conn: PooledConnection):
+    try:
+        if conn.in_transaction:
+            conn.rollback()   # незакоммиченное не должно достаться следующему
+        conn._on_commit = []
+        conn._on_rollback = []
+        conn.row_factory = sqlite3.Row
+    except sqlite3.ProgrammingError:
+        return  # уже закрыто
+    with _pool_lock:
+        if _pool_path == DB_PATH and len(_idle) < POOL_SIZE and conn not in _idle:
+            _idle.append(conn)
+            return
+    conn.close_for_real()
+
+
+def close_pool():
+    with _pool_lock:
+        conns = list(_idle)
+        _idle.clear()
+    for conn in conns:
+        conn.close_for_real()
+
+
+# === Подключение и работа с базой ===
+def get_conn():
+    global _pool_path
+    with _pool_lock:
+        if _pool_path != DB_PATH:
+            # путь к базе сменили (тесты/бенчмарки) — старые соединения не годятся
+            stale = list(_idle)
+            _idle.clear()
+            _pool_path = DB_PATH
+        else:
+            stale = []
+        conn = _idle.pop() if _idle else None
+    for old in stale:
+        old.close_for_real()
+    return conn or _connect()
+
+
+# === Доступ к базе из корутин ===
+# sqlite3 блокирующий: прямой запрос из async-функции останавливает весь
+# event loop (и поллинг бота вместе с ним). Корутины отдают работу с базой
+# в отдельные потоки и ждут результат через await run_db(...).
+DB_ASYNC_WORKERS = int(os.getenv("DB_ASYNC_WORKERS", "2"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_ASYNC_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Выполняет синхронную fn(*args) в DB-потоке, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
 def init_db():
     conn = get_conn()
     cur = conn.cursor()
@@ -125,6 +313,40 @@ def init_db():
         )
     """)
 
+    # --- Managers ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS managers(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+    # --- History ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS history(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            protection_id INTEGER NOT NULL,
+            at TEXT NOT NULL,
+            actor TEXT NOT NULL,
+            action TEXT NOT NULL,
+            payload TEXT,
+            FOREIGN KEY(protection_id) REFERENCES protections(id)
+        )
+    """)
+
+    # --- Telegram-сообщения по защитам (для редактирования после решения) ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tg_notifications(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            protection_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(protection_id) REFERENCES protections(id)
+        )
+    """)
+
     conn.commit()
     conn.close()
 
@@ -0,0 +1,134 @@
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+# === Индекс дублей: нормализованный SKU → отсортированные площади ===
+# Держим в памяти только активные защиты, по записи на каждый артикул. Поиск ±10% — это один dict-lookup
+# и бинарный поиск по площадям вместо полного прохода по таблице.
+
+
+def normalize_sku(raw: str) -> str:
+    return re.sub(r"[\(\)а-яА-Я\s]+", "", raw or "").strip()
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_sku = {}    # sku_norm -> отсортированный список (area, pid)
+        self._by_pid = {}    # pid -> [(sku_norm, area)] — по строке на артикул защиты
+        self._loaded = False
+
+    # --- построение ---
+    # артикулы и площади — из protection_items (backend/items.py); NULL в
+    # area_m2 — общая площадь защиты на все её артикулы
+    _ITEMS = """
+        SELECT p.id, i.sku, IFNULL(i.area_m2, p.area_m2)
+        FROM protections p JOIN protection_items i ON i.protection_id = p.id
+        WHERE p.status='active'
+    """
+
+    def rebuild(self, cur):
+        by_sku, by_pid = {}, {}
+        for pid, sku, area in cur.execute(self._ITEMS):
+            if not area:
+                continue
+            entry = (sku, float(area))
+            entries = by_pid.setdefault(pid, [])
+            if entry in entries:
+                continue
+            entries.append(entry)
+            by_sku.setdefault(sku, []).append((float(area), pid))
+        for entries in by_sku.values():
+            entries.sort()
+        with self._lock:
+            self._by_sku, self._by_pid = by_sku, by_pid
+            self._loaded = True
+
+    def ensure_loaded(self, cur):
+        if not self._loaded:
+            self.rebuild(cur)
+
+    def invalidate(self):
+        """Следующий ensure_loaded перечитает индекс из базы"""
+        with self._lock:
+            self._loaded = False
+
+    # --- изменения ---
+    def _remove_locked(self, pid):
+        for key, area in self._by_pid.pop(pid, ()):
+            entries = self._by_sku.get(key)
+            if not entries:
+                continue
+            i = bisect_left(entries, (area, pid))
+            if i < len(entries) and entries[i] == (area, pid):
+                entries.pop(i)
+            if not entries:
+                del self._by_sku[key]
+
+    def _put_locked(self, pid, pairs):
+        self._remove_locked(pid)
+        entries = []
+        for key, area in pairs:
+            if not area or (key, float(area)) in entries:
+                continue
+            entries.append((key, float(area)))
+            insort(self._by_sku.setdefault(key, []), (float(area), pid))
+        if entries:
+            self._by_pid[pid] = entries
+
+    def put(self, pid, pairs):
+        """pairs — [(нормализованный SKU, площадь)] активной защиты"""
+        with self._lock:
+            self._put_locked(pid, pairs)
+
+    def remove(self, pid):
+        with self._lock:
+            self._remove_locked(pid)
+
+    def sync(self, cur, *pids):
+        """Перечитывает защиты из БД и приводит индекс в соответствие"""
+        if not self._loaded or not pids:
+            return  # индекс ещё не построен — подхватит всё при rebuild
+        pairs = {pid: [] for pid in pids}
+        rows = cur.execute(
+            f"{self._ITEMS} AND p.id IN ({','.join('?' * len(pairs))})", list(pairs)
+        ).fetchall()
+        for pid, sku, area in rows:
+            pairs[pid].append((sku, area))
+        with self._lock:
+            for pid, items in pairs.items():
+                self._put_locked(pid, items)
+        if cur.connection.in_transaction:
+            # индекс уже видит незакоммиченное (так проверка дублей внутри
+            # группы изменений backend/writer.py видит соседние); откат — перечитать
+            cur.connection.on_rollback(self.invalidate)
+
+    # --- поиск ---
+    def find_in_range(self, sku_norm, lo, hi):
+        """pid активных защит с тем же SKU и lo <= area <= hi (по возрастанию площади)"""
+        with self._lock:
+            entries = self._by_sku.get(sku_norm)
+            if not entries:
+                return []
+            i = bisect_left(entries, (lo, -1))
+            j = bisect_right(entries, (hi, float("inf")))
+            return list(dict.fromkeys(pid for area, pid in entries[i:j] if lo <= area <= hi))
+
+    def find_around(self, sku_norm, area):
+        """pid защит, для которых area попадает в ±10% от их площади"""
+        x = float(area)
+        # запас на погрешность деления, точная проверка — как в старой логике
+        candidates = self.find_in_range(sku_norm, x / 1.1 * 0.999, x / 0.9 * 1.001)
+        with self._lock:
+            out = []
+            for pid in candidates:
+                if any(key == sku_norm and area * 0.9 <= x <= area * 1.1
+                       for key, area in self._by_pid.get(pid, ())):
+                    out.append(pid)
+            return out
+
+    def __len__(self):
+        return len(self._by_pid)
+
+
+DUP_INDEX = DuplicateIndex()
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+from backend.db import DATA_EPOCH
+from backend.managers import MANAGERS
+
+# === Живая лента изменений (Server-Sent Events, GET /api/events) ===
+# Запись в history (add_history) ставит событие на соединение, а после commit
+# оно уходит подписчикам: «protection» — защита целиком, «stats» — строка
+# статистики её менеджера. Менеджер видит только свои события, админ — все.
+# Событие помечено managers.id защиты (0 — без менеджера), подписчик — id
+# менеджеров, которых он видит: имена тёзок не путаются.
+#
+# id события — "<эпоха процесса>:<номер>". Браузерный EventSource сам
+# присылает Last-Event-ID при переподключении, и пропущенное досылается из
+# кольцевого буфера. Если буфер уже ушёл дальше (или сервер перезапускался),
+# приходит «resync» — клиенту нужно один раз перечитать списки целиком.
+
+BACKLOG_SIZE = 10_000      # сколько последних событий держим для докачки
+QUEUE_SIZE = 1_000         # очередь одного подписчика; переполнилась — отключаем
+HEARTBEAT_SEC = 20         # комментарий-пинг, чтобы прокси не рвали соединение
+RETRY_MS = 3000
+
+
+class Event:
+    __slots__ = ("seq", "kind", "data", "manager", "_frame")
+
+    def __init__(self, seq: int, kind: str, data: dict, manager):
+        self.seq = seq
+        self.kind = kind
+        self.data = data
+        self.manager = manager   # managers.id (0 — защита без менеджера); None — событие для всех
+        self._frame = None
+
+    @property
+    def frame(self) -> bytes:
+        # кодируем один раз на событие, а не на каждого подписчика
+        if self._frame is None:
+            payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"))
+            self._frame = f"id: {DATA_EPOCH}:{self.seq}\nevent: {self.kind}\ndata: {payload}\n\n".encode()
+        return self._frame
+
+
+class Subscriber:
+    def __init__(self, managers=None):
+        self.managers = managers   # множество managers.id; None — видит всё (админ)
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflow = False
+
+    def wants(self, ev: Event) -> bool:
+        return ev.manager is None or self.managers is None or ev.manager in self.managers
+
+
+class EventBus:
+    def __init__(self, backlog: int = BACKLOG_SIZE):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._backlog = deque(maxlen=backlog)
+        self._subscribers = set()
+        self._loop = None
+        self.encode_row = dict   # main подставляет row_to_out
+
+    # --- публикация (из любого потока) ---
+    def publish(self, kind: str, data: dict, manager=None) -> Event:
+        with self._lock:
+            self._seq += 1
+            ev = Event(self._seq, kind, data, manager)
+            self._backlog.append(ev)
+            # под тем же lock: порядок в очередях подписчиков = порядок номеров
+            if self._loop and self._subscribers:
+                self._loop.call_soon_threadsafe(self._fanout, ev)
+        return ev
+
+    def _fanout(self, ev: Event):
+        for sub in list(self._subscribers):
+            if sub.overflow or not sub.wants(ev):
+                continue
+            try:
+                sub.queue.put_nowait(ev)
+            except asyncio.QueueFull:
+                # слишком медленный клиент: закрываем, он переподключится с Last-Event-ID
+                sub.overflow = True
+
+    # --- подписка (в event loop) ---
+    def _parse_last_id(self, last_event_id: str):
+        """Номер последнего полученного события или None, если докачать нельзя"""
+        if not last_event_id:
+            return self._seq
+        epoch, _, seq = last_event_id.partition(":")
+        if epoch != DATA_EPOCH or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._backlog[0].seq if self._backlog else self._seq + 1
+        if seq > self._seq or seq < oldest - 1:
+            return None
+        return seq
+
+    def subscribe(self, sub: Subscriber, last_event_id: str = ""):
+        """Регистрирует подписчика; возвращает (пропущенные события, нужен ли resync, с какого номера живьём)"""
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            last = self._parse_last_id(last_event_id)
+            resync = last is None
+            if resync:
+                last = self._seq
+            backlog = [ev for ev in self._backlog if ev.seq > last]
+            self._subscribers.add(sub)
+        return backlog, resync, last
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.discard(sub)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    async def stream(self, sub: Subscriber, last_event_id: str = ""):
+        """Тело SSE-ответа"""
+        backlog, resync, sent = self.subscribe(sub, last_event_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            if resync:
+                yield f"id: {DATA_EPOCH}:{sent}\nevent: resync\ndata: {{}}\n\n".encode()
+            for ev in backlog:
+                if sub.wants(ev):
+                    yield ev.frame
+                sent = ev.seq
+            while not sub.overflow:
+                try:
+                    ev = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if ev.seq <= sent:
+                    continue   # уже отдано из буфера
+                sent = ev.seq
+                yield ev.frame
+        finally:
+            self.unsubscribe(sub)
+
+
+EVENTS = EventBus()
+
+
+# === Источник событий: записи в history ===
+def stage_protection_event(conn, protection_id: int, action: str, actor: str):
+    """Ставит событие по защите; уйдёт подписчикам только после commit этого соединения"""
+    staged = getattr(conn, "_staged_events", None)
+    if not staged:
+        staged = conn._staged_events = []
+        conn.on_commit(lambda: _publish_staged(conn))
+    event = (protection_id, action, actor)
+    staged.append(event)
+    # откат (в том числе savepoint изменения в backend/writer.py) — события нет
+    conn.on_rollback(lambda: event in staged and staged.remove(event))
+
+
+def _publish_staged(conn):
+    staged, conn._staged_events = conn._staged_events, []
+    if not staged:
+        return
+    pids = list(dict.fromkeys(pid for pid, _, _ in staged))
+    marks = ",".join("?" * len(pids))
+    rows = {r["id"]: r for r in conn.execute(f"SELECT * FROM protections WHERE id IN ({marks})", pids)}
+    managers = {}   # manager_id (0 — без менеджера) -> имя
+    for pid, action, actor in staged:
+        row = rows.get(pid)
+        if row is None:
+            EVENTS.publish("protection", {"action": action, "actor": actor, "protection": {"id": pid}})
+            continue
+        mid = row["manager_id"] or 0
+        managers[mid] = MANAGERS.name(row)
+        EVENTS.publish(
+            "protection",
+            {"action": action, "actor": actor, "protection": EVENTS.encode_row(row)},
+            manager=mid,
+        )
+    for mid, st in manager_stats(conn, managers).items():
+        EVENTS.publish("stats", st, manager=mid)
+
+
+def manager_stats(conn, managers: dict) -> dict:
+    """{manager_id: строка в формате /api/stats} для менеджеров {manager_id: имя} (из свёртки manager_stats)"""
+    if not managers:
+        return {}
+    ids = sorted(managers)
+    marks = ",".join("?" * len(ids))
+    out = {mid: {"manager": managers[mid], "total": 0, "active": 0, "success": 0, "closed": 0,
+                 "active_area": 0.0, "success_area": 0.0, "closed_area": 0.0} for mid in ids}
+    for r in conn.execute(
+        f"SELECT manager_id, status, cnt, area FROM manager_stats WHERE manager_id IN ({marks}) AND status != 'deleted'",
+        ids,
+    ):
+        st = out[r["manager_id"]]
+        st["total"] += r["cnt"]
+        if r["status"] in ("active", "success", "closed"):
+            st[r["status"]] = r["cnt"]
+            st[f"{r['status']}_area"] = round(r["area"], 1)
+    for st in out.values():
+        st["success_rate"] = round(st["success"] / st["total"] * 100) if st["total"] else 0
+    return out
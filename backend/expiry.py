@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from backend.db import get_conn, run_db, now_iso
+from backend.dup_index import DUP_INDEX
+from backend.events import stage_protection_event
+from backend.tg_outbox import OUTBOX, enqueue, esc
+from backend.managers import name_sql
+from backend.recipients import RECIPIENTS
+from backend.writer import WRITER
+
+# === Планировщик напоминаний и авто-закрытия защит ===
+# В куче лежат ближайшие сроки: (когда, что сделать, id защиты). Планировщик
+# спит ровно до ближайшего срока, а не раз в сутки. Каждое событие перед
+# выполнением перепроверяется по базе, поэтому устаревшие записи в куче
+# (после продления/закрытия) просто пропускаются.
+
+REMIND_BEFORE_DAYS = 2
+BATCH_SIZE = 500
+MAX_SLEEP = 3600  # на всякий случай просыпаемся хотя бы раз в час
+
+EXPIRE = 0   # при одинаковом сроке сначала закрываем, потом напоминаем
+REMIND = 1
+
+
+def iso_to_ts(value: str) -> float:
+    dt = datetime.fromisoformat(value.replace("Z", ""))
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._event = None
+
+    # --- наполнение кучи ---
+    def arm(self, pid: int, expires_at: str, reminded: bool = False):
+        """Ставит сроки защиты в кучу; можно звать из любого потока"""
+        self.arm_ts(pid, iso_to_ts(expires_at), reminded)
+
+    def arm_ts(self, pid: int, expires: float, reminded: bool = False):
+        """То же, что arm, но срок уже в секундах Unix (protections.expires_ts)"""
+        with self._lock:
+            heapq.heappush(self._heap, (expires, EXPIRE, pid))
+            if not reminded:
+                remind_at = expires - REMIND_BEFORE_DAYS * 86400
+                heapq.heappush(self._heap, (remind_at, REMIND, pid))
+        if self._loop and self._event:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def load(self):
+        conn = get_conn()
+        rows = conn.execute(
+            "SELECT id, expires_ts, reminder_sent_at FROM protections WHERE status='active'"
+        ).fetchall()
+        conn.close()
+        with self._lock:
+            self._heap = []
+        for r in rows:
+            self.arm_ts(r["id"], r["expires_ts"], reminded=bool(r["reminder_sent_at"]))
+        return len(rows)
+
+    def _pop_due(self, now: float):
+        due = {EXPIRE: [], REMIND: []}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, kind, pid = heapq.heappop(self._heap)
+                due[kind].append(pid)
+            next_at = self._heap[0][0] if self._heap else None
+        return due, next_at
+
+    # --- основной цикл ---
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        loaded = await run_db(self.load)
+        print(f"⏰ Планировщик сроков запущен, активных защит: {loaded}")
+        while True:
+            try:
+                due, next_at = self._pop_due(time.time())
+                if due[EXPIRE]:
+                    closed = await run_db(auto_close, due[EXPIRE])
+                    if closed:
+                        print(f"🔒 Авто-закрыто истёкших защит: {closed}")
+                if due[REMIND]:
+                    queued = await run_db(send_reminders, due[REMIND])
+                    if queued:
+                        OUTBOX.wake()
+            except Exception as e:
+                print("❌ Ошибка в планировщике сроков:", e)
+                next_at = time.time() + 60
+
+            timeout = MAX_SLEEP if next_at is None else min(MAX_SLEEP, max(0.0, next_at - time.time()))
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+
+
+# === Синхронная часть (выполняется через run_db) ===
+def _chunks(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _close_expired_tx(conn, chunk: list, now: str) -> int:
+    cur = conn.cursor()
+    marks = ",".join("?" * len(chunk))
+    expired = [r["id"] for r in cur.execute(
+        f"SELECT id FROM protections WHERE id IN ({marks}) AND status='active' AND expires_ts <= ?",
+        (*chunk, iso_to_ts(now)),
+    ).fetchall()]
+    if not expired:
+        return 0
+    marks = ",".join("?" * len(expired))
+    cur.execute(
+        f"UPDATE protections SET status='closed', auto_closed=1, closed_at=?, updated_at=? WHERE id IN ({marks})",
+        (now, now, *expired),
+    )
+    cur.executemany(
+        "INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,?,?,?)",
+        [
+            (pid, now, "system", "auto_close", json.dumps({"reason": "срок истёк"}, ensure_ascii=False))
+            for pid in expired
+        ],
+    )
+    for pid in expired:
+        stage_protection_event(conn, pid, "auto_close", "system")
+    DUP_INDEX.sync(cur, *expired)
+    return len(expired)
+
+
+def auto_close(pids: list) -> int:
+    """
+    Закрывает истёкшие защиты пачками; ещё не истёкшие (продлённые) пропускает.
+    Проверка срока и UPDATE — в одной транзакции писателя (backend/writer.py),
+    так что продление между ними не потеряется.
+    """
+    now = now_iso()
+    return sum(WRITER.call(_close_expired_tx, chunk, now) for chunk in _chunks(sorted(set(pids))))
+
+
+def _remind_tx(conn, chunk: list) -> int:
+    cur = conn.cursor()
+    border = time.time() + REMIND_BEFORE_DAYS * 86400
+    marks = ",".join("?" * len(chunk))
+    rows = cur.execute(
+        f"""
+        SELECT id, manager_id, {name_sql()} AS manager, sku, expires_at FROM protections
+        WHERE id IN ({marks}) AND status='active'
+          AND reminder_sent_at IS NULL AND expires_ts <= ?
+        """,
+        (*chunk, border),
+    ).fetchall()
+    if not rows:
+        return 0
+    queued = 0
+    recipients = RECIPIENTS.owners({r["manager_id"] for r in rows})
+    for r in rows:
+        msg = (
+            f"⚠️ Защита #{r['id']} ({esc(r['sku'])}) у менеджера {esc(r['manager'])}\n"
+            f"⏰ Истекает {r['expires_at'][:10]} — осталось 2 дня!"
+        )
+        queued += enqueue(cur, recipients[r["manager_id"]], msg, r["id"])
+    cur.execute(
+        f"UPDATE protections SET reminder_sent_at=? WHERE id IN ({','.join('?' * len(rows))})",
+        (now_iso(), *[r["id"] for r in rows]),
+    )
+    return queued
+
+
+def send_reminders(pids: list) -> int:
+    """Ставит напоминания в tg_outbox — ровно один раз на срок (reminder_sent_at)"""
+    return sum(WRITER.call(_remind_tx, chunk) for chunk in _chunks(sorted(set(pids))))
+
+
+EXPIRY = ExpiryScheduler()
@@ -0,0 +1,192 @@
+import csv
+import re
+import zipfile
+from datetime import datetime
+from operator import itemgetter
+from xml.sax.saxutils import escape
+
+from backend import db
+
+# === Выгрузка в CSV / XLSX потоком ===
+# Строки читаются из курсора SQLite пачками и сразу пишутся в ответ, так что
+# память не зависит от размера выгрузки.
+#
+# CSV — UTF-8 с BOM и разделителем «;»: так его без мастера импорта
+# открывает Excel с русской локалью. XLSX собирается без сторонних библиотек:
+# это zip из нескольких XML, лист пишется построчно через zipfile (без seek,
+# размеры уходят в data descriptor), строки — inline, без sharedStrings.
+# Excel показывает не больше 1 048 576 строк на листе — остальное отрезаем.
+
+FETCH_CHUNK = 1000
+XLSX_MAX_ROWS = 1_048_575   # + строка заголовка
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# (заголовок, колонка)
+PROTECTION_COLUMNS = [
+    ("ID", "id"),
+    ("Менеджер", "manager"),
+    ("Клиент", "client"),
+    ("Партнёр", "partner"),
+    ("Город партнёра", "partner_city"),
+    ("Артикул", "sku"),
+    ("Площадь, м²", "area_m2"),
+    ("Последние 4 цифры", "last4"),
+    ("Город объекта", "object_city"),
+    ("Адрес", "address"),
+    ("Комментарий", "comment"),
+    ("Статус", "status"),
+    ("Создана", "created_at"),
+    ("Истекает", "expires_at"),
+    ("Закрыта", "closed_at"),
+    ("Продлений", "extend_count"),
+]
+HISTORY_COLUMNS = [
+    ("ID", "id"),
+    ("Защита", "protection_id"),
+    ("Менеджер", "manager"),
+    ("Артикул", "sku"),
+    ("Когда", "at"),
+    ("Кто", "actor"),
+    ("Действие", "action"),
+    ("Данные", "payload"),
+]
+
+
+def _rows(sql: str, params: list, columns: list):
+    """Кортежи значений прямо из курсора, пачками по FETCH_CHUNK"""
+    conn = db.get_conn()
+    conn.row_factory = None   # обычные кортежи; _release вернёт sqlite3.Row
+    try:
+        cur = conn.execute(sql, params)
+        names = [d[0] for d in cur.description]
+        pick = itemgetter(*(names.index(key) for _, key in columns))
+        while True:
+            chunk = cur.fetchmany(FETCH_CHUNK)
+            if not chunk:
+                break
+            yield [pick(r) for r in chunk]
+    finally:
+        conn.close()
+
+
+class _Sink:
+    """Файлоподобный буфер: писатель пишет, генератор забирает накопленное"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        parts, self.parts = self.parts, []
+        return parts
+
+
+# --- CSV ---
+def csv_stream(sql: str, params: list, columns: list):
+    sink = _Sink()
+    writer = csv.writer(sink, delimiter=";", lineterminator="\r\n")
+    writer.writerow([title for title, _ in columns])
+    yield ("\ufeff" + "".join(sink.take())).encode("utf-8")
+    for chunk in _rows(sql, params, columns):
+        writer.writerows(chunk)
+        yield "".join(sink.take()).encode("utf-8")
+
+
+# --- XLSX ---
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf/></cellStyleXfs>
+<cellXfs count="2"><xf/><xf fontId="1" applyFont="1"/></cellXfs>
+</styleSheet>"""
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/></sheetView></sheetViews>'
+    "<sheetData>"
+)
+_SHEET_TAIL = "</sheetData></worksheet>"
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _cell(value, style: str = "") -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c{style}><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xml_rows(rows, style: str = "") -> str:
+    return "".join("<row>" + "".join(_cell(v, style) for v in row) + "</row>" for row in rows)
+
+
+def xlsx_stream(sql: str, params: list, columns: list, sheet: str = "Лист1"):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=5) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet, {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _STYLES)
+        with zf.open("xl/worksheets/sheet1.xml", "w") as ws:
+            ws.write((_SHEET_HEAD + _xml_rows([[t for t, _ in columns]], ' s="1"')).encode("utf-8"))
+            left = XLSX_MAX_ROWS
+            for chunk in _rows(sql, params, columns):
+                chunk = chunk[:left]
+                left -= len(chunk)
+                ws.write(_xml_rows(chunk).encode("utf-8"))
+                yield b"".join(sink.take())
+                if not left:
+                    break
+            ws.write(_SHEET_TAIL.encode("utf-8"))
+    yield b"".join(sink.take())
+
+
+def export_response_args(fmt: str, name: str) -> dict:
+    """media_type и заголовки StreamingResponse для выгрузки"""
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if fmt == "xlsx":
+        # xlsx уже сжат — GZipMiddleware его не трогает
+        headers["Content-Encoding"] = "identity"
+    return {"media_type": FORMATS[fmt], "headers": headers}
+
+
+def stream(fmt: str, sql: str, params: list, columns: list, sheet: str):
+    if fmt == "xlsx":
+        return xlsx_stream(sql, params, columns, sheet)
+    return csv_stream(sql, params, columns)
@@ -0,0 +1,109 @@
+from backend.db import now_iso
+from backend.managers import name_sql
+
+# === Очередь заявок на продление ===
+# Раньше заявки искались перебором history (action='extend_request') с
+# json.loads каждой записи, и обработанные никуда не девались. Теперь у
+# заявки своя строка со статусом pending → granted / denied, а список для
+# админа — выборка по индексу (status, requested_at) только открытых.
+# В history запись по-прежнему пишется — для журнала.
+#
+# Продление админом закрывает заявки защиты как granted. Если защита ушла из
+# active (успешная, закрыта, удалена, авто-закрыта), открытые заявки по ней
+# закрывает триггер — продлевать там уже нечего.
+
+
+def init_extend_requests(cur):
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='extend_requests'"
+    ).fetchone()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS extend_requests(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            protection_id INTEGER NOT NULL,
+            days INTEGER NOT NULL,
+            reason TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            requested_at TEXT NOT NULL,
+            resolved_at TEXT,
+            resolved_by TEXT,
+            history_id INTEGER,
+            FOREIGN KEY(protection_id) REFERENCES protections(id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_extend_requests_status ON extend_requests(status, requested_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_extend_requests_protection ON extend_requests(protection_id, status)")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS extend_requests_close
+        AFTER UPDATE OF status ON protections
+        WHEN old.status = 'active' AND new.status != 'active' BEGIN
+            UPDATE extend_requests
+            SET status = 'denied', resolved_by = 'system',
+                resolved_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+            WHERE protection_id = new.id AND status = 'pending';
+        END
+    """)
+    if not exists:
+        migrate_from_history(cur)
+
+
+def migrate_from_history(cur):
+    """
+    Переносит старые заявки из history. Открытой остаётся только заявка по
+    активной защите, которую админ после неё не продлевал.
+    """
+    cur.execute("""
+        INSERT INTO extend_requests(protection_id, days, reason, status, requested_at, resolved_at, resolved_by, history_id)
+        SELECT h.protection_id,
+               IFNULL(CAST(json_extract(h.payload, '$.days') AS INTEGER), 0),
+               IFNULL(json_extract(h.payload, '$.reason'), '—'),
+               CASE
+                   WHEN g.at IS NOT NULL THEN 'granted'
+                   WHEN p.status = 'active' THEN 'pending'
+                   ELSE 'denied'
+               END,
+               h.at,
+               CASE WHEN g.at IS NOT NULL THEN g.at WHEN p.status = 'active' THEN NULL ELSE p.closed_at END,
+               CASE WHEN g.at IS NOT NULL THEN 'admin' WHEN p.status = 'active' THEN NULL ELSE 'system' END,
+               h.id
+        FROM history h
+        JOIN protections p ON p.id = h.protection_id
+        LEFT JOIN history g ON g.id = (
+            SELECT MIN(x.id) FROM history x
+            WHERE x.protection_id = h.protection_id AND x.action = 'extend'
+              AND x.actor = 'admin' AND x.id > h.id
+        )
+        WHERE h.action = 'extend_request'
+        ORDER BY h.id
+    """)
+
+
+def add_request(cur, pid: int, days: int, reason: str, history_id: int) -> int:
+    cur.execute(
+        "INSERT INTO extend_requests(protection_id, days, reason, requested_at, history_id) VALUES (?,?,?,?,?)",
+        (pid, days, reason, now_iso(), history_id),
+    )
+    return cur.lastrowid
+
+
+def resolve_requests(cur, pid: int, status: str, actor: str) -> int:
+    """Закрывает открытые заявки защиты; возвращает, сколько закрыто"""
+    cur.execute(
+        "UPDATE extend_requests SET status=?, resolved_at=?, resolved_by=? "
+        "WHERE protection_id=? AND status='pending'",
+        (status, now_iso(), actor, pid),
+    )
+    return cur.rowcount
+
+
+def open_requests(cur) -> list:
+    return cur.execute(
+        f"""
+        SELECT r.id, r.history_id, r.protection_id, r.requested_at, r.days, r.reason,
+               {name_sql('p.')} AS manager, p.partner, p.sku, p.expires_at
+        FROM extend_requests r
+        JOIN protections p ON p.id = r.protection_id
+        WHERE r.status = 'pending'
+        ORDER BY r.requested_at DESC
+        """
+    ).fetchall()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import time
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from backend.db import get_conn, run_db
+from backend.writer import WRITER
+
+# === Ключи идемпотентности (заголовок Idempotency-Key) ===
+# WebApp в мобильной сети повторяет POST, не дождавшись ответа. Без ключа
+# повтор создания — вторая защита или 409 от проверки дублей, повтор
+# продления — ещё +N дней. С ключом изменение выполняется один раз: его
+# результат пишется в idempotency_keys той же транзакцией писателя, что и
+# само изменение, а повтор с тем же ключом получает сохранённый ответ и
+# ничего не выполняет. Два одновременных повтора тоже не проходят оба:
+# второй перепроверяет ключ уже внутри писателя.
+# Хранятся только выполненные изменения — после 4xx повтор выполнится
+# заново. Ключ с другим запросом (маршрут, id, тело) — 422.
+# Записи старше TTL_SECONDS не действуют и удаляются при очередной записи.
+
+TTL_SECONDS = 24 * 3600
+PURGE_EVERY = 600      # не чаще, чем раз в 10 минут
+MAX_KEY_LENGTH = 255
+
+_purged_at = 0.0
+
+
+def init_idempotency(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys(
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_ts INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_ts)")
+
+
+def fingerprint(route: str, *parts) -> str:
+    """Отпечаток запроса: тот же ключ с другим запросом — ошибка клиента, а не повтор"""
+    raw = json.dumps([route, *jsonable_encoder(parts)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _lookup(cur, key: str, fp: str):
+    """(True, сохранённый ответ) или (False, None)"""
+    row = cur.execute(
+        "SELECT fingerprint, response FROM idempotency_keys WHERE key=? AND created_ts > ?",
+        (key, int(time.time()) - TTL_SECONDS),
+    ).fetchone()
+    if not row:
+        return False, None
+    if row[0] != fp:
+        raise HTTPException(status_code=422, detail="Idempotency-Key уже использован с другим запросом")
+    return True, json.loads(row[1])
+
+
+def _lookup_stored(key: str, fp: str):
+    conn = get_conn()
+    try:
+        return _lookup(conn.cursor(), key, fp)
+    finally:
+        conn.close()
+
+
+def _save(cur, key: str, fp: str, result):
+    global _purged_at
+    now = int(time.time())
+    if now - _purged_at >= PURGE_EVERY:
+        cur.execute("DELETE FROM idempotency_keys WHERE created_ts <= ?", (now - TTL_SECONDS,))
+        _purged_at = now
+    cur.execute(
+        "INSERT OR REPLACE INTO idempotency_keys(key, fingerprint, response, created_ts) VALUES (?,?,?,?)",
+        (key, fp, json.dumps(jsonable_encoder(result), ensure_ascii=False), now),
+    )
+
+
+def _once_tx(conn, key: str, fp: str, fn, *args):
+    cur = conn.cursor()
+    found, stored = _lookup(cur, key, fp)
+    if found:
+        return True, stored
+    result = fn(conn, *args)
+    _save(cur, key, fp, result)
+    return False, result
+
+
+async def run_once(key, fp: str, fn, *args):
+    """
+    WRITER.run(fn, *args) не больше одного раза на ключ. Возвращает
+    (replayed, result); при повторе result — сохранённый ответ в виде JSON
+    (dict вместо модели). Без ключа — просто WRITER.run.
+    """
+    if not key:
+        return False, await WRITER.run(fn, *args)
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key длиннее {MAX_KEY_LENGTH} символов")
+    # повтор уже выполненного — без очереди писателя
+    found, stored = await run_db(_lookup_stored, key, fp)
+    if found:
+        return True, stored
+    return await WRITER.run(_once_tx, key, fp, fn, *args)
@@ -0,0 +1,97 @@
+import re
+
+from backend.catalog import CATALOG
+from backend.dup_index import normalize_sku
+
+# === Артикулы защиты: protection_items ===
+# protections.sku — строка для людей ("4031 (замок) — 120 м²; 4032 (клей) —
+# 80 м²"). Для проверки дублей и аналитики каждый артикул лежит отдельной
+# строкой protection_items: нормализованный SKU, тип, коллекция из каталога
+# на момент записи и площадь под этим артикулом. area_m2 NULL — площадь одна
+# на несколько артикулов (формат " + "), она в protections.area_m2.
+# Строки пишут create_protection, update_protection, create_pending_protection
+# и импорт; существующие защиты разобраны из строки миграцией 3.
+
+_PART = re.compile(r"^(?P<sku>.*?)\s*(?:\((?P<type>[^()]*)\))?\s*(?:—\s*(?P<area>\d+(?:\.\d+)?)\s*м²)?$")
+
+
+def init_items(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS protection_items(
+            id INTEGER PRIMARY KEY,
+            protection_id INTEGER NOT NULL REFERENCES protections(id),
+            sku TEXT NOT NULL,
+            type TEXT NOT NULL DEFAULT '',
+            collection TEXT NOT NULL DEFAULT '',
+            area_m2 REAL
+        )
+    """)
+    # дубли: SKU и площадь ±10%; артикулы одной защиты — при правке и для индекса дублей
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_protection_items_sku_area ON protection_items(sku, area_m2)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_protection_items_protection ON protection_items(protection_id)")
+
+
+def _item(raw_sku: str, type_: str, area):
+    """(sku, type, collection, area_m2) или None, если артикула в строке нет"""
+    sku = normalize_sku(raw_sku)
+    if not any(ch.isalnum() for ch in sku):
+        return None
+    type_ = (type_ or "").strip().lower()
+    entries = CATALOG.get(sku)
+    entry = next((e for e in entries if e["type"] == type_), entries[0] if entries else None)
+    if entry:
+        type_ = type_ or entry["type"]
+    return sku, type_, entry["collection"] if entry else "", area
+
+
+def shape_items(skus_in: list, sku_display: str, total_area: float) -> list:
+    """Артикулы новой или отредактированной защиты (SkuItem из запроса или свободный текст)"""
+    if not skus_in:
+        item = _item(sku_display, "", total_area if total_area > 0 else None)
+        return [item] if item else []
+    per_sku = any(it.area is not None for it in skus_in)
+    shared = None if len(skus_in) > 1 else (total_area if total_area > 0 else None)
+    items = [_item(it.sku, it.type, float(it.area or 0) if per_sku else shared) for it in skus_in]
+    return [it for it in items if it]
+
+
+def parse_display(text: str, area_m2) -> list:
+    """Разбор старой строки protections.sku (для миграции)"""
+    text = (text or "").strip()
+    if "м²" in text or ";" in text:
+        parts = text.split(";")
+    else:
+        parts = text.split(" + ")
+    items = []
+    for part in parts:
+        m = _PART.match(part.strip())
+        if m.group("area") is not None:
+            area = float(m.group("area"))
+        elif len(parts) == 1 and area_m2:
+            area = float(area_m2)
+        else:
+            area = None
+        item = _item(m.group("sku"), m.group("type"), area)
+        if item:
+            items.append(item)
+    return items
+
+
+def dup_pairs(items: list, total_area: float) -> list:
+    """(SKU, площадь) для поиска дублей ±10%: общая площадь — каждому артикулу"""
+    pairs = []
+    for sku, _, _, area in items:
+        area = total_area if area is None else area
+        if area and area > 0:
+            pairs.append((sku, float(area)))
+    return pairs
+
+
+def write_items(cur, rows: list, replace: bool = True):
+    """rows — [(protection_id, items)]; прежние артикулы этих защит заменяются"""
+    if replace:
+        cur.executemany("DELETE FROM protection_items WHERE protection_id=?", [(pid,) for pid, _ in rows])
+    cur.executemany(
+        "INSERT INTO protection_items(protection_id, sku, type, collection, area_m2) VALUES (?,?,?,?,?)",
+        [(pid, *item) for pid, items in rows for item in items],
+    )
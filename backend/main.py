@@ -1,20 +1,48 @@
-from fastapi import FastAPI, HTTPException, Body, BackgroundTasks, Depends, Header, Request
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, StreamingResponse
+from fastapi import Query, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional, Literal
 from datetime import datetime
 from pathlib import Path
-from jose import jwt, JWTError
+from jose import jwt
 SECRET_KEY = "supersecretkey"  # потом можно вынести в .env
 ALGORITHM = "HS256"
-import asyncio, sqlite3, json, os, re, hashlib, hmac
+import asyncio, sqlite3, json, os, re, hashlib, hmac, tempfile, math, time
+from zipfile import BadZipFile
 
 # === Локальные модули ===
-from backend.db import get_conn, init_db, now_iso, add_days, load_skus
+from backend.db import get_conn, init_db, now_iso, add_days, run_db
 from backend.users import router as users_router, init_users_table
 from backend.auth import require_admin
+from backend.dup_index import DUP_INDEX, DuplicateIndex, normalize_sku
+from backend.catalog import CATALOG, SEARCH_LIMIT
+from backend.conditional import ConditionalGetMiddleware
+from backend.events import EVENTS, Subscriber, stage_protection_event
+from backend.search import init_search, fts_query
+from backend.stats import init_stats
+from backend.sync import SYNC_LIMIT, init_sync, changes_since, reset_sync
+from backend.serialize import WARN_TEXT, out_columns, encode_row
+from backend.migrations import run_migrations
+from backend.export import (
+    HISTORY_COLUMNS, PROTECTION_COLUMNS, export_response_args, stream as export_stream,
+)
+from backend.bulk_import import bulk_insert, iter_rows, detect_format
+from backend.extend_requests import init_extend_requests, add_request, resolve_requests, open_requests
+from backend.tg_outbox import OUTBOX, init_outbox, enqueue, esc
+from backend.expiry import EXPIRY
+from backend.recipients import RECIPIENTS
+from backend.managers import MANAGERS, filter_sql, link_account, manager_id_for, name_sql, register_manager
+from backend.items import init_items, dup_pairs, shape_items, write_items
+from backend.writer import WRITER
+from backend.idempotency import init_idempotency, fingerprint, run_once
+from backend.principal import PRINCIPALS, users_changed
+from backend.pagination import (
+    MAX_LIMIT, edge_clause, encode_cursor, keyset_clause, keyset_order, stream_json_array,
+)
 
 
 
@@ -25,11 +53,11 @@ DB_PATH = Path(__file__).resolve().parent / "data.sqlite3"
 def get_current_user(token: str = Header(None)):
     if not token:
         raise HTTPException(status_code=401, detail="Missing token")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return {"id": int(payload["sub"]), "role": payload.get("role", "manager")}
-    except JWTError:
+    # проверка JWT кэшируется, роль — текущая из users (backend/principal.py)
+    user = PRINCIPALS.resolve(token, SECRET_KEY, ALGORITHM)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return user
 
 def require_admin(user=Depends(get_current_user)):
     if user["role"] not in ("admin", "superadmin"):
@@ -44,22 +72,20 @@ def fmt_iso(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%dT%H:%M:%S")
 
 app = FastAPI(title="ProjectGuard Mini API", version="2.2")
-SKUS = load_skus()
 # === CORS настройки ===
 
 
 
 # ====== ADMIN: approve / reject pending protections ======
 
-@app.post("/api/admin/pending/{pid}/approve")
-def approve_pending(pid: int, user=Depends(require_admin)):
-    conn = get_conn()
+# изменения защит выполняет единственный писатель (backend/writer.py):
+# *_tx(conn, ...) — тело транзакции, обработчик ждёт её через WRITER.run
+def _approve_pending_tx(conn, pid: int):
     cur = conn.cursor()
     row = cur.execute(
         "SELECT * FROM protections WHERE id=? AND status='pending'", (pid,)
     ).fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Защита не найдена или уже обработана")
 
     cur.execute(
@@ -67,21 +93,23 @@ def approve_pending(pid: int, user=Depends(require_admin)):
         (now_iso(), pid),
     )
     add_history(cur, pid, "admin", "approve", {"approved": True})
-    conn.commit()
-    conn.close()
+    DUP_INDEX.sync(cur, pid)
+    conn.on_commit(lambda: EXPIRY.arm(pid, row["expires_at"]))
     return {"ok": True}
 
 
-@app.post("/api/admin/pending/{pid}/reject")
-def reject_pending(pid: int, payload: dict, user=Depends(require_admin)):
-    reason = payload.get("reason", "").strip() or "Отклонено администратором"
-    conn = get_conn()
+@app.post("/api/admin/pending/{pid}/approve")
+async def approve_pending(pid: int, user=Depends(require_admin), idempotency_key: Optional[str] = Header(None)):
+    fp = fingerprint("approve", pid)
+    return (await run_once(idempotency_key, fp, _approve_pending_tx, pid))[1]
+
+
+def _reject_pending_tx(conn, pid: int, reason: str):
     cur = conn.cursor()
     row = cur.execute(
         "SELECT * FROM protections WHERE id=? AND status='pending'", (pid,)
     ).fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Защита не найдена или уже обработана")
 
     cur.execute(
@@ -89,10 +117,22 @@ def reject_pending(pid: int, payload: dict, user=Depends(require_admin)):
         (reason, now_iso(), pid),
     )
     add_history(cur, pid, "admin", "reject", {"reason": reason})
-    conn.commit()
-    conn.close()
     return {"ok": True, "reason": reason}
 
+
+@app.post("/api/admin/pending/{pid}/reject")
+async def reject_pending(pid: int, payload: dict, user=Depends(require_admin),
+                         idempotency_key: Optional[str] = Header(None)):
+    reason = payload.get("reason", "").strip() or "Отклонено администратором"
+    fp = fingerprint("reject", pid, reason)
+    return (await run_once(idempotency_key, fp, _reject_pending_tx, pid, reason))[1]
+
+# ===== ETag/304 и сжатие =====
+# Добавляются раньше CORS, чтобы оказаться внутри него: 304 и gzip-ответы
+# тоже должны нести CORS-заголовки.
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # ===== CORS =====
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -106,6 +146,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
@@ -158,18 +199,35 @@ class ProtectionUpdate(BaseModel):
     manager: Optional[str] = None  # кто редактировал, можно не присылать
 
 
-@app.on_event("startup")
-def on_startup():
-    # 1. База и миграции
+def init_storage():
+    """База, миграции, служебные таблицы и индекс дублей — всё до приёма запросов"""
     init_db()
     init_users_table()
     _safe_migrate()
+    conn = get_conn()
+    init_search(conn.cursor())
+    init_stats(conn.cursor())
+    init_outbox(conn.cursor())
+    init_sync(conn.cursor())
+    init_extend_requests(conn.cursor())
+    init_items(conn.cursor())
+    init_idempotency(conn.cursor())
+    conn.commit()
+    DUP_INDEX.rebuild(conn.cursor())
+    conn.close()
+
+
+@app.on_event("startup")
+def on_startup():
+    # 1. База и миграции
+    init_storage()
 
-    # 2. Telegram бот
+    # 2. Telegram бот и очередь исходящих сообщений
     asyncio.get_event_loop().create_task(start_tg_bot())
+    asyncio.get_event_loop().create_task(OUTBOX.run(bot))
 
-    # 3. Проверка истекающих защит
-    asyncio.get_event_loop().create_task(check_expiring_protections())
+    # 3. Напоминания об истечении и авто-закрытие
+    asyncio.get_event_loop().create_task(EXPIRY.run())
 
     print("🚀 Startup: база и бот запущены, проверка защит активна")
 
@@ -180,46 +238,54 @@ def on_startup():
 def _safe_migrate():
     print("⚙️ Проверка структуры базы данных...")
 
+    conn = get_conn()  # одно соединение на все шаги миграции
+
     def exec_safe(sql):
         """Выполняет SQL и игнорирует 'duplicate column'"""
-        conn2 = get_conn()
-        cur2 = conn2.cursor()
         try:
-            cur2.execute(sql)
-            conn2.commit()
+            conn.execute(sql)
         except sqlite3.OperationalError as e:
             if "duplicate column" not in str(e):
                 print("⚠️", e)
-        finally:
-            conn2.close()
 
     # === Protections ===
     exec_safe("ALTER TABLE protections ADD COLUMN extend_count INTEGER DEFAULT 0")
     exec_safe("ALTER TABLE protections ADD COLUMN auto_closed INTEGER DEFAULT 0")
     exec_safe("ALTER TABLE protections ADD COLUMN updated_at TEXT")
+    exec_safe("ALTER TABLE protections ADD COLUMN reminder_sent_at TEXT")
+    exec_safe("ALTER TABLE protections ADD COLUMN approved_by_admin BOOLEAN DEFAULT 0")
+    exec_safe("ALTER TABLE protections ADD COLUMN admin_comment TEXT DEFAULT ''")
+    exec_safe("ALTER TABLE protections ADD COLUMN manager_id INTEGER")
+    exec_safe("ALTER TABLE protections ADD COLUMN change_version INTEGER NOT NULL DEFAULT 0")
+    exec_safe("CREATE INDEX IF NOT EXISTS idx_protections_created ON protections(created_at, id)")
 
     # === Users ===
     exec_safe("ALTER TABLE users ADD COLUMN group_tag TEXT")
     exec_safe("ALTER TABLE users ADD COLUMN region TEXT")
+    exec_safe("ALTER TABLE users ADD COLUMN manager_id INTEGER")
 
         # === Managers ===
     exec_safe("ALTER TABLE managers ADD COLUMN telegrams TEXT DEFAULT '[]'")
 
     # === Managers ===
     exec_safe("ALTER TABLE managers ADD COLUMN telegrams TEXT DEFAULT '[]'")
+    exec_safe("ALTER TABLE managers ADD COLUMN user_id INTEGER")   # аккаунт менеджера, см. миграцию 4
 
-    print("✅ Авто-миграция базы завершена (extend_count, auto_closed, updated_at, users.extra)")
-
+    conn.commit()
+    # версионные миграции (backend/migrations.py) — после колонок, которые они копируют
+    version = run_migrations(conn)
+    conn.close()
+    print(f"✅ Авто-миграция базы завершена (extend_count, auto_closed, updated_at, users.extra), схема v{version}")
 
 
 def row_to_out(row) -> ProtectionOut:
-    expires = datetime.fromisoformat(row["expires_at"].replace("Z", ""))
-    days_left = (expires - datetime.utcnow()).days
+    # expires_ts — секунды Unix (backend/migrations.py); floor — как timedelta.days
+    days_left = math.floor((row["expires_ts"] - time.time()) / 86400)
     warn2d = row["status"] == "active" and days_left <= 2
-    warn_text = "⏰ Через 2 дня истекает — напомни менеджеру." if warn2d else None
+    warn_text = WARN_TEXT if warn2d else None
     return ProtectionOut(
         id=row["id"],
-        manager=row["manager"],
+        manager=MANAGERS.name(row),
         client=row["client"] or "",
         partner=row["partner"] or "",
         partner_city=row["partner_city"] or "",
@@ -239,19 +305,43 @@ def row_to_out(row) -> ProtectionOut:
         extend_count=row["extend_count"] if "extend_count" in row.keys() else 0,
     )
 
-def normalize_sku(raw: str) -> str:
-    return re.sub(r"[\(\)а-яА-Я\s]+", "", raw or "").strip()
+
+EVENTS.encode_row = lambda row: row_to_out(row).dict()
 
 def add_history(cur, protection_id: int, actor: str, action: str, payload: dict):
     cur.execute(
         "INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,?,?,?)",
         (protection_id, now_iso(), actor, action, json.dumps(payload, ensure_ascii=False)),
     )
+    # после commit изменение уйдёт в /api/events
+    stage_protection_event(cur.connection, protection_id, action, actor)
 
 # ===== Basic =====
 @app.get("/api/skus")
-def get_skus():
-    return SKUS
+async def get_skus(request: Request):
+    # готовый JSON/gzip из снимка каталога, клиент с актуальным ETag получает 304
+    snap = CATALOG.snapshot()
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = snap.etag_gzip if use_gzip else snap.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if snap.etag in if_none_match or snap.etag_gzip in if_none_match:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(snap.body_gzip, media_type="application/json", headers=headers)
+    return Response(snap.body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/skus/search")
+async def search_skus(
+    q: str = "",
+    collection: Optional[str] = None,
+    type: Optional[str] = None,
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=500),
+):
+    """Автодополнение артикула по префиксу, с фильтром по коллекции и типу"""
+    return CATALOG.search(q, collection=collection, type_=type, limit=limit)
 
 @app.get("/api/ping")
 def ping():
@@ -259,7 +349,6 @@ def ping():
 
 import hashlib, hmac
 from fastapi import Request
-from jose import jwt, JWTError
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8256079955:AAGrghwannJh_tub3Av460PRKLV0nGR_cc8")
 SECRET_KEY = os.getenv("SECRET_KEY", "Messiah_Secret_2025")
@@ -276,7 +365,8 @@ def verify_telegram_auth(data: dict) -> bool:
 
 # --- JWT токен ---
 def create_token(user_id: int, role: str):
-    return jwt.encode({"sub": str(user_id), "role": role}, SECRET_KEY, algorithm=ALGORITHM)
+    """sub — всегда users.id (см. backend/principal.py)"""
+    return jwt.encode({"sub": str(user_id), "kind": "id", "role": role}, SECRET_KEY, algorithm=ALGORITHM)
 
 
 # --- Авторизация через Telegram ---
@@ -290,7 +380,13 @@ async def telegram_auth(request: Request):
     username = data.get("username")
     first_name = data.get("first_name")
 
-    conn = get_conn()
+    role, user_id = await WRITER.run(_telegram_login_tx, tg_id, username, first_name)
+    token = create_token(user_id, role)
+    return {"ok": True, "role": role, "token": token}
+
+
+def _telegram_login_tx(conn, tg_id: int, username, first_name):
+    """Запись telegram_auth в транзакции писателя: (роль, users.id)"""
     cur = conn.cursor()
 
     # === Главный админ ===
@@ -299,11 +395,9 @@ async def telegram_auth(request: Request):
             "INSERT OR IGNORE INTO users (tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
             (tg_id, username, first_name, "superadmin", now_iso())
         )
-        conn.commit()
+        conn.on_commit(users_changed)
         user = cur.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
-        conn.close()
-        token = create_token(user["id"], "superadmin")
-        return {"ok": True, "role": "superadmin", "token": token}
+        return "superadmin", user["id"]
 
     # --- Остальные пользователи ---
     cur.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,))
@@ -313,16 +407,34 @@ async def telegram_auth(request: Request):
             "INSERT INTO users (tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
             (tg_id, username, first_name, "manager", now_iso())
         )
-        conn.commit()
+        user_id = cur.lastrowid
+        link_account(cur, first_name)   # менеджер с этим именем уже заведён админом
+        conn.on_commit(users_changed)
         role = "manager"
     else:
-        role = row["role"]
-    conn.close()
-
-    token = create_token(tg_id, role)
-    return {"ok": True, "role": role, "token": token}
+        role, user_id = row["role"], row["id"]
+    return role, user_id
 
 # ===== DEV-авторизация без проверки Telegram =====
+def _dev_login_tx(conn, tg_id: int, username: str, first_name: str, role: str):
+    cur = conn.cursor()
+    # создадим/обновим пользователя
+    cur.execute(
+        """
+        INSERT INTO users (tg_id, tg_username, first_name, role, created_at)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT(tg_id) DO UPDATE SET
+            tg_username=excluded.tg_username,
+            first_name=excluded.first_name,
+            role=excluded.role
+        """,
+        (tg_id, username, first_name, role, now_iso()),
+    )
+    link_account(cur, first_name)
+    conn.on_commit(users_changed)
+    return cur.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
+
+
 @app.post("/api/auth/dev-login")
 def dev_login(payload: dict):
     """
@@ -339,24 +451,7 @@ def dev_login(payload: dict):
     # если роль не передали — пусть будет manager
     role = payload.get("role") or "manager"
 
-    conn = get_conn()
-    cur = conn.cursor()
-    # создадим/обновим пользователя
-    cur.execute(
-        """
-        INSERT INTO users (tg_id, tg_username, first_name, role, created_at)
-        VALUES (?,?,?,?,?)
-        ON CONFLICT(tg_id) DO UPDATE SET
-            tg_username=excluded.tg_username,
-            first_name=excluded.first_name,
-            role=excluded.role
-        """,
-        (tg_id, username, first_name, role, now_iso()),
-    )
-    conn.commit()
-    user = cur.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
-    conn.close()
-
+    user = WRITER.call(_dev_login_tx, tg_id, username, first_name, role)
     token = create_token(user["id"], role)
     return {"ok": True, "token": token, "role": role, "user": dict(user)}
 
@@ -365,9 +460,11 @@ def dev_login(payload: dict):
 # ===== Managers CRUD =====
 class ManagerCreate(BaseModel):
     name: str
+    user_id: Optional[int] = None   # Telegram-аккаунт (users.id); нет — единственный тёзка-менеджер, см. link_account
 
 class ManagerUpdate(BaseModel):
-    name: str
+    name: Optional[str] = None
+    user_id: Optional[int] = None   # Telegram-аккаунт менеджера (users.id); 0 — отвязать
 
 @app.get("/api/admin/managers")
 def admin_list_managers(user=Depends(require_admin)):
@@ -376,21 +473,21 @@ def admin_list_managers(user=Depends(require_admin)):
     cur = conn.cursor()
     rows = cur.execute("""
         SELECT
-            m.id, m.name, m.telegrams,
+            m.id, m.name, m.telegrams, m.user_id,
             IFNULL(t.total,0) AS total,
             IFNULL(t.active,0) AS active,
             IFNULL(t.success,0) AS success,
             IFNULL(t.closed,0) AS closed
         FROM managers m
         LEFT JOIN (
-            SELECT manager,
-                   COUNT(*) AS total,
-                   SUM(CASE WHEN status='active' THEN 1 ELSE 0 END) AS active,
-                   SUM(CASE WHEN status='success' THEN 1 ELSE 0 END) AS success,
-                   SUM(CASE WHEN status='closed' THEN 1 ELSE 0 END) AS closed
-            FROM protections
-            GROUP BY manager
-        ) t ON t.manager = m.name
+            SELECT manager_id,
+                   SUM(cnt) AS total,
+                   SUM(CASE WHEN status='active' THEN cnt ELSE 0 END) AS active,
+                   SUM(CASE WHEN status='success' THEN cnt ELSE 0 END) AS success,
+                   SUM(CASE WHEN status='closed' THEN cnt ELSE 0 END) AS closed
+            FROM manager_stats
+            GROUP BY manager_id
+        ) t ON t.manager_id = m.id
         ORDER BY m.name COLLATE NOCASE
     """).fetchall()
 
@@ -405,6 +502,7 @@ def admin_list_managers(user=Depends(require_admin)):
         managers.append({
             "id": r["id"],
             "name": r["name"],
+            "user_id": r["user_id"],
             "total": r["total"],
             "active": r["active"],
             "success": r["success"],
@@ -415,67 +513,82 @@ def admin_list_managers(user=Depends(require_admin)):
     return managers
 
 
+def _add_manager_tx(conn, name: str, user_id):
+    cur = conn.cursor()
+    if user_id and not cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone():
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        cur.execute("INSERT INTO managers(name, created_at, user_id) VALUES (?,?,?)",
+                    (name, now_iso(), user_id or None))
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Менеджер с таким именем уже существует")
+    link_account(cur, name)
+    conn.on_commit(users_changed)
+
+
 @app.post("/api/admin/managers")
 def admin_add_manager(data: ManagerCreate, user=Depends(require_admin)):
     name = (data.name or "").strip()
     if not name:
         raise HTTPException(status_code=400, detail="Имя не может быть пустым")
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO managers(name, created_at) VALUES (?,?)", (name, now_iso()))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise HTTPException(status_code=409, detail="Менеджер с таким именем уже существует")
-    conn.close()
+    WRITER.call(_add_manager_tx, name, data.user_id)
     return {"ok": True}
 
+def _rename_manager_tx(conn, mid: int, new_name, user_id):
+    cur = conn.cursor()
+    if not cur.execute("SELECT 1 FROM managers WHERE id=?", (mid,)).fetchone():
+        raise HTTPException(status_code=404, detail="Manager not found")
+    if user_id and not cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone():
+        raise HTTPException(status_code=404, detail="User not found")
+    if new_name is not None:
+        exists = cur.execute("SELECT 1 FROM managers WHERE name=? AND id<>?", (new_name, mid)).fetchone()
+        if exists:
+            raise HTTPException(status_code=409, detail="Менеджер с таким именем уже существует")
+        # защиты ссылаются на manager_id — сами строки protections не меняются
+        cur.execute("UPDATE managers SET name=? WHERE id=?", (new_name, mid))
+        # но локальные копии клиентов (/api/protections/changes) держат старое имя
+        reset_sync(cur)
+        conn.on_commit(lambda: EVENTS.publish("resync", {"reason": "managers"}))  # новое имя у всех защит менеджера
+    if user_id is not None:
+        cur.execute("UPDATE managers SET user_id=? WHERE id=?", (user_id or None, mid))
+    conn.on_commit(users_changed)
+
+
 @app.patch("/api/admin/managers/{mid}")
 def admin_rename_manager(mid: int, data: ManagerUpdate, user=Depends(require_admin)):
-    new_name = (data.name or "").strip()
-    if not new_name:
+    """Переименование и/или привязка Telegram-аккаунта (получатель уведомлений, лента /api/events)"""
+    if data.name is None and data.user_id is None:
+        raise HTTPException(status_code=400, detail="Нужно передать name или user_id")
+    new_name = None if data.name is None else data.name.strip()
+    if new_name == "":
         raise HTTPException(status_code=400, detail="Имя не может быть пустым")
-    conn = get_conn()
-    cur = conn.cursor()
-    row = cur.execute("SELECT * FROM managers WHERE id=?", (mid,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Manager not found")
-    old_name = row["name"]
-    exists = cur.execute("SELECT 1 FROM managers WHERE name=? AND id<>?", (new_name, mid)).fetchone()
-    if exists:
-        conn.close()
-        raise HTTPException(status_code=409, detail="Менеджер с таким именем уже существует")
-    cur.execute("UPDATE managers SET name=? WHERE id=?", (new_name, mid))
-    cur.execute("UPDATE protections SET manager=? WHERE manager=?", (new_name, old_name))
-    conn.commit()
-    conn.close()
+    WRITER.call(_rename_manager_tx, mid, new_name, data.user_id)
     return {"ok": True}
 
-@app.delete("/api/admin/managers/{mid}")
-def admin_delete_manager(mid: int, transfer_to: Optional[int] = None, user=Depends(require_admin)):
-    conn = get_conn()
+
+def _delete_manager_tx(conn, mid: int, transfer_to: Optional[int]):
     cur = conn.cursor()
-    row = cur.execute("SELECT * FROM managers WHERE id=?", (mid,)).fetchone()
-    if not row:
-        conn.close()
+    if not cur.execute("SELECT 1 FROM managers WHERE id=?", (mid,)).fetchone():
         raise HTTPException(status_code=404, detail="Manager not found")
-    name = row["name"]
-    cnt = cur.execute("SELECT COUNT(*) AS c FROM protections WHERE manager=?", (name,)).fetchone()["c"] or 0
+    cnt = cur.execute("SELECT COUNT(*) AS c FROM protections WHERE manager_id=?", (mid,)).fetchone()["c"] or 0
     if cnt > 0:
         if not transfer_to:
-            conn.close()
             raise HTTPException(status_code=400, detail="Нужно выбрать менеджера для перевода всех защит")
         row_to = cur.execute("SELECT * FROM managers WHERE id=?", (transfer_to,)).fetchone()
         if not row_to:
-            conn.close()
             raise HTTPException(status_code=404, detail="transfer_to manager not found")
-        new_name = row_to["name"]
-        cur.execute("UPDATE protections SET manager=? WHERE manager=?", (new_name, name))
+        cur.execute(
+            "UPDATE protections SET manager_id=?, manager=? WHERE manager_id=?",
+            (transfer_to, row_to["name"], mid),
+        )
+        conn.on_commit(lambda: EVENTS.publish("resync", {"reason": "managers"}))
     cur.execute("DELETE FROM managers WHERE id=?", (mid,))
-    conn.commit()
-    conn.close()
+    conn.on_commit(users_changed)
+
+
+@app.delete("/api/admin/managers/{mid}")
+def admin_delete_manager(mid: int, transfer_to: Optional[int] = None, user=Depends(require_admin)):
+    WRITER.call(_delete_manager_tx, mid, transfer_to)
     return {"ok": True}
 
 
@@ -483,31 +596,31 @@ def admin_delete_manager(mid: int, transfer_to: Optional[int] = None, user=Depen
 
 
 # === Добавление пользователя (админка) ===
+def _create_user_tx(conn, user: dict):
+    cur = conn.cursor()
+
+    # tg_id обязателен, но мы можем подставить временный ноль
+    tg_id = user.get("tg_id") or 0
+
+    cur.execute("""
+        INSERT INTO users (tg_id, first_name, tg_username, group_tag, manager_id, region, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+    """, (
+        tg_id,
+        user.get("first_name"),
+        user.get("tg_username"),
+        user.get("group_tag"),
+        user.get("manager_id"),
+        user.get("region") or "Москва"
+    ))
+    conn.on_commit(users_changed)
+
+
 @app.post("/api/users/")
 def create_user(user: dict):
     try:
         print("📩 Новый пользователь:", user)
-        conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False)
-        cur = conn.cursor()
-
-        # tg_id обязателен, но мы можем подставить временный ноль
-        tg_id = user.get("tg_id") or 0
-
-        cur.execute("""
-            INSERT INTO users (tg_id, first_name, tg_username, group_tag, manager_id, region, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
-        """, (
-            tg_id,
-            user.get("first_name"),
-            user.get("tg_username"),
-            user.get("group_tag"),
-            user.get("manager_id"),
-            user.get("region") or "Москва"
-        ))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        WRITER.call(_create_user_tx, user)
         print("✅ Пользователь добавлен успешно")
         return {"detail": "Пользователь добавлен"}
 
@@ -553,51 +666,50 @@ def check_duplicate(data: dict):
     area_m2 = data.get("area_m2")
     if not sku_data:
         return []
-    cur.execute(
-        "SELECT id, manager, partner, sku, area_m2, expires_at, status FROM protections WHERE status = 'active'"
-    )
-    protections = cur.fetchall()
+    DUP_INDEX.ensure_loaded(cur)
     for item in sku_data:
         sku = item.get("sku")
         area = item.get("area") or area_m2
         if not sku or not area:
             continue
-        sku_norm = normalize_sku(sku)
-        for row in protections:
-            _, p_manager, p_partner, p_sku, p_area, p_expires, _ = row
-            if not p_area:
-                continue
-            if sku_norm != normalize_sku(p_sku):
-                continue
-            lower = float(p_area) * 0.9
-            upper = float(p_area) * 1.1
-            if lower <= float(area) <= upper:
-                results.append(
-                    {
-                        "manager": p_manager,
-                        "partner": p_partner,
-                        "sku": p_sku,
-                        "area_m2": p_area,
-                        "expires_at": p_expires,
-                    }
-                )
+        pids = sorted(DUP_INDEX.find_around(normalize_sku(sku), area))
+        if not pids:
+            continue
+        rows = cur.execute(
+            f"SELECT {name_sql()}, partner, sku, area_m2, expires_at FROM protections "
+            f"WHERE id IN ({','.join('?' * len(pids))}) ORDER BY id",
+            pids,
+        ).fetchall()
+        for p_manager, p_partner, p_sku, p_area, p_expires in rows:
+            results.append(
+                {
+                    "manager": p_manager,
+                    "partner": p_partner,
+                    "sku": p_sku,
+                    "area_m2": p_area,
+                    "expires_at": p_expires,
+                }
+            )
     conn.close()
     return results
 
-# === Утилита для сопоставления user_id с manager_id ===
-def resolve_manager_for_user(cur, user_id):
-    """Безопасно ищет менеджера по user_id, если требуется"""
-    if not user_id:
-        return None
-    row = cur.execute("SELECT id FROM users WHERE id=?", (user_id,)).fetchone()
-    return row["id"] if row else None
-
 # ===== Создание защиты =====
-@app.post("/api/protections", response_model=ProtectionOut)
-def create_protection(payload: ProtectionCreate):
-    conn = get_conn()
-    cur = conn.cursor()
-    created = now_iso()
+MIN_AREA_M2 = 50
+
+
+def owner_id(cur, name: str):
+    """managers.id владельца новой защиты; незаведённое имя — 400 (заводит админ)"""
+    manager_id = manager_id_for(cur, name)
+    if manager_id is None and (name or "").strip():
+        raise HTTPException(status_code=400, detail=f"Менеджер «{name.strip()}» не заведён")
+    return manager_id
+
+
+def protection_shape(payload, empty: str = "—") -> tuple:
+    """
+    (sku_display, суммарная площадь, артикулы для protection_items — backend/items.py)
+    по ProtectionCreate или ProtectionUpdate; empty — sku, если нет ни sku_data, ни sku.
+    """
     skus_in: List[SkuItem] = payload.sku_data or []
     has_per_sku_areas = any((it.area is not None) for it in skus_in)
 
@@ -618,83 +730,68 @@ def create_protection(payload: ProtectionCreate):
             parts = [f"{it.sku} ({it.type})" for it in skus_in]
             sku_display = " + ".join(parts)
     else:
-        sku_display = (payload.sku or (skus_in[0].sku if skus_in else "—")).strip()
+        sku_display = (payload.sku or empty).strip()
         total_area = float(payload.area_m2) if payload.area_m2 else 0.0
 
+    return sku_display, total_area, shape_items(skus_in, sku_display, total_area)
+
+
+def ttl_days_for(total_area: float) -> int:
+    """TTL по суммарной площади"""
+    if total_area < 100:
+        return 5
+    if total_area < 250:
+        return 10
+    if total_area < 500:
+        return 15
+    return 30
+
+
+def _create_protection_tx(conn, payload: ProtectionCreate) -> ProtectionOut:
+    cur = conn.cursor()
+    created = now_iso()
+    sku_display, total_area, items = protection_shape(payload)
+
     # ⛔ минимум 50 м²
-    if total_area < 50:
-        conn.close()
+    if total_area < MIN_AREA_M2:
         raise HTTPException(
             status_code=400,
             detail="⚠️ Защита ставится от 50 м²"
         )
 
     # === ПРОВЕРКА ДУБЛЕЙ по SKU и метражу ±10% (без учёта партнёра) ===
-    pairs = []
-    if skus_in:
-        if has_per_sku_areas:
-            for it in skus_in:
-                if it.area and it.area > 0:
-                    pairs.append((normalize_sku(it.sku), float(it.area)))
-        else:
-            for it in skus_in:
-                pairs.append((normalize_sku(it.sku), total_area))
-    else:
-        if sku_display and total_area > 0:
-            pairs.append((normalize_sku(sku_display), total_area))
-
-    cur.execute("""
-        SELECT manager, partner, sku, area_m2, expires_at
-        FROM protections
-        WHERE status='active'
-    """)
-    active_rows = cur.fetchall()
-
-    for sku_code, area_x in pairs:
+    # внутри транзакции писателя: между проверкой и INSERT никто не вставит такую же
+    DUP_INDEX.ensure_loaded(cur)
+    for sku_code, area_x in dup_pairs(items, total_area):
         if not sku_code or area_x <= 0:
             continue
-        min_a = area_x * 0.9
-        max_a = area_x * 1.1
-        for row in active_rows:
-            if not row["area_m2"]:
-                continue
-            if normalize_sku(row["sku"]) != sku_code:
-                continue
-            if min_a <= float(row["area_m2"]) <= max_a:
-                conn.close()
-                raise HTTPException(
-                    status_code=409,
-                    detail={
-                        "msg": (
-                            "⚠️ Похожая активная защита уже существует:\n"
-                            f"👤 Менеджер: {row['manager']}\n"
-                            f"🏢 Партнёр: {row['partner'] or '—'}\n"
-                            f"❗️Артикул: {row['sku']}\n"
-                            f"📏 Метраж: {int(row['area_m2']) if float(row['area_m2']).is_integer() else row['area_m2']} м²\n"
-                            f"⏰ Истекает: {row['expires_at']}\n\n"
-                            "💬 Обратись к коллеге, прежде чем ставить новую защиту."
-                        )
-                    }
-                )
-
-    # ===== TTL по суммарной площади =====
-    ttl_days = 5
-    if total_area > 0:
-        if total_area < 100:
-            ttl_days = 5
-        elif total_area < 250:
-            ttl_days = 10
-        elif total_area < 500:
-            ttl_days = 15
-        else:
-            ttl_days = 30
+        pids = DUP_INDEX.find_in_range(sku_code, area_x * 0.9, area_x * 1.1)
+        if pids:
+            row = cur.execute(
+                f"SELECT {name_sql()} AS manager, partner, sku, area_m2, expires_at FROM protections WHERE id=?",
+                (min(pids),),
+            ).fetchone()
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "msg": (
+                        "⚠️ Похожая активная защита уже существует:\n"
+                        f"👤 Менеджер: {row['manager']}\n"
+                        f"🏢 Партнёр: {row['partner'] or '—'}\n"
+                        f"❗️Артикул: {row['sku']}\n"
+                        f"📏 Метраж: {int(row['area_m2']) if float(row['area_m2']).is_integer() else row['area_m2']} м²\n"
+                        f"⏰ Истекает: {row['expires_at']}\n\n"
+                        "💬 Обратись к коллеге, прежде чем ставить новую защиту."
+                    )
+                }
+            )
 
+    ttl_days = ttl_days_for(total_area)
     expires = add_days(created, ttl_days)
 
-    # 🆕 Определяем менеджера для защиты через users → manager_id
-    manager_id = resolve_manager_for_user(cur, getattr(payload, "user_id", None))
+    # владелец — managers.id по имени (backend/managers.py)
+    manager_id = owner_id(cur, payload.manager)
 
-    # 🆕 Вставляем новую защиту с manager_id
     cur.execute("""
         INSERT INTO protections(
             manager, client, partner, partner_city, sku, area_m2, last4,
@@ -718,23 +815,231 @@ def create_protection(payload: ProtectionCreate):
     ))
 
     new_id = cur.lastrowid
+    write_items(cur, [(new_id, items)], replace=False)
     add_history(cur, new_id, "manager", "create", {"sku": sku_display, "area_m2": total_area})
-    conn.commit()
+    # следующая проверка дублей в этой же группе уже видит новую защиту
+    DUP_INDEX.sync(cur, new_id)
+    conn.on_commit(lambda: EXPIRY.arm(new_id, expires))
+    row = cur.execute("SELECT * FROM protections WHERE id=?", (new_id,)).fetchone()
+    return row_to_out(row)
+
+
+@app.post("/api/protections", response_model=ProtectionOut)
+async def create_protection(payload: ProtectionCreate, idempotency_key: Optional[str] = Header(None)):
+    # повтор с тем же Idempotency-Key — сохранённый ответ, без проверки дублей и уведомления
+    replayed, out = await run_once(idempotency_key, fingerprint("create", payload), _create_protection_tx, payload)
+    if replayed:
+        return out
 
     # если защита "на проверке" — уведомляем админа
-    row = cur.execute("SELECT * FROM protections WHERE id=?", (new_id,)).fetchone()
-    if row["status"] == "pending":
+    if out.status == "pending":
         try:
-            asyncio.create_task(notify_admin_new_protection(row_to_out(row).dict()))
+            asyncio.create_task(notify_admin_new_protection(out.dict()))
         except Exception as e:
             print(f"⚠️ Ошибка при отправке уведомления админу: {e}")
+    return out
+
+
+# ===== Массовый импорт (POST /api/admin/import, python -m backend.bulk_import) =====
+# Те же правила, что у create_protection: ProtectionCreate, минимум 50 м²,
+# дубли ±10% по SKU, TTL по площади. Дубли ищутся и среди активных защит в
+# базе, и среди уже принятых строк самого файла. Запись — пачками по
+# IMPORT_BATCH строк: executemany в protections и history, один commit.
+IMPORT_BATCH = 5000
+IMPORT_SPOOL_BYTES = 16 * 1024 * 1024   # больше — тело запроса уходит во временный файл
+
+
+def _validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+def _active_duplicate(pairs):
+    """Наименьший id активной защиты ±10% по одной из пар (SKU, площадь) или None"""
+    for sku_code, area_x in pairs:
+        if not sku_code or area_x <= 0:
+            continue
+        pids = DUP_INDEX.find_in_range(sku_code, area_x * 0.9, area_x * 1.1)
+        if pids:
+            return min(pids)
+    return None
+
+
+def _insert_import_batch_tx(conn, batch: list, actor: str) -> list:
+    """
+    Пишет пачку в транзакции писателя; возвращает для каждой строки batch
+    (id, None) или (None, id похожей активной защиты).
+    """
+    cur = conn.cursor()
+    # проверка при разборе файла шла вне писателя: пока пачка копилась,
+    # такую же защиту мог создать обычный запрос — перепроверяем здесь
+    DUP_INDEX.ensure_loaded(cur)
+    result = [(None, _active_duplicate(item["pairs"])) for item in batch]
+    batch = [item for item, (_, dup) in zip(batch, result) if dup is None]
+    if not batch:
+        return result
+    # писатель один: новые id — только наши и подряд
+    # импорт — админский путь: незнакомые имена заводятся в managers
+    manager_ids = {name: register_manager(cur, name) for name in {item["values"][0] for item in batch}}
+    ids = bulk_insert(cur, """
+        INSERT INTO protections(
+            manager, client, partner, partner_city, sku, area_m2, last4,
+            object_city, address, comment, status, created_at, expires_at, closed_at,
+            extend_count, auto_closed, manager_id
+        ) VALUES (?,?,?,?,?,?,?,?,?,?, 'active', ?, ?, NULL, 0, 0, ?)
+    """, [(*item["values"], manager_ids[item["values"][0]]) for item in batch])
+    write_items(cur, [(pid, item["items"]) for pid, item in zip(ids, batch)], replace=False)
+    cur.executemany(
+        "INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,?,?,?)",
+        [
+            (pid, item["values"][10], actor, "import",
+             json.dumps({"sku": item["values"][4], "area_m2": item["values"][5], "row": item["row"]}, ensure_ascii=False))
+            for pid, item in zip(ids, batch)
+        ],
+    )
+    DUP_INDEX.sync(cur, *ids)
+
+    def arm():
+        for pid, item in zip(ids, batch):
+            EXPIRY.arm(pid, item["values"][11])
+    conn.on_commit(arm)
+    fresh = iter(ids)
+    return [(next(fresh), None) if dup is None else (None, dup) for _, dup in result]
 
+
+def import_protections(rows, dry_run: bool = False, actor: str = "admin") -> dict:
+    """
+    rows — итератор (номер строки, поля ProtectionCreate). Возвращает отчёт
+    с итогами и статусом каждой строки: created / ok (dry_run) / duplicate / invalid.
+    """
+    conn = get_conn()
+    DUP_INDEX.ensure_loaded(conn.cursor())
     conn.close()
-    return row_to_out(row)
+    seen = DuplicateIndex()   # уже принятые строки файла
+    report = {"total": 0, "created": 0, "duplicates": 0, "invalid": 0, "dry_run": dry_run, "rows": []}
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        if dry_run:
+            report["created"] += len(batch)
+            batch.clear()
+            return
+        for (pid, dup), item in zip(WRITER.call(_insert_import_batch_tx, batch, actor), batch):
+            if dup is None:
+                item["entry"]["id"] = pid
+                report["created"] += 1
+            else:
+                item["entry"].update(status="duplicate", duplicate_of=dup, error=f"похожая активная защита #{dup}")
+                report["duplicates"] += 1
+        batch.clear()
+
+    for line_no, fields in rows:
+        report["total"] += 1
+        entry = {"row": line_no}
+        report["rows"].append(entry)
+        try:
+            payload = ProtectionCreate(**fields)
+        except ValidationError as e:
+            entry.update(status="invalid", error=_validation_error(e))
+            report["invalid"] += 1
+            continue
+        sku_display, total_area, items = protection_shape(payload)
+        if total_area < MIN_AREA_M2:
+            entry.update(status="invalid", error="⚠️ Защита ставится от 50 м²")
+            report["invalid"] += 1
+            continue
+
+        duplicate = None
+        pairs = dup_pairs(items, total_area)
+        active = _active_duplicate(pairs)
+        if active is not None:
+            duplicate = {"duplicate_of": active, "error": f"похожая активная защита #{active}"}
+        else:
+            for sku_code, area_x in pairs:
+                if not sku_code or area_x <= 0:
+                    continue
+                lines = seen.find_in_range(sku_code, area_x * 0.9, area_x * 1.1)
+                if lines:
+                    line = min(lines)
+                    duplicate = {"duplicate_of_row": line, "error": f"повторяет строку {line} файла"}
+                    break
+        if duplicate:
+            entry.update(status="duplicate", **duplicate)
+            report["duplicates"] += 1
+            continue
+
+        seen.put(line_no, pairs)   # ключ — номер строки файла
+        created = now_iso()
+        entry["status"] = "ok" if dry_run else "created"
+        batch.append({
+            "row": line_no,
+            "entry": entry,
+            "items": items,
+            "pairs": pairs,
+            "values": (
+                (payload.manager or "").strip(),
+                (payload.client or "").strip(),
+                (payload.partner or "").strip(),
+                (payload.partner_city or "").strip(),
+                sku_display,
+                total_area,
+                (payload.last4 or "").strip(),
+                (payload.object_city or "").strip(),
+                (payload.address or "").strip(),
+                (payload.comment or "").strip(),
+                created,
+                add_days(created, ttl_days_for(total_area)),
+            ),
+        })
+        if len(batch) >= IMPORT_BATCH:
+            flush()
+    flush()
+    if report["created"] and not dry_run:
+        # тысячи отдельных событий никому не нужны — клиенты перечитают списки
+        EVENTS.publish("resync", {"reason": "import"})
+    return report
+
+
+@app.post("/api/admin/import")
+async def admin_import(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|xlsx)$"),
+    dry_run: bool = False,
+    user=Depends(require_admin),
+):
+    """Тело запроса — сам файл (CSV или XLSX), формат по сигнатуре, если не указан"""
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        fmt = format or detect_format(spool.read(4))
+        spool.seek(0)
+        try:
+            return await run_db(import_protections, iter_rows(spool, fmt), dry_run, "admin")
+        except (ValueError, UnicodeDecodeError, BadZipFile) as e:
+            raise HTTPException(status_code=400, detail=f"Не удалось прочитать файл: {e}")
+    finally:
+        spool.close()
 
     # === Обновление Telegram уведомлений менеджера ===
 from fastapi import Body
 
+def _update_manager_telegrams_tx(conn, manager_id: int, telegrams: str, user_id):
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM managers WHERE id = ?", (manager_id,))
+    if not cur.fetchone():
+        raise HTTPException(status_code=404, detail="Менеджер не найден")
+    if user_id and not cur.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone():
+        raise HTTPException(status_code=404, detail="User not found")
+
+    cur.execute("UPDATE managers SET telegrams = ? WHERE id = ?", (telegrams, manager_id))
+    if user_id is not None:
+        cur.execute("UPDATE managers SET user_id=? WHERE id=?", (user_id or None, manager_id))
+    conn.on_commit(users_changed)
+
+
 @app.put("/api/admin/managers/{manager_id}/telegrams")
 def update_manager_telegrams(manager_id: int, body: dict = Body(...)):
     import json
@@ -743,62 +1048,30 @@ def update_manager_telegrams(manager_id: int, body: dict = Body(...)):
     if not isinstance(telegrams, list):
         raise HTTPException(status_code=400, detail="Поле 'telegrams' должно быть списком")
 
-    conn = get_conn()   # ✅ вместо get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM managers WHERE id = ?", (manager_id,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Менеджер не найден")
-
-    cur.execute(
-        "UPDATE managers SET telegrams = ? WHERE id = ?",
-        (json.dumps(telegrams, ensure_ascii=False), manager_id)
-    )
-    conn.commit()
-    conn.close()
+    user_id = body.get("user_id")   # Telegram-аккаунт менеджера (users.id); 0 — отвязать
+    if user_id is not None and not isinstance(user_id, int):
+        raise HTTPException(status_code=400, detail="Поле 'user_id' должно быть числом")
 
+    WRITER.call(_update_manager_telegrams_tx, manager_id, json.dumps(telegrams, ensure_ascii=False), user_id)
     return {"message": "✅ Telegram-уведомления успешно обновлены", "telegrams": telegrams}
 
 
 # ===== Редактирование защиты =====
-@app.put("/api/protections/{pid}", response_model=ProtectionOut)
-def update_protection(pid: int, payload: ProtectionUpdate):
-    conn = get_conn()
+def _update_protection_tx(conn, pid: int, payload: ProtectionUpdate) -> ProtectionOut:
     cur = conn.cursor()
 
     # проверим, что защита есть и активна
     cur.execute("SELECT * FROM protections WHERE id = ?", (pid,))
     row = cur.fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Защита не найдена")
     if row["status"] != "active":
-        conn.close()
         raise HTTPException(status_code=400, detail="Редактировать можно только активные защиты")
 
     # === формируем sku и площадь ТАК ЖЕ, как при создании ===
-    skus_in: List[SkuItem] = payload.sku_data or []
-    has_per_sku_areas = any((it.area is not None) for it in skus_in)
-
-    if skus_in:
-        if has_per_sku_areas:
-            parts = []
-            total_area = 0.0
-            for it in skus_in:
-                a = float(it.area or 0)
-                total_area += a
-                parts.append(f"{it.sku} ({it.type}) — {int(a) if a.is_integer() else a} м²")
-            sku_display = "; ".join(parts)
-        else:
-            total_area = float(payload.area_m2 or 0)
-            parts = [f"{it.sku} ({it.type})" for it in skus_in]
-            sku_display = " + ".join(parts)
-    else:
-        sku_display = (payload.sku or "").strip()
-        total_area = float(payload.area_m2 or 0)
+    sku_display, total_area, items = protection_shape(payload, empty="")
 
-    # === обновляем запись ===
+    # === обновляем запись и её артикулы ===
     cur.execute(
         """
         UPDATE protections
@@ -807,6 +1080,7 @@ def update_protection(pid: int, payload: ProtectionUpdate):
         """,
         (sku_display, total_area, payload.comment or "", now_iso(), pid),
     )
+    write_items(cur, [(pid, items)])
 
     add_history(
         cur,
@@ -820,76 +1094,181 @@ def update_protection(pid: int, payload: ProtectionUpdate):
         },
     )
 
-    conn.commit()
+    DUP_INDEX.sync(cur, pid)
     cur.execute("SELECT * FROM protections WHERE id = ?", (pid,))
     updated = cur.fetchone()
-    conn.close()
-
     return row_to_out(updated)
 
-    
 
-    # === формируем sku и площадь ТАК ЖЕ, как при создании ===
-
-
-    # обновляем
-    cur.execute(
-        """
-        UPDATE protections
-        SET sku = ?, area_m2 = ?, comment = ?, updated_at = ?
-        WHERE id = ?
-        """,
-        (sku_display, total_area, payload.comment or "", now_iso(), pid),
-    )
-    add_history(
-        cur,
-        pid,
-        payload.manager or "system",
-        "edit",
-        {
-            "new_area": total_area,
-            "new_skus": sku_display,
-            "comment": payload.comment or "",
-        },
-    )
-    conn.commit()
-
-    cur.execute("SELECT * FROM protections WHERE id = ?", (pid,))
-    updated = cur.fetchone()
-    conn.close()
-    return row_to_out(updated)
+@app.put("/api/protections/{pid}", response_model=ProtectionOut)
+async def update_protection(pid: int, payload: ProtectionUpdate):
+    return await WRITER.run(_update_protection_tx, pid, payload)
 
 
 
 
 # ===== List / Actions / Stats =====
-@app.get("/api/protections", response_model=List[ProtectionOut])
-def list_protections(search: str = "", manager: str = "", status: str = ""):
-    sql = "SELECT * FROM protections WHERE 1=1"
+def protections_query(search: str = "", manager: str = "", status: str = "", columns: str = "p.*") -> tuple:
+    """SELECT с фильтрами списка защит: (sql без ORDER BY, params, order)"""
+    sql = f"SELECT {columns} FROM protections p"
     params: list = []
+    order = " ORDER BY p.created_at DESC"
+    match = fts_query(search)
+    # имя менеджера не в FTS (backend/managers.py) — его id ищем по справочнику
+    manager_ids = MANAGERS.matching(search) if search else []
+    by_manager = ",".join(str(int(mid)) for mid in manager_ids) or "NULL"
+    if match and not manager_ids:
+        # полнотекстовый индекс: сначала самые релевантные
+        sql += " JOIN protections_fts f ON f.rowid = p.id AND protections_fts MATCH ?"
+        params.append(match)
+        order = " ORDER BY f.rank, p.created_at DESC"
+    sql += " WHERE 1=1"
+    if match and manager_ids:
+        # строка совпала с именем менеджера: его защиты плюс совпадения по тексту
+        sql += (f" AND (p.manager_id IN ({by_manager})"
+                " OR p.id IN (SELECT rowid FROM protections_fts WHERE protections_fts MATCH ?))")
+        params.append(match)
     # по умолчанию скрываем deleted
     if not status:
-        sql += " AND status != 'deleted'"
-    if search:
+        sql += " AND p.status != 'deleted'"
+    if search and not match:
         s = f"%{search.lower()}%"
-        sql += """ AND (
-            LOWER(manager) LIKE ? OR LOWER(client) LIKE ? OR LOWER(partner) LIKE ? 
-            OR LOWER(partner_city) LIKE ? OR LOWER(sku) LIKE ? OR LOWER(last4) LIKE ? 
-            OR LOWER(object_city) LIKE ? OR LOWER(address) LIKE ?
+        sql += f""" AND (
+            p.manager_id IN ({by_manager}) OR LOWER(p.client) LIKE ? OR LOWER(p.partner) LIKE ? 
+            OR LOWER(p.partner_city) LIKE ? OR LOWER(p.sku) LIKE ? OR LOWER(p.last4) LIKE ? 
+            OR LOWER(p.object_city) LIKE ? OR LOWER(p.address) LIKE ?
         )"""
-        params += [s] * 8
+        params += [s] * 7
     if manager:
-        sql += " AND manager = ?"
+        sql += " AND " + filter_sql("p.")
         params.append(manager)
     if status:
-        sql += " AND status = ?"
+        sql += " AND p.status = ?"
         params.append(status)
-    sql += " ORDER BY created_at DESC"
+    return sql, params, order
+
+
+@app.get("/api/protections", response_model=List[ProtectionOut])
+def list_protections(
+    search: str = "",
+    manager: str = "",
+    status: str = "",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    """
+    Без limit/cursor — как раньше, весь список.
+    С limit — страница по (created_at, id), курсор следующей в X-Next-Cursor.
+    stream=1 — строки пишутся в ответ прямо с курсора SQLite (с limit — тоже с X-Next-Cursor).
+    """
+    paged = limit is not None or cursor is not None
+    # колонки под encode_row: days_left уже посчитан в SQL, ProtectionOut не строится
+    sql, params, order = protections_query(search, manager, status, columns=out_columns("p."))
+    if paged:
+        # постранично всегда по (created_at, id), иначе курсор не стабилен
+        clause, cparams = keyset_clause(cursor, "p.")
+        sql += clause
+        params += cparams
+        order = keyset_order("p.")
+
+    if stream:
+        headers = {}
+        if limit is not None:
+            # заголовки уходят раньше тела — край страницы ищем заранее и режем поток по нему:
+            # защита, добавленная между запросами, попадёт в эту страницу, а не выпадет из обеих
+            edge_sql, edge_params, _ = protections_query(search, manager, status, columns="p.created_at, p.id")
+            conn = get_conn()
+            edge = conn.execute(edge_sql + clause + order + " LIMIT 2 OFFSET ?",
+                                [*edge_params, *cparams, limit - 1]).fetchall()
+            conn.close()
+            if len(edge) == 2:
+                eclause, eparams = edge_clause(edge[0]["created_at"], edge[0]["id"], "p.")
+                sql += eclause
+                params += eparams
+                headers["X-Next-Cursor"] = encode_cursor(edge[0]["created_at"], edge[0]["id"])
+        return StreamingResponse(
+            stream_json_array(sql + order, params, encode_row),
+            media_type="application/json",
+            headers=headers,
+        )
+
+    sql += order
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
 
     conn = get_conn()
     rows = conn.cursor().execute(sql, params).fetchall()
     conn.close()
-    return [row_to_out(r) for r in rows]
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    # готовый Response: FastAPI не прогоняет список через List[ProtectionOut] второй раз
+    return ORJSONResponse([encode_row(r) for r in rows], headers=headers)
+
+@app.get("/api/protections/changes")
+def protection_changes(
+    since: str = "",
+    manager: str = "",
+    limit: int = Query(SYNC_LIMIT, ge=1, le=MAX_LIMIT),
+):
+    """
+    Дельта для клиента с локальной копией: что изменилось после токена since.
+    Без since (или с чужим токеном) — всё с нуля и reset=true. Пока has_more,
+    запрашивать дальше с новым token.
+    """
+    conn = get_conn()
+    res = changes_since(conn.cursor(), since, manager, limit, columns=out_columns())
+    conn.close()
+    res["items"] = [encode_row(r) for r in res.pop("rows")]
+    return ORJSONResponse(res)
+
+# --- выгрузка (кнопка «Экспорт» в App.jsx)
+@app.get("/api/export")
+def export_protections(
+    search: str = "",
+    manager: str = "",
+    status: str = "",
+    format: str = Query("xlsx", pattern="^(csv|xlsx)$"),
+):
+    """Те же фильтры, что у /api/protections; строки идут в ответ прямо с курсора"""
+    # out_columns — ради текущего имени менеджера (и "" вместо NULL, как в API)
+    sql, params, order = protections_query(search, manager, status, columns=out_columns("p."))
+    return StreamingResponse(
+        export_stream(format, sql + order, params, PROTECTION_COLUMNS, "Защиты"),
+        **export_response_args(format, "protections"),
+    )
+
+
+@app.get("/api/export/history")
+def export_history(
+    protection_id: Optional[int] = None,
+    manager: str = "",
+    action: str = "",
+    format: str = Query("xlsx", pattern="^(csv|xlsx)$"),
+):
+    sql = f"""
+        SELECT h.id, h.protection_id, {name_sql("p.")} AS manager, p.sku, h.at, h.actor, h.action, h.payload
+        FROM history h LEFT JOIN protections p ON p.id = h.protection_id
+        WHERE 1=1
+    """
+    params: list = []
+    if protection_id:
+        sql += " AND h.protection_id = ?"
+        params.append(protection_id)
+    if manager:
+        sql += " AND " + filter_sql("p.")
+        params.append(manager)
+    if action:
+        sql += " AND h.action = ?"
+        params.append(action)
+    sql += " ORDER BY h.id DESC"
+    return StreamingResponse(
+        export_stream(format, sql, params, HISTORY_COLUMNS, "История"),
+        **export_response_args(format, "history"),
+    )
 
 # --- история
 @app.get("/api/history")
@@ -898,12 +1277,12 @@ def history(protection_id: Optional[int] = None):
     cur = conn.cursor()
     if protection_id:
         rows = cur.execute(
-            "SELECT * FROM history WHERE protection_id=? ORDER BY at DESC",
+            "SELECT * FROM history WHERE protection_id=? ORDER BY at_ts DESC",
             (protection_id,),
         ).fetchall()
     else:
         rows = cur.execute(
-            "SELECT * FROM history ORDER BY at DESC LIMIT 500"
+            "SELECT * FROM history ORDER BY at_ts DESC LIMIT 500"
         ).fetchall()
     out = []
     for r in rows:
@@ -921,16 +1300,13 @@ def history(protection_id: Optional[int] = None):
     return out
 
 # --- продление
-@app.post("/api/protections/{pid}/extend", response_model=ProtectionOut)
-def extend(pid: int, days: int = 10, actor: Literal["manager", "admin"] = "manager"):
-    conn = get_conn()
+def _extend_tx(conn, pid: int, days: int, actor: str):
+    """Продлённая защита или None, если менеджер упёрся в лимит (отказ записан в history)"""
     cur = conn.cursor()
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Not found")
     if row["status"] not in ("active",):
-        conn.close()
         raise HTTPException(
             status_code=400, detail="Можно продлевать только активные защиты"
         )
@@ -938,6 +1314,7 @@ def extend(pid: int, days: int = 10, actor: Literal["manager", "admin"] = "manag
     # ограничение для менеджера: 2 раза
     extend_count = row["extend_count"] or 0
     if actor == "manager" and extend_count >= 2:
+        # исключение откатило бы и эту запись — 403 бросает обработчик
         add_history(
             cur,
             pid,
@@ -945,37 +1322,42 @@ def extend(pid: int, days: int = 10, actor: Literal["manager", "admin"] = "manag
             "extend_denied_limit",
             {"current_extend_count": extend_count},
         )
-        conn.commit()
-        conn.close()
-        raise HTTPException(
-            status_code=403,
-            detail={
-                "msg": "Превышен лимит продлений менеджером. Запросите у администратора.",
-                "needs_admin": True,
-            },
-        )
+        return None
 
     new_exp = add_days(row["expires_at"], days)
     new_count = extend_count + (1 if actor == "manager" else 0)
+    # новый срок — новое напоминание
     cur.execute(
-        "UPDATE protections SET expires_at=?, extend_count=? WHERE id=?",
+        "UPDATE protections SET expires_at=?, extend_count=?, reminder_sent_at=NULL WHERE id=?",
         (new_exp, new_count, pid),
     )
     add_history(cur, pid, actor, "extend", {"days": days})
-    conn.commit()
+    if actor == "admin":
+        resolve_requests(cur, pid, "granted", actor)
+    conn.on_commit(lambda: EXPIRY.arm(pid, new_exp))
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
-    conn.close()
     return row_to_out(row)
 
-@app.post("/api/protections/{pid}/request-extend")
-def request_extend(pid: int, data: dict = Body(...)):
-    days = data.get("days", 5)
-    reason = (data.get("reason") or "").strip()
-    conn = get_conn()
+
+@app.post("/api/protections/{pid}/extend", response_model=ProtectionOut)
+async def extend(pid: int, days: int = 10, actor: Literal["manager", "admin"] = "manager",
+                 idempotency_key: Optional[str] = Header(None)):
+    fp = fingerprint("extend", pid, days, actor)
+    _, out = await run_once(idempotency_key, fp, _extend_tx, pid, days, actor)
+    if out is None:
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "msg": "Превышен лимит продлений менеджером. Запросите у администратора.",
+                "needs_admin": True,
+            },
+        )
+    return out
+
+def _request_extend_tx(conn, pid: int, days, reason: str):
     cur = conn.cursor()
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Not found")
 
     if not reason:
@@ -988,121 +1370,263 @@ def request_extend(pid: int, data: dict = Body(...)):
         "extend_request",
         {"days": days, "reason": reason},
     )
-    conn.commit()
-    conn.close()
-    return {"ok": True}
+    rid = add_request(cur, pid, days, reason, cur.lastrowid)
+    return {"ok": True, "request_id": rid}
+
+
+@app.post("/api/protections/{pid}/request-extend")
+async def request_extend(pid: int, data: dict = Body(...)):
+    days = data.get("days", 5)
+    reason = (data.get("reason") or "").strip()
+    return await WRITER.run(_request_extend_tx, pid, days, reason)
 
 
 # --- успешная / закрытая / удаление
-@app.post("/api/protections/{pid}/success", response_model=ProtectionOut)
-def mark_success(pid: int, data: dict = Body(...)):
-    doc_1c = (data or {}).get("doc_1c", "").strip()
-    if not doc_1c:
-        raise HTTPException(
-            status_code=400, detail="Нужно указать номер документа из 1С"
-        )
-    conn = get_conn()
+def _finish_tx(conn, pid: int, status: str, action: str, payload: dict) -> ProtectionOut:
     cur = conn.cursor()
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Not found")
     cur.execute(
-        "UPDATE protections SET status='success', closed_at=? WHERE id=?",
-        (now_iso(), pid),
+        "UPDATE protections SET status=?, closed_at=? WHERE id=?",
+        (status, now_iso(), pid),
     )
-    add_history(cur, pid, "manager", "success", {"doc_1c": doc_1c})
-    conn.commit()
+    add_history(cur, pid, "manager", action, payload)
+    DUP_INDEX.sync(cur, pid)
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
-    conn.close()
     return row_to_out(row)
 
+
+@app.post("/api/protections/{pid}/success", response_model=ProtectionOut)
+async def mark_success(pid: int, data: dict = Body(...), idempotency_key: Optional[str] = Header(None)):
+    doc_1c = (data or {}).get("doc_1c", "").strip()
+    if not doc_1c:
+        raise HTTPException(
+            status_code=400, detail="Нужно указать номер документа из 1С"
+        )
+    fp = fingerprint("success", pid, doc_1c)
+    return (await run_once(idempotency_key, fp, _finish_tx, pid, "success", "success", {"doc_1c": doc_1c}))[1]
+
 @app.post("/api/protections/{pid}/close", response_model=ProtectionOut)
-def mark_closed(pid: int, data: dict = Body(...)):
+async def mark_closed(pid: int, data: dict = Body(...), idempotency_key: Optional[str] = Header(None)):
     reason = (data or {}).get("reason", "").strip()
     if not reason:
         raise HTTPException(
             status_code=400, detail="Нужно указать причину закрытия"
         )
-    conn = get_conn()
-    cur = conn.cursor()
-    row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Not found")
-    cur.execute(
-        "UPDATE protections SET status='closed', closed_at=? WHERE id=?",
-        (now_iso(), pid),
-    )
-    add_history(cur, pid, "manager", "close", {"reason": reason})
-    conn.commit()
-    row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
-    conn.close()
-    return row_to_out(row)
+    fp = fingerprint("close", pid, reason)
+    return (await run_once(idempotency_key, fp, _finish_tx, pid, "closed", "close", {"reason": reason}))[1]
 
 @app.delete("/api/protections/{pid}")
-def delete_protection(pid: int, reason: Optional[str] = None):
+async def delete_protection(pid: int, reason: Optional[str] = None):
     """
     Мягкое удаление: статус -> 'deleted' + запись в историю.
     Если причина не передана — запишем 'not provided', чтобы не ломать старый фронт.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Not found")
-    cur.execute(
-        "UPDATE protections SET status='deleted', closed_at=? WHERE id=?",
-        (now_iso(), pid),
-    )
-    add_history(cur, pid, "manager", "delete", {"reason": reason or "not provided"})
-    conn.commit()
-    conn.close()
+    await WRITER.run(_finish_tx, pid, "deleted", "delete", {"reason": reason or "not provided"})
     return {"ok": True}
 
 # --- админ: запросы на продление
 @app.get("/api/admin/extend-requests")
 def admin_extend_requests(user=Depends(require_admin)):
+    """Только открытые заявки (см. backend/extend_requests.py)"""
     conn = get_conn()
-    cur = conn.cursor()
-    rows = cur.execute(
-        """
-        SELECT h.id as hid, h.protection_id, h.at, h.payload,
-               p.manager, p.partner, p.sku, p.expires_at
-        FROM history h
-        JOIN protections p ON p.id = h.protection_id
-        WHERE h.action='extend_request'
-        ORDER BY h.at DESC
-        """
-    ).fetchall()
-    out = []  # 🟢 вот этой строки не хватало
-    for r in rows:
-        payload = json.loads(r["payload"] or "{}")
-        out.append(
-            {
-                "history_id": r["hid"],
-                "protection_id": r["protection_id"],
-                "requested_at": r["at"],
-                "days": payload.get("days", 0),
-                "reason": payload.get("reason", "—"),
-                "manager": r["manager"],
-                "partner": r["partner"],
-                "sku": r["sku"],
-                "expires_at": r["expires_at"],
-            }
-        )
+    rows = open_requests(conn.cursor())
     conn.close()
-    return out
+    return [
+        {
+            "id": r["id"],
+            "history_id": r["history_id"],
+            "protection_id": r["protection_id"],
+            "requested_at": r["requested_at"],
+            "days": r["days"],
+            "reason": r["reason"] or "—",
+            "manager": r["manager"],
+            "partner": r["partner"],
+            "sku": r["sku"],
+            "expires_at": r["expires_at"],
+        }
+        for r in rows
+    ]
 
 
+def _deny_extend_request_tx(conn, rid: int):
+    cur = conn.cursor()
+    row = cur.execute(
+        "SELECT protection_id FROM extend_requests WHERE id=? AND status='pending'", (rid,)
+    ).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Заявка не найдена или уже обработана")
+    resolve_requests(cur, row["protection_id"], "denied", "admin")
+    add_history(cur, row["protection_id"], "admin", "extend_denied", {"request_id": rid})
+    return {"ok": True}
+
+
+@app.post("/api/admin/extend-requests/{rid}/deny")
+async def admin_deny_extend_request(rid: int, user=Depends(require_admin)):
+    return await WRITER.run(_deny_extend_request_tx, rid)
+
 
 @app.post("/api/admin/protections/{pid}/extend-any", response_model=ProtectionOut)
-def admin_extend_any(pid: int, days: int = 10, user=Depends(require_admin)):
-    # админ без лимита
-    return extend(pid, days=days, actor="admin")
+async def admin_extend_any(pid: int, days: int = 10, user=Depends(require_admin)):
+    # админ без лимита; открытые заявки по защите закрываются как granted
+    return await extend(pid, days=days, actor="admin", idempotency_key=None)
+
+
+# ===== Пакетные действия админа (POST /api/admin/protections/batch) =====
+# Те же правила, что у approve_pending / reject_pending / admin_extend_any /
+# mark_closed / delete_protection, но на много защит сразу: одна транзакция,
+# history одним executemany, одно сводное сообщение в Telegram на получателя.
+# Элемент, который нельзя применить (нет защиты, не тот статус, нет причины),
+# получает ошибку в своём результате и ничего не меняет; остальные
+# применяются. Действия над одной защитой идут по порядку: approve, затем
+# extend в том же пакете работают.
+BATCH_MAX_ITEMS = 1000
+BATCH_TG_LINES = 30   # строк в сводке; остальное — «… и ещё N»
+
+class BatchItem(BaseModel):
+    id: int
+    action: Literal["approve", "reject", "extend", "close", "delete"]
+    params: dict = {}
+
+
+BATCH_DONE_TEXT = {
+    "approve": "✅ одобрена",
+    "reject": "🚫 отклонена",
+    "extend": "⏳ продлена",
+    "close": "🔒 закрыта",
+    "delete": "🗑 удалена",
+}
+
+
+def _batch_step(row: dict, item: BatchItem, now: str):
+    """
+    Проверяет действие над текущим состоянием защиты.
+    Возвращает (UPDATE sql, параметры, запись history) или бросает HTTPException.
+    """
+    action, params, pid = item.action, item.params or {}, item.id
+    if action == "approve":
+        if row["status"] != "pending":
+            raise HTTPException(status_code=409, detail="Защита не на проверке")
+        row.update(status="active")
+        return ("UPDATE protections SET status='active', approved_by_admin=1, updated_at=? WHERE id=?",
+                (now, pid), {"approved": True})
+    if action == "reject":
+        if row["status"] != "pending":
+            raise HTTPException(status_code=409, detail="Защита не на проверке")
+        reason = str(params.get("reason") or "").strip() or "Отклонено администратором"
+        row.update(status="deleted")
+        return ("UPDATE protections SET status='deleted', admin_comment=?, updated_at=? WHERE id=?",
+                (reason, now, pid), {"reason": reason})
+    if action == "extend":
+        if row["status"] != "active":
+            raise HTTPException(status_code=409, detail="Можно продлевать только активные защиты")
+        try:
+            days = int(params.get("days", 10))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="days — целое число")
+        if days <= 0:
+            raise HTTPException(status_code=400, detail="days должно быть больше нуля")
+        row.update(expires_at=add_days(row["expires_at"], days))
+        return ("UPDATE protections SET expires_at=?, reminder_sent_at=NULL WHERE id=?",
+                (row["expires_at"], pid), {"days": days})
+    if action == "close":
+        reason = str(params.get("reason") or "").strip()
+        if not reason:
+            raise HTTPException(status_code=400, detail="Нужно указать причину закрытия")
+        row.update(status="closed")
+        return ("UPDATE protections SET status='closed', closed_at=? WHERE id=?",
+                (now, pid), {"reason": reason})
+    # delete
+    row.update(status="deleted")
+    return ("UPDATE protections SET status='deleted', closed_at=? WHERE id=?",
+            (now, pid), {"reason": str(params.get("reason") or "").strip() or "not provided"})
+
+
+def _batch_messages(done: list) -> dict:
+    """{текст: [chat_id]} — одна сводка на получателя по всем его защитам из пакета"""
+    names = [MANAGERS.name(row) for _, row in done]
+    recipients = RECIPIENTS.for_managers({row["manager_id"] for _, row in done})
+    lines_by_chat = {}
+    for (item, row), name in zip(done, names):
+        line = f"#{item.id} {esc(row['sku'] or '—')} ({esc(name)}) — {BATCH_DONE_TEXT[item.action]}"
+        for chat_id in recipients[row["manager_id"]]:
+            lines_by_chat.setdefault(chat_id, []).append(line)
+    by_text = {}
+    for chat_id, lines in lines_by_chat.items():
+        text = f"🗂 <b>Изменения администратора</b> ({len(lines)}):\n" + "\n".join(lines[:BATCH_TG_LINES])
+        if len(lines) > BATCH_TG_LINES:
+            text += f"\n… и ещё {len(lines) - BATCH_TG_LINES}"
+        by_text.setdefault(text, []).append(chat_id)
+    return by_text
+
+
+def _apply_batch_tx(conn, items: List[BatchItem]) -> list:
+    cur = conn.cursor()
+    ids = list(dict.fromkeys(item.id for item in items))
+    marks = ",".join("?" * len(ids))
+    now = now_iso()
+    results, history, done = [], [], []
+    # транзакция писателя: между проверкой состояния и UPDATE никто не вклинится
+    rows = {r["id"]: dict(r) for r in cur.execute(f"SELECT * FROM protections WHERE id IN ({marks})", ids)}
+    for item in items:
+        result = {"id": item.id, "action": item.action}
+        results.append(result)
+        row = rows.get(item.id)
+        try:
+            if row is None:
+                raise HTTPException(status_code=404, detail="Not found")
+            sql, params, payload = _batch_step(row, item, now)
+        except HTTPException as e:
+            result.update(ok=False, status_code=e.status_code, error=e.detail)
+            continue
+        cur.execute(sql, params)
+        if item.action == "extend":
+            resolve_requests(cur, item.id, "granted", "admin")
+        history.append((item.id, now, "admin", item.action, json.dumps(payload, ensure_ascii=False)))
+        stage_protection_event(conn, item.id, item.action, "admin")
+        done.append((item, row))
+        result["ok"] = True
+    cur.executemany(
+        "INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,?,?,?)",
+        history,
+    )
+    for text, chat_ids in _batch_messages(done).items():
+        enqueue(cur, chat_ids, text)
+
+    changed = list(dict.fromkeys(item.id for item, _ in done))
+    fresh = {}
+    if changed:
+        marks = ",".join("?" * len(changed))
+        fresh = {r["id"]: r for r in cur.execute(f"SELECT * FROM protections WHERE id IN ({marks})", changed)}
+        DUP_INDEX.sync(cur, *changed)
+
+    def after_commit():
+        for pid in changed:
+            row = fresh[pid]
+            if row["status"] == "active":
+                EXPIRY.arm(pid, row["expires_at"])
+        if done:
+            OUTBOX.wake()
+    conn.on_commit(after_commit)
+    for result in results:
+        if result["ok"]:
+            result["protection"] = row_to_out(fresh[result["id"]])
+    return results
+
+
+@app.post("/api/admin/protections/batch")
+async def admin_batch(items: List[BatchItem] = Body(...), user=Depends(require_admin)):
+    if not items:
+        return {"results": [], "applied": 0, "failed": 0}
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Не больше {BATCH_MAX_ITEMS} действий за раз")
+    results = await WRITER.run(_apply_batch_tx, items)
+    applied = sum(1 for r in results if r["ok"])
+    return {"results": results, "applied": applied, "failed": len(results) - applied}
 
 # ===== Stats =====
+# Читаем из свёртки manager_stats (см. backend/stats.py), а не из protections
 @app.get("/api/stats")
 def stats():
     conn = get_conn()
@@ -1110,17 +1634,20 @@ def stats():
     rows = cur.execute(
         """
         SELECT 
-            manager,
-            COUNT(*) AS total,
-            SUM(CASE WHEN status='active' THEN 1 ELSE 0 END) AS active_cnt,
-            SUM(CASE WHEN status='success' THEN 1 ELSE 0 END) AS success_cnt,
-            SUM(CASE WHEN status='closed' THEN 1 ELSE 0 END) AS closed_cnt,
-            ROUND(SUM(CASE WHEN status='active' THEN area_m2 ELSE 0 END), 1) AS active_area,
-            ROUND(SUM(CASE WHEN status='success' THEN area_m2 ELSE 0 END), 1) AS success_area,
-            ROUND(SUM(CASE WHEN status='closed' THEN area_m2 ELSE 0 END), 1) AS closed_area
-        FROM protections
+            IFNULL(m.name, '') AS manager,
+            SUM(cnt) AS total,
+            SUM(CASE WHEN status='active' THEN cnt ELSE 0 END) AS active_cnt,
+            SUM(CASE WHEN status='success' THEN cnt ELSE 0 END) AS success_cnt,
+            SUM(CASE WHEN status='closed' THEN cnt ELSE 0 END) AS closed_cnt,
+            ROUND(SUM(CASE WHEN status='active' THEN area ELSE 0 END), 1) AS active_area,
+            ROUND(SUM(CASE WHEN status='success' THEN area ELSE 0 END), 1) AS success_area,
+            ROUND(SUM(CASE WHEN status='closed' THEN area ELSE 0 END), 1) AS closed_area
+        FROM manager_stats s
+        LEFT JOIN managers m ON m.id = s.manager_id
         WHERE status != 'deleted'
-        GROUP BY manager
+        GROUP BY s.manager_id
+        HAVING SUM(cnt) > 0
+        ORDER BY manager
         """
     ).fetchall()
     conn.close()
@@ -1144,25 +1671,123 @@ def stats():
             }
         )
     return out
+# ===== Спрос по артикулам и коллекциям =====
+# Из protection_items (backend/items.py) с каталогом skus.csv. area_m2 —
+# площадь, указанная под артикулом; shared_area_m2 — площадь защит, где она
+# одна на несколько артикулов (засчитывается каждому из них).
+def _demand(group: str, status: Optional[str], days: Optional[int]) -> list:
+    where, params = ["p.status != 'deleted'"], []
+    if status:
+        where.append("p.status = ?")
+        params.append(status)
+    if days:
+        where.append("p.created_ts >= CAST(strftime('%s', 'now') AS INTEGER) - ?")
+        params.append(days * 86400)
+    conn = get_conn()
+    rows = conn.execute(
+        f"""
+        SELECT
+            i.{group} AS key,
+            COUNT(DISTINCT i.protection_id) AS protections,
+            COUNT(DISTINCT CASE WHEN p.status='active' THEN i.protection_id END) AS active,
+            COUNT(DISTINCT CASE WHEN p.status='success' THEN i.protection_id END) AS success,
+            COUNT(DISTINCT i.sku) AS skus,
+            ROUND(IFNULL(SUM(i.area_m2), 0), 1) AS area_m2,
+            ROUND(IFNULL(SUM(CASE WHEN i.area_m2 IS NULL THEN p.area_m2 END), 0), 1) AS shared_area_m2
+        FROM protection_items i
+        JOIN protections p ON p.id = i.protection_id
+        WHERE {" AND ".join(where)}
+        GROUP BY i.{group}
+        ORDER BY protections DESC, key
+        """,
+        params,
+    ).fetchall()
+    conn.close()
+    return [
+        {
+            "protections": r["protections"],
+            "active": r["active"],
+            "success": r["success"],
+            "success_rate": round(r["success"] / r["protections"] * 100) if r["protections"] else 0,
+            "skus": r["skus"],
+            "area_m2": r["area_m2"],
+            "shared_area_m2": r["shared_area_m2"],
+            "key": r["key"],
+        }
+        for r in rows
+    ]
+
+
+@app.get("/api/admin/demand/skus")
+def demand_by_sku(
+    status: Optional[Literal["active", "success", "closed", "pending"]] = None,
+    days: Optional[int] = Query(None, ge=1),
+    limit: int = Query(100, ge=1, le=MAX_LIMIT),
+    user=Depends(require_admin),
+):
+    """Защиты и площадь по каждому артикулу; коллекции и тип — из каталога"""
+    out = []
+    for row in _demand("sku", status, days)[:limit]:
+        sku = row.pop("key")
+        row.pop("skus")
+        entries = CATALOG.get(sku)
+        out.append({
+            "sku": sku,
+            "in_catalog": bool(entries),
+            "collections": sorted({e["collection"] for e in entries}),
+            "types": sorted({e["type"] for e in entries}),
+            **row,
+        })
+    return out
+
+
+@app.get("/api/admin/demand/collections")
+def demand_by_collection(
+    status: Optional[Literal["active", "success", "closed", "pending"]] = None,
+    days: Optional[int] = Query(None, ge=1),
+    user=Depends(require_admin),
+):
+    """
+    Спрос по коллекциям каталога, включая коллекции без защит.
+    collection "" — артикулы, которых не было в каталоге на момент записи.
+    """
+    catalog_skus = {}
+    for it in CATALOG.items:
+        catalog_skus.setdefault(it["collection"], set()).add(it["sku"])
+    demand = {row.pop("key"): row for row in _demand("collection", status, days)}
+    empty = {"protections": 0, "active": 0, "success": 0, "success_rate": 0, "skus": 0,
+             "area_m2": 0, "shared_area_m2": 0}
+    return [
+        {"collection": name, "catalog_skus": len(catalog_skus.get(name, ())), **demand.get(name, empty)}
+        for name in dict.fromkeys([*demand, *catalog_skus])
+    ]
+
+
 # ====== Новый эндпоинт: список защит по менеджеру ======
 @app.get("/api/admin/manager-protections")
-def admin_manager_protections(manager_id: int, user=Depends(require_admin)):
+def admin_manager_protections(
+    manager_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    user=Depends(require_admin),
+):
     """
     Возвращает все защиты указанного менеджера.
     Пример: /api/admin/manager-protections?manager_id=3
+    С limit/cursor — постранично по (created_at, id), stream=1 — потоком.
     """
     conn = get_conn()
     cur = conn.cursor()
 
     # Проверяем, что менеджер существует
     manager_row = cur.execute("SELECT name FROM managers WHERE id=?", (manager_id,)).fetchone()
+    conn.close()
     if not manager_row:
-        conn.close()
         return []  # если менеджера нет — просто возвращаем пустой список
 
-    manager_name = manager_row["name"]
-
-    cur.execute("""
+    sql = """
         SELECT 
             id,
             partner,
@@ -1174,9 +1799,18 @@ def admin_manager_protections(manager_id: int, user=Depends(require_admin)):
             area_m2,
             status,
             expires_at,
-            comment
+            comment,
+            created_at
         FROM protections
-        WHERE manager = ?
+        WHERE manager_id = ?
+    """
+    params: list = [manager_id]
+    if limit is not None or cursor is not None:
+        clause, cparams = keyset_clause(cursor)
+        sql += clause + keyset_order()
+        params += cparams
+    else:
+        sql += """
         ORDER BY 
             CASE status 
                 WHEN 'active' THEN 1
@@ -1186,13 +1820,13 @@ def admin_manager_protections(manager_id: int, user=Depends(require_admin)):
                 ELSE 5
             END,
             id DESC
-    """, (manager_name,))
-
-    rows = cur.fetchall()
-    conn.close()
+        """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1 if not stream else limit)
 
-    protections = [
-        {
+    def to_dict(r):
+        return {
             "id": r["id"],
             "partner": r["partner"],
             "partner_city": r["partner_city"],
@@ -1205,37 +1839,26 @@ def admin_manager_protections(manager_id: int, user=Depends(require_admin)):
             "expires_at": r["expires_at"],
             "comment": r["comment"],
         }
-        for r in rows
-    ]
-    return protections
-from fastapi import BackgroundTasks
 
-@app.post("/api/protections/pending")
-def create_pending_protection(payload: ProtectionCreate = Body(...), background_tasks: BackgroundTasks = None):
+    if stream:
+        return StreamingResponse(stream_json_array(sql, params, to_dict), media_type="application/json")
+
     conn = get_conn()
+    rows = conn.cursor().execute(sql, params).fetchall()
+    conn.close()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+    return [to_dict(r) for r in rows]
+
+
+def _create_pending_tx(conn, payload: ProtectionCreate) -> int:
     cur = conn.cursor()
     created = now_iso()
 
     # === Формируем sku_display так же, как при обычном создании ===
-    skus_in: List[SkuItem] = payload.sku_data or []
-    has_per_sku_areas = any((it.area is not None) for it in skus_in)
-
-    if skus_in:
-        if has_per_sku_areas:
-            parts = []
-            total_area = 0.0
-            for it in skus_in:
-                a = float(it.area or 0)
-                total_area += a
-                parts.append(f"{it.sku} ({it.type}) — {int(a) if a.is_integer() else a} м²")
-            sku_display = "; ".join(parts)
-        else:
-            total_area = float(payload.area_m2 or 0)
-            parts = [f"{it.sku} ({it.type})" for it in skus_in]
-            sku_display = " + ".join(parts)
-    else:
-        sku_display = (payload.sku or "").strip()
-        total_area = float(payload.area_m2 or 0)
+    sku_display, total_area, items = protection_shape(payload, empty="")
 
     # === TTL ===
     ttl_days = 5
@@ -1244,12 +1867,13 @@ def create_pending_protection(payload: ProtectionCreate = Body(...), background_
     expires = add_days(created, ttl_days)
 
     # === Запись в базу ===
+    manager_id = owner_id(cur, payload.manager)
     cur.execute("""
         INSERT INTO protections(
             manager, client, partner, partner_city, sku, area_m2, last4,
             object_city, address, comment, status, created_at, expires_at,
-            closed_at, extend_count, auto_closed
-        ) VALUES (?,?,?,?,?,?,?,?,?,?, 'pending', ?, ?, NULL, 0, 0)
+            closed_at, extend_count, auto_closed, manager_id
+        ) VALUES (?,?,?,?,?,?,?,?,?,?, 'pending', ?, ?, NULL, 0, 0, ?)
     """, (
         (payload.manager or "").strip(),
         (payload.client or "").strip(),
@@ -1263,36 +1887,41 @@ def create_pending_protection(payload: ProtectionCreate = Body(...), background_
         (payload.comment or "отправлено админу").strip(),
         created,
         expires,
+        manager_id,
     ))
 
     new_id = cur.lastrowid
+    write_items(cur, [(new_id, items)], replace=False)
     add_history(cur, new_id, "manager", "create_pending", {"reason": payload.comment})
-    conn.commit()
-    conn.close()
 
-    # === Telegram уведомление админу ===
-    if background_tasks:
-        background_tasks.add_task(
-            notify_admin_new_protection,
-            {
-                "id": new_id,
-                "manager": payload.manager,
-                "partner": payload.partner,
-                "partner_city": payload.partner_city,
-                "sku": sku_display,  # ✅ теперь передаём нормализованный артикул
-                "area_m2": total_area,
-                "object_city": payload.object_city,
-                "address": payload.address,
-                "comment": payload.comment,
-            }
-        )
+    # === Telegram уведомление админу — в tg_outbox в той же транзакции ===
+    text, markup = _new_protection_message({
+        "id": new_id,
+        "manager": payload.manager,
+        "partner": payload.partner,
+        "partner_city": payload.partner_city,
+        "sku": sku_display,  # ✅ теперь передаём нормализованный артикул
+        "area_m2": total_area,
+        "object_city": payload.object_city,
+        "address": payload.address,
+        "comment": payload.comment,
+    })
+    enqueue(cur, get_tg_recipients_for_manager(cur, manager_id), text, new_id, markup)
+    conn.on_commit(OUTBOX.wake)
+    return new_id
+
+
+@app.post("/api/protections/pending")
+async def create_pending_protection(payload: ProtectionCreate = Body(...),
+                                    idempotency_key: Optional[str] = Header(None)):
+    fp = fingerprint("pending", payload)
+    replayed, new_id = await run_once(idempotency_key, fp, _create_pending_tx, payload)
+    if not replayed:
         print(f"📨 Уведомление о защите #{new_id} добавлено в очередь на отправку в Telegram.")
 
     return {"ok": True, "id": new_id, "msg": "✅ Защита отправлена админу на проверку"}
 
 # ===== USERS MANAGEMENT =====
-from fastapi import BackgroundTasks
-
 @app.get("/api/users")
 def get_users():
     conn = get_conn()
@@ -1307,10 +1936,13 @@ def get_users():
     return rows
 
 
+def _update_user_tx(conn, user_id: int, fields: list, values: list):
+    conn.execute(f"UPDATE users SET {', '.join(fields)} WHERE id = ?", [*values, user_id])
+    conn.on_commit(users_changed)
+
+
 @app.patch("/api/users/{user_id}")
 def update_user(user_id: int, data: dict):
-    conn = get_conn()
-    cur = conn.cursor()
     fields = []
     values = []
     for key in ["role", "group_tag", "manager_id"]:
@@ -1319,74 +1951,24 @@ def update_user(user_id: int, data: dict):
             values.append(data[key])
     if not fields:
         raise HTTPException(status_code=400, detail="Нет полей для обновления")
-    values.append(user_id)
-    cur.execute(f"UPDATE users SET {', '.join(fields)} WHERE id = ?", values)
-    conn.commit()
-    conn.close()
+    WRITER.call(_update_user_tx, user_id, fields, values)
     return {"ok": True}
 
 
+def _delete_user_tx(conn, user_id: int):
+    conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    conn.on_commit(users_changed)
+
+
 @app.delete("/api/users/{user_id}")
 def delete_user(user_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    WRITER.call(_delete_user_tx, user_id)
     return {"ok": True}
 
 from aiogram import Bot
 import asyncio
 from datetime import datetime, timedelta
 
-# === Проверка истекающих защит (ежедневно) ===
-async def check_expiring_protections():
-    while True:
-        try:
-            conn = get_conn()
-            cur = conn.cursor()
-            now = datetime.utcnow()
-            two_days = (now + timedelta(days=2)).isoformat()
-
-            rows = cur.execute("""
-                SELECT p.id, p.manager, p.sku, p.expires_at, u.tg_id, u.id AS user_id
-                FROM protections p
-                LEFT JOIN users u ON u.first_name = p.manager
-                WHERE p.status='active' AND p.expires_at <= ?
-            """, (two_days,)).fetchall()
-
-            for r in rows:
-                manager_name = r["manager"]
-                sku = r["sku"]
-                pid = r["id"]
-                expires_at = r["expires_at"]
-                tg_id = r["tg_id"]
-
-                # ищем помощников
-                assistants = cur.execute(
-                    "SELECT tg_id FROM users WHERE manager_id=? AND role='assistant'",
-                    (r["user_id"],)
-                ).fetchall()
-
-                msg = (
-                    f"⚠️ Защита #{pid} ({sku}) у менеджера {manager_name}\n"
-                    f"⏰ Истекает {expires_at[:10]} — осталось 2 дня!"
-                )
-
-                recipients = [tg_id] + [a["tg_id"] for a in assistants if a["tg_id"]]
-                for tid in recipients:
-                    try:
-                        await bot.send_message(tid, msg)
-                        print(f"📩 Напоминание отправлено {tid}")
-                    except Exception as e:
-                        print(f"⚠️ Ошибка отправки напоминания {tid}: {e}")
-
-            conn.close()
-        except Exception as e:
-            print("❌ Ошибка в проверке истекающих защит:", e)
-
-        await asyncio.sleep(24 * 60 * 60)  # раз в сутки
-
 # ===== TELEGRAM BOT (единая версия) =====
 import asyncio
 from aiogram import Bot, Dispatcher, types, F
@@ -1396,148 +1978,102 @@ BOT_TOKEN = "8256079955:AAGrghwannJh_tub3Av460PRKLV0nGR_cc8"  # ProjectGuard mai
 TG_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
 bot = Bot(token=BOT_TOKEN)
 
-bot = Bot(token=BOT_TOKEN)
+# TG_API_BASE — свой Bot API сервер (локальный или фейковый для тестов)
+TG_API_BASE = os.getenv("TG_API_BASE")
+if TG_API_BASE:
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TG_API_BASE)))
+else:
+    bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
 # ===== TG helpers (получатели и сохранение сообщений) =====
 
-def get_tg_recipients_for_manager(cur, manager_name: str) -> list[int]:
+def get_tg_recipients_for_manager(cur, manager_id) -> list[int]:
     """
-    Возвращает список tg_id:
-    - менеджер (users.role='manager' и first_name=manager_name)
-    - его ассистенты (users.role='assistant' и manager_id = id менеджера)
+    Возвращает список tg_id по managers.id защиты:
+    - аккаунт менеджера (managers.user_id)
+    - его ассистенты (users.role='assistant' и manager_id = этот users.id)
     - админы той же группы (если у менеджера есть group_tag)
+    - супер-админы
+    Берётся из графа в памяти (backend/recipients.py), в базу не ходит.
     """
-    tg_ids: list[int] = []
+    return RECIPIENTS.for_manager(manager_id)
 
-    # найдём самого менеджера
-    mgr = cur.execute(
-        "SELECT id, tg_id, group_tag FROM users WHERE role='manager' AND first_name=?",
-        (manager_name,)
-    ).fetchone()
-
-    group_tag = None
-    if mgr:
-        if mgr["tg_id"]:
-            tg_ids.append(mgr["tg_id"])
-        group_tag = mgr["group_tag"]
-
-        # ассистенты этого менеджера
-        assistants = cur.execute(
-            "SELECT tg_id FROM users WHERE role='assistant' AND manager_id=?",
-            (mgr["id"],)
-        ).fetchall()
-        for a in assistants:
-            if a["tg_id"]:
-                tg_ids.append(a["tg_id"])
-
-    # админы этой же группы
-    if group_tag:
-        admins = cur.execute(
-            "SELECT tg_id FROM users WHERE role='admin' AND group_tag=?",
-            (group_tag,)
-        ).fetchall()
-        for a in admins:
-            if a["tg_id"]:
-                tg_ids.append(a["tg_id"])
 
-    # супер-админ (ты) — на всякий случай всегда
-    superadmins = cur.execute(
-        "SELECT tg_id FROM users WHERE role='superadmin'"
-    ).fetchall()
-    for sa in superadmins:
-        if sa["tg_id"]:
-            tg_ids.append(sa["tg_id"])
-
-    # уберём дубли
-    return list(dict.fromkeys(tg_ids))
-
-
-async def send_and_store_tg(cur, protection_id: int, text: str, reply_markup=None):
-    """
-    Шлёт сообщение всем причастным и сохраняет chat_id/message_id
-    """
+def _enqueue_for_protection_tx(conn, protection_id: int, text: str, reply_markup=None) -> int:
+    cur = conn.cursor()
     # достаём защиту, нам нужен manager
     row = cur.execute(
-        "SELECT manager FROM protections WHERE id=?",
+        "SELECT manager_id FROM protections WHERE id=?",
         (protection_id,)
     ).fetchone()
-    if not row:
-        return
+    queued = 0
+    if row:
+        recipients = get_tg_recipients_for_manager(cur, row["manager_id"])
+        queued = enqueue(cur, recipients, text, protection_id, reply_markup)
+    conn.on_commit(OUTBOX.wake)
+    return queued
 
-    recipients = get_tg_recipients_for_manager(cur, row["manager"])
 
-    for chat_id in recipients:
-        try:
-            msg = await bot.send_message(
-                chat_id,
-                text,
-                parse_mode="HTML",
-                reply_markup=reply_markup
-            )
-            # сохраняем
-            cur.execute(
-                "INSERT INTO tg_notifications(protection_id, chat_id, message_id, created_at) VALUES (?,?,?,?)",
-                (protection_id, chat_id, msg.message_id, now_iso())
-            )
-        except Exception as e:
-            print(f"⚠️ Ошибка отправки в чат {chat_id}: {e}")
-    # транзакцию снаружи закроем
-
-
-
-# 📨 Функция отправки уведомления админу
-async def notify_admin_new_protection(p: dict):
+async def send_and_store_tg(protection_id: int, text: str, reply_markup=None):
     """
-    p = {
-      id, manager, partner, partner_city, sku, area_m2, object_city, address, comment
-    }
+    Ставит сообщение всем причастным в tg_outbox; отправит и сохранит
+    chat_id/message_id в tg_notifications фоновый OutboxWorker
     """
+    return await WRITER.run(_enqueue_for_protection_tx, protection_id, text, reply_markup)
+
+
+def _new_protection_message(p: dict):
+    """Текст и кнопки уведомления о новой защите на проверке"""
     pid = p["id"]
     text = (
         "🆕 <b>Новая защита на проверке</b>\n"
-        f"👤 Менеджер: {p.get('manager', '—')}\n"
-        f"🏢 Партнёр: {p.get('partner', '—')} ({p.get('partner_city', '—')})\n"
-        f"📦 SKU: {p.get('sku', '—')}\n"
+        f"👤 Менеджер: {esc(p.get('manager', '—'))}\n"
+        f"🏢 Партнёр: {esc(p.get('partner', '—'))} ({esc(p.get('partner_city', '—'))})\n"
+        f"📦 SKU: {esc(p.get('sku', '—'))}\n"
         f"📏 Площадь: {p.get('area_m2', '—')} м²\n"
-        f"📍 Объект: {p.get('object_city', '—')}, {p.get('address', '—')}\n"
-        f"💬 Комментарий: {p.get('comment', '—')}\n"
+        f"📍 Объект: {esc(p.get('object_city', '—'))}, {esc(p.get('address', '—'))}\n"
+        f"💬 Комментарий: {esc(p.get('comment', '—'))}\n"
     )
 
     kb = InlineKeyboardBuilder()
     kb.button(text="✅ Одобрить", callback_data=f"approve:{pid}")
     kb.button(text="🚫 Отклонить", callback_data=f"reject:{pid}")
     kb.adjust(2)
+    return text, kb.as_markup()
 
-    # открываем коннект тут, потому что мы уже в async
-    conn = get_conn()
-    cur = conn.cursor()
 
+# 📨 Функция отправки уведомления админу
+async def notify_admin_new_protection(p: dict):
+    """
+    p = {
+      id, manager, partner, partner_city, sku, area_m2, object_city, address, comment
+    }
+    """
+    text, markup = _new_protection_message(p)
     # используем общий helper
-    await send_and_store_tg(cur, pid, text, reply_markup=kb.as_markup())
-
-    conn.commit()
-    conn.close()
-    print(f"✅ Уведомление по защите #{pid} отправлено всем ответственным")
-
+    await send_and_store_tg(p["id"], text, reply_markup=markup)
+    print(f"✅ Уведомление по защите #{p['id']} поставлено в очередь")
 
 
-        
-
+def _enqueue_edits(cur, pid: int, text: str):
+    """Редактирование всех ранее отправленных по защите сообщений — через tg_outbox"""
+    notif_rows = cur.execute(
+        "SELECT chat_id, message_id FROM tg_notifications WHERE protection_id=?",
+        (pid,)
+    ).fetchall()
+    for n in notif_rows:
+        enqueue(cur, [n["chat_id"]], text, pid, method="edit", message_id=n["message_id"])
 
-# === Обработка кнопки "Одобрить" ===
-@dp.callback_query(F.data.startswith("approve:"))
-async def approve_handler(callback: types.CallbackQuery):
-    pid = int(callback.data.split(":")[1])
 
-    conn = get_conn()
+def _approve_from_tg(conn, pid: int):
     cur = conn.cursor()
 
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
     if not row:
-        await callback.answer("❌ Защита не найдена", show_alert=True)
-        conn.close()
-        return
+        return None
 
     r = dict(row)
     sku_display = r.get("sku") or r.get("comment") or "—"
@@ -1549,51 +2085,28 @@ async def approve_handler(callback: types.CallbackQuery):
     )
     add_history(cur, pid, "admin", "approve", {"source": "tg", "sku": sku_display})
 
-    # достаём все связанные tg-сообщения
-    notif_rows = cur.execute(
-        "SELECT chat_id, message_id FROM tg_notifications WHERE protection_id=?",
-        (pid,)
-    ).fetchall()
-
-    conn.commit()
-    conn.close()
-
     # текст, который покажем всем
     final_text = (
         f"✅ Защита #{pid} одобрена!\n\n"
-        f"👤 Менеджер: {r['manager']}\n"
-        f"🏢 Партнёр: {r['partner']} ({r['partner_city']})\n"
-        f"📦 SKU: {sku_display}\n"
+        f"👤 Менеджер: {esc(MANAGERS.name(row))}\n"
+        f"🏢 Партнёр: {esc(r['partner'])} ({esc(r['partner_city'])})\n"
+        f"📦 SKU: {esc(sku_display)}\n"
         f"📏 Площадь: {r['area_m2']} м²"
     )
+    _enqueue_edits(cur, pid, final_text)
 
-    # редактируем у всех, кому отправляли
-    for n in notif_rows:
-        try:
-            await bot.edit_message_text(
-                chat_id=n["chat_id"],
-                message_id=n["message_id"],
-                text=final_text,
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            print(f"⚠️ Не смог обновить сообщение в чате {n['chat_id']}: {e}")
-
-    await callback.answer("Одобрено ✅")
+    DUP_INDEX.sync(cur, pid)
+    conn.on_commit(lambda: EXPIRY.arm(pid, r["expires_at"]))
+    conn.on_commit(OUTBOX.wake)
+    return r
 
 
-@dp.callback_query(F.data.startswith("reject:"))
-async def reject_handler(callback: types.CallbackQuery):
-    pid = int(callback.data.split(":")[1])
-
-    conn = get_conn()
+def _reject_from_tg(conn, pid: int):
     cur = conn.cursor()
 
     row = cur.execute("SELECT * FROM protections WHERE id=?", (pid,)).fetchone()
     if not row:
-        await callback.answer("❌ Защита не найдена", show_alert=True)
-        conn.close()
-        return
+        return None
 
     r = dict(row)
 
@@ -1603,32 +2116,41 @@ async def reject_handler(callback: types.CallbackQuery):
     )
     add_history(cur, pid, "admin", "reject", {"source": "tg"})
 
-    notif_rows = cur.execute(
-        "SELECT chat_id, message_id FROM tg_notifications WHERE protection_id=?",
-        (pid,)
-    ).fetchall()
-
-    conn.commit()
-    conn.close()
-
     final_text = (
         f"🚫 Защита #{pid} отклонена.\n\n"
-        f"👤 Менеджер: {r['manager']}\n"
-        f"🏢 Партнёр: {r['partner']} ({r['partner_city']})\n"
-        f"📦 SKU: {r.get('sku') or '—'}\n"
+        f"👤 Менеджер: {esc(MANAGERS.name(row))}\n"
+        f"🏢 Партнёр: {esc(r['partner'])} ({esc(r['partner_city'])})\n"
+        f"📦 SKU: {esc(r.get('sku') or '—')}\n"
         f"📏 Площадь: {r.get('area_m2') or '—'} м²"
     )
+    _enqueue_edits(cur, pid, final_text)
 
-    for n in notif_rows:
-        try:
-            await bot.edit_message_text(
-                chat_id=n["chat_id"],
-                message_id=n["message_id"],
-                text=final_text,
-                parse_mode="HTML",
-            )
-        except Exception as e:
-            print(f"⚠️ Не смог обновить сообщение в чате {n['chat_id']}: {e}")
+    DUP_INDEX.sync(cur, pid)
+    conn.on_commit(OUTBOX.wake)
+    return r
+
+
+# === Обработка кнопки "Одобрить" ===
+@dp.callback_query(F.data.startswith("approve:"))
+async def approve_handler(callback: types.CallbackQuery):
+    pid = int(callback.data.split(":")[1])
+
+    found = await WRITER.run(_approve_from_tg, pid)
+    if not found:
+        await callback.answer("❌ Защита не найдена", show_alert=True)
+        return
+
+    await callback.answer("Одобрено ✅")
+
+
+@dp.callback_query(F.data.startswith("reject:"))
+async def reject_handler(callback: types.CallbackQuery):
+    pid = int(callback.data.split(":")[1])
+
+    found = await WRITER.run(_reject_from_tg, pid)
+    if not found:
+        await callback.answer("❌ Защита не найдена", show_alert=True)
+        return
 
     await callback.answer("Отклонено 🚫")
 
@@ -1662,6 +2184,56 @@ async def start_tg_bot():
         print(f"Ошибка запуска Telegram-бота: {e}")
 
 
+# === Состояние очереди tg_outbox ===
+@app.get("/api/admin/tg-outbox")
+async def tg_outbox_metrics(user=Depends(require_admin)):
+    return await OUTBOX.metrics()
+
+
+# === Живая лента изменений (SSE) ===
+def _event_managers(user_id: int) -> set:
+    """
+    managers.id, чьи защиты видит не-админ: менеджеры, связанные с его
+    аккаунтом (managers.user_id), и (для ассистента) с аккаунтом его менеджера
+    """
+    conn = get_conn()
+    ids = {r[0] for r in conn.execute(
+        "SELECT id FROM managers WHERE user_id = ? OR user_id = (SELECT manager_id FROM users WHERE id = ?)",
+        (user_id, user_id),
+    )}
+    conn.close()
+    return ids
+
+
+@app.get("/api/events")
+async def events_stream(
+    request: Request,
+    token: Optional[str] = None,
+    manager: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+):
+    """
+    Server-Sent Events: protection / stats / resync.
+    EventSource не умеет заголовки, поэтому токен можно передать в ?token=.
+    Админ может сузить ленту до одного менеджера (?manager=).
+    """
+    token = token or request.headers.get("token")
+    user = await run_db(PRINCIPALS.resolve, token, SECRET_KEY, ALGORITHM) if token else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    if user["role"] in ("admin", "superadmin"):
+        managers = await run_db(MANAGERS.named, manager) if manager else None
+    else:
+        managers = await run_db(_event_managers, user["id"])
+    last = request.headers.get("last-event-id") or last_event_id or ""
+    return StreamingResponse(
+        EVENTS.stream(Subscriber(managers), last),
+        media_type="text/event-stream",
+        # identity — чтобы GZipMiddleware не копил события в буфере
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity", "X-Accel-Buffering": "no"},
+    )
+
+
 # === Подключаем users API ===
 app.include_router(users_router)
 
@@ -0,0 +1,125 @@
+import threading
+
+from backend.db import get_conn, now_iso
+
+# === Владелец защиты: protections.manager_id → managers.id ===
+# Защиту с менеджером связывает id, а не имя: фильтры, свёртка
+# manager_stats, передача защит и поиск по менеджеру идут по индексу
+# idx_protections_manager. Имя в ответах берётся из managers по id, так что
+# переименование — UPDATE одной строки managers.
+# protections.manager остаётся: там имя на момент создания. Для защит без
+# менеджера (пустое имя, manager_id NULL) это единственное, что показываем.
+# Список managers ведёт админ: создание защиты (без авторизации) и «на
+# проверке» незнакомое имя не заводят, а отклоняют (400) — опечатка или
+# чужой клиент не должны появляться в /api/admin/managers, а защита без
+# manager_id — теряться в фильтре, поиске и /api/stats. Заводит только
+# админский импорт.
+# Telegram-аккаунт менеджера — managers.user_id. Без него менеджер не
+# получает уведомлений и пустая лента /api/events, поэтому link_account
+# связывает сам, когда это однозначно: при заведении менеджера и при входе
+# аккаунта. Тёзок админ связывает вручную (user_id в POST/PATCH).
+
+
+def name_sql(alias: str = "") -> str:
+    """SQL-выражение: текущее имя менеджера защиты ({alias} — "p." или "")"""
+    return f"IFNULL((SELECT name FROM managers WHERE id = {alias}manager_id), {alias}manager)"
+
+
+def filter_sql(alias: str = "") -> str:
+    """Условие «защиты менеджера с именем ?» — по индексу manager_id"""
+    return f"{alias}manager_id = (SELECT id FROM managers WHERE name = ?)"
+
+
+def manager_id_for(cur, name: str):
+    """managers.id по имени или None (пустое имя или такого менеджера нет)"""
+    name = (name or "").strip()
+    if not name:
+        return None
+    row = cur.execute("SELECT id FROM managers WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def link_account(cur, name: str):
+    """
+    Менеджеру name без аккаунта — единственный users с role='manager' и
+    таким first_name (то же правило, что у миграции 4). Тёзки — не трогает.
+    """
+    name = (name or "").strip()
+    if not name:
+        return
+    cur.execute("""
+        UPDATE managers SET user_id = (
+            SELECT CASE WHEN COUNT(*) = 1 THEN MIN(u.id) END
+            FROM users u WHERE u.role = 'manager' AND u.first_name = managers.name
+        )
+        WHERE name = ? AND user_id IS NULL
+    """, (name,))
+
+
+def register_manager(cur, name: str):
+    """
+    managers.id по имени; незнакомое непустое имя заводится в транзакции
+    cur. Только для админских путей (импорт).
+    """
+    manager_id = manager_id_for(cur, name)
+    if manager_id is not None or not (name or "").strip():
+        return manager_id
+    cur.execute("INSERT INTO managers(name, created_at) VALUES (?,?)", (name.strip(), now_iso()))
+    manager_id = cur.lastrowid
+    link_account(cur, name)
+    # principal импортирует этот модуль — поэтому здесь, а не наверху
+    from backend.principal import users_changed
+    cur.connection.on_commit(users_changed)
+    return manager_id
+
+
+class ManagerDirectory:
+    """managers.id -> name в памяти; перечитывается после users_changed()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._generation = 0
+        self.loads = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._names = None
+
+    def _get(self) -> dict:
+        names = self._names
+        if names is not None:
+            return names
+        with self._lock:
+            generation = self._generation
+        conn = get_conn()
+        names = {r[0]: r[1] for r in conn.execute("SELECT id, name FROM managers")}
+        conn.close()
+        with self._lock:
+            self.loads += 1
+            if generation == self._generation:
+                self._names = names
+        return names
+
+    def name(self, row) -> str:
+        """Текущее имя менеджера строки protections (нужны manager_id и manager)"""
+        manager_id = row["manager_id"]
+        if manager_id is None:
+            return row["manager"]
+        return self._get().get(manager_id, row["manager"])
+
+    def named(self, name: str) -> set:
+        """id менеджера с таким именем (пустое множество, если его нет)"""
+        name = (name or "").strip()
+        return {mid for mid, n in self._get().items() if n == name}
+
+    def matching(self, text: str) -> list:
+        """id менеджеров, в имени которых есть text (без учёта регистра)"""
+        needle = (text or "").strip().casefold()
+        if not needle:
+            return []
+        return [mid for mid, name in self._get().items() if needle in name.casefold()]
+
+
+MANAGERS = ManagerDirectory()
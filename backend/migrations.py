@@ -0,0 +1,199 @@
+import re
+import time
+
+# === Версионные миграции схемы ===
+# _safe_migrate в main.py — идемпотентные ALTER TABLE ADD COLUMN, которые
+# можно гонять на каждом старте. Сюда — то, что делается ровно один раз и
+# по порядку (перестройка таблиц, перенос данных). Номер последней
+# применённой миграции хранится в PRAGMA user_version; каждая миграция
+# выполняется в своей транзакции вместе с записью нового номера.
+
+# --- Перестройка таблицы с новыми колонками ---
+_TABLE_CONSTRAINT = re.compile(r"(CONSTRAINT|PRIMARY\s+KEY|UNIQUE|CHECK|FOREIGN\s+KEY)\b", re.I)
+
+
+def _add_columns(create: str, columns: list) -> str:
+    """CREATE TABLE с новыми колонками после существующих (до FOREIGN KEY и прочих ограничений таблицы)"""
+    start, end = create.index("("), create.rindex(")")
+    parts, depth, quote, i, last = [], 0, None, start + 1, start + 1
+    while i < end:
+        ch = create[i]
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"`":
+            quote = ch
+        elif create.startswith("--", i):
+            i = create.find("\n", i)
+            i = end if i < 0 else i
+            continue
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(create[last:i])
+            last = i + 1
+        i += 1
+    parts.append(create[last:end])
+
+    def is_constraint(part: str) -> bool:
+        text = re.sub(r"--[^\n]*", "", part).strip()
+        return bool(_TABLE_CONSTRAINT.match(text))
+
+    at = next((n for n, part in enumerate(parts) if is_constraint(part)), len(parts))
+    parts[at:at] = [f"\n    {c}" for c in columns]
+    body = ",".join(p.rstrip() if n < len(parts) - 1 else p for n, p in enumerate(parts))
+    return create[:start + 1] + body + create[end:]
+
+
+def _rebuild_with(cur, table: str, extra: dict):
+    """Перестраивает table, добавив в конец колонки {имя: определение}"""
+    have = {r[1] for r in cur.execute(f"PRAGMA table_xinfo({table})")}
+    extra = {name: ddl for name, ddl in extra.items() if name not in have}
+    if not extra:
+        return
+    create = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()[0]
+    dependents = cur.execute(
+        "SELECT sql FROM sqlite_master "
+        "WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+    seq = cur.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    columns = ", ".join(r[1] for r in cur.execute(f"PRAGMA table_info({table})"))
+
+    tmp = f"{table}__rebuild"
+    create = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{table}\"?", f"CREATE TABLE {tmp}", create, count=1)
+    cur.execute(_add_columns(create, [f"{name} {ddl}" for name, ddl in extra.items()]))
+    cur.execute(f"INSERT INTO {tmp}({columns}) SELECT {columns} FROM {table}")
+    cur.execute(f"DROP TABLE {table}")   # вместе с индексами и триггерами; триггеры при этом не срабатывают
+    cur.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+    if seq:
+        # AUTOINCREMENT: id удалённых в хвосте строк не должны вернуться
+        cur.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", (seq[0], table))
+    for (sql,) in dependents:
+        cur.execute(sql)
+
+
+# --- 1. Время в секундах Unix рядом с ISO-строками ---
+# created_at / expires_at / closed_at / history.at остаются строками
+# "YYYY-MM-DDTHH:MM:SSZ" — их отдаёт API. Рядом появляются STORED
+# generated-колонки *_ts: SQLite сам считает их при записи, писать в них не
+# нужно, а читать — без разбора строки. На них индексы для выборок по
+# срокам: (status, expires_ts) и (protection_id, at_ts).
+# ALTER TABLE умеет добавлять только VIRTUAL generated-колонки (они
+# разбирают строку при каждом чтении), поэтому таблицы перестраиваются:
+# CREATE по исходному SQL + новые колонки, копия, DROP, RENAME. Индексы и
+# триггеры старой таблицы пересоздаются из их же SQL.
+def _epoch(column: str) -> str:
+    # strftime('%s') вместо unixepoch(): последний есть только с SQLite 3.38
+    return f"INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', {column}) AS INTEGER)) STORED"
+
+
+EPOCH_COLUMNS = {
+    "protections": {"created_ts": "created_at", "expires_ts": "expires_at", "closed_ts": "closed_at"},
+    "history": {"at_ts": "at"},
+}
+
+
+def m001_epoch_columns(cur):
+    for table, columns in EPOCH_COLUMNS.items():
+        _rebuild_with(cur, table, {name: _epoch(src) for name, src in columns.items()})
+    # индекс по строке expires_at больше не нужен — выборки по срокам идут по expires_ts
+    cur.execute("DROP INDEX IF EXISTS idx_protections_status_expires")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_protections_status_expires_ts ON protections(status, expires_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_history_protection_at ON history(protection_id, at_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_history_at ON history(at_ts)")
+    # create_user писал datetime('now', 'localtime') — приводим к UTC и формату now_iso()
+    cur.execute("""
+        UPDATE users SET created_at = strftime('%Y-%m-%dT%H:%M:%SZ', created_at, 'utc')
+        WHERE created_at GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9]*'
+    """)
+
+
+# --- 2. Защита ссылается на менеджера по id (backend/managers.py) ---
+# Раньше связь была по тексту protections.manager = managers.name, а
+# manager_id хоть и был колонкой, оставался NULL (или попадал туда users.id).
+# Имена без строки в managers регистрируются, manager_id заполняется по
+# имени. manager_stats и protections_fts пересобираются без имени менеджера:
+# init_stats / init_search создадут их заново при этом же старте.
+def m002_manager_ids(cur):
+    cur.execute("""
+        INSERT INTO managers(name, created_at)
+        SELECT DISTINCT p.manager, strftime('%Y-%m-%dT%H:%M:%SZ', 'now') FROM protections p
+        WHERE TRIM(p.manager) != '' AND NOT EXISTS (SELECT 1 FROM managers m WHERE m.name = p.manager)
+    """)
+    for trigger in ("manager_stats_ai", "manager_stats_ad", "manager_stats_au",
+                    "protections_fts_ai", "protections_fts_ad", "protections_fts_au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute("DROP TABLE IF EXISTS manager_stats")
+    cur.execute("DROP TABLE IF EXISTS protections_fts")
+    # в ответах API ничего не меняется (имя то же) — change_version не трогаем
+    sync_au = cur.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='protections_sync_au'").fetchone()
+    cur.execute("DROP TRIGGER IF EXISTS protections_sync_au")
+    cur.execute("UPDATE protections SET manager_id = (SELECT id FROM managers m WHERE m.name = protections.manager)")
+    if sync_au:
+        cur.execute(sync_au[0])
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_protections_manager ON protections(manager_id, created_at, id)")
+
+
+# --- 3. Артикулы защиты отдельными строками (backend/items.py) ---
+# protection_items заполняется разбором protections.sku: "; " — артикулы со
+# своей площадью, " + " — общая площадь защиты, иначе свободный текст.
+# Коллекция — по каталогу skus.csv на момент миграции. Таблицу и индексы
+# создаёт init_items — её же, как init_stats, вызывает init_storage.
+def m003_protection_items(cur):
+    from backend.items import init_items, parse_display, write_items
+
+    init_items(cur)
+    cur.execute("DELETE FROM protection_items")
+    rows = cur.execute("SELECT id, sku, area_m2 FROM protections").fetchall()
+    write_items(cur, [(pid, parse_display(sku, area)) for pid, sku, area in rows], replace=False)
+
+
+# --- 4. Telegram-аккаунт менеджера: managers.user_id → users.id ---
+# Получателей уведомлений и ленту /api/events искали по users.first_name =
+# имени менеджера — у тёзок они путались. Теперь менеджер (managers.id)
+# ссылается на свой аккаунт в users. Связь проставляется только там, где
+# имя однозначно: ровно один пользователь с ролью manager и таким
+# first_name. Остальные админ связывает сам (PATCH /api/admin/managers/{id}).
+def m004_manager_users(cur):
+    if "user_id" not in {r[1] for r in cur.execute("PRAGMA table_info(managers)")}:
+        cur.execute("ALTER TABLE managers ADD COLUMN user_id INTEGER")
+    cur.execute("""
+        UPDATE managers SET user_id = (
+            SELECT CASE WHEN COUNT(*) = 1 THEN MIN(u.id) END FROM users u
+            WHERE u.role = 'manager' AND u.first_name = managers.name
+        )
+        WHERE user_id IS NULL
+    """)
+
+
+MIGRATIONS = [
+    (1, "epoch-колонки *_ts и индексы по срокам", m001_epoch_columns),
+    (2, "protections.manager_id → managers.id", m002_manager_ids),
+    (3, "protection_items: артикулы защиты отдельными строками", m003_protection_items),
+    (4, "managers.user_id → users.id", m004_manager_users),
+]
+
+
+def run_migrations(conn) -> int:
+    """Применяет недостающие миграции по порядку; возвращает новую версию схемы"""
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    for number, title, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        t0 = time.perf_counter()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            migrate(cur)
+            cur.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        version = number
+        print(f"🧱 Миграция {number}: {title} — {time.perf_counter() - t0:.1f} с")
+    return version
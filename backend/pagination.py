@@ -0,0 +1,66 @@
+import base64
+import json
+
+import orjson
+
+from fastapi import HTTPException
+
+from backend import db
+
+# === Keyset-пагинация по (created_at, id) и потоковая выдача JSON ===
+
+MAX_LIMIT = 1000
+FETCH_CHUNK = 500
+
+
+def encode_cursor(created_at: str, pid: int) -> str:
+    raw = json.dumps([created_at, pid], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, pid = json.loads(raw)
+        return str(created_at), int(pid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+def keyset_clause(cursor, alias: str = "") -> tuple:
+    """Условие «строго после курсора» для сортировки created_at DESC, id DESC"""
+    if not cursor:
+        return "", []
+    created_at, pid = decode_cursor(cursor)
+    return f" AND ({alias}created_at, {alias}id) < (?, ?)", [created_at, pid]
+
+
+def edge_clause(created_at: str, pid: int, alias: str = "") -> tuple:
+    """Условие «не дальше края страницы» (край включён) — поток страницы режется по нему, а не LIMIT"""
+    return f" AND ({alias}created_at, {alias}id) >= (?, ?)", [created_at, pid]
+
+
+def keyset_order(alias: str = "") -> str:
+    return f" ORDER BY {alias}created_at DESC, {alias}id DESC"
+
+
+def stream_json_array(sql: str, params: list, encode):
+    """
+    Генератор JSON-массива прямо из курсора SQLite: строки уходят в сокет
+    пачками по FETCH_CHUNK, весь результат в памяти не собирается.
+    """
+    conn = db.get_conn()
+    try:
+        cur = conn.execute(sql, params)
+        yield b"["
+        first = True
+        while True:
+            rows = cur.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            chunk = orjson.dumps([encode(r) for r in rows])[1:-1]   # без [ ]
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]"
+    finally:
+        conn.close()
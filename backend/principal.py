@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jose import jwt, JWTError
+
+from backend.db import get_conn
+from backend.managers import MANAGERS
+from backend.recipients import RECIPIENTS
+
+# === Кто делает запрос: токен → {id, role} ===
+# JWT проверяется один раз, дальше результат лежит в LRU-кэше по sha256
+# токена (не дольше TOKEN_CACHE_TTL и не дольше exp из токена). Роль берётся
+# не из токена, а из индекса users в памяти — понижение роли через
+# PATCH /api/users/{id} действует сразу, без перевыпуска токена.
+# sub токена — users.id ("kind": "id"). Токены без kind выдавались раньше
+# тремя входами: через Telegram (sub — tg_id), супер-админом и dev-login
+# (sub — users.id), и различить их нельзя. Такой sub ищется только среди
+# tg_id, а промах — отказ (401, войти заново), а не роль из самого токена:
+# у старых токенов нет exp, и понижённый или удалённый админ иначе сохранял
+# бы права навсегда. Каждый вид — ровно в одной карте: tg_id одного
+# пользователя не может совпасть с users.id другого и достать чужую роль.
+# Роль из токена не используется вовсе: нет пользователя — нет доступа.
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL = 300  # сек
+
+
+class UsersIndex:
+    """users.id -> роль и tg_id -> users.id; перечитывается после users_changed()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._generation = 0
+        self.loads = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data = None
+
+    def _get(self) -> dict:
+        data = self._data
+        if data is not None:
+            return data
+        with self._lock:
+            generation = self._generation
+        conn = get_conn()
+        rows = conn.execute("SELECT id, tg_id, role FROM users ORDER BY id").fetchall()
+        conn.close()
+        data = {
+            "by_id": {r["id"]: r["role"] for r in rows},
+            "by_tg": {r["tg_id"]: r["id"] for r in rows if r["tg_id"]},
+            "first_role": rows[0]["role"] if rows else None,
+        }
+        with self._lock:
+            self.loads += 1
+            if generation == self._generation:
+                self._data = data
+        return data
+
+    def find(self, kind: str, sub: int):
+        """(users.id, роль) по sub из токена или None; kind: id или tg"""
+        data = self._get()
+        user_id = sub if kind == "id" else data["by_tg"].get(sub)
+        role = data["by_id"].get(user_id)
+        return None if role is None else (user_id, role)
+
+    def first_role(self):
+        return self._get()["first_role"]
+
+
+class PrincipalCache:
+    def __init__(self, size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.users = UsersIndex()
+        self._tokens = OrderedDict()  # sha256(token) -> (годен до, kind, sub)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _claims(self, token: str, secret: str, algorithm: str):
+        key = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with self._lock:
+            hit = self._tokens.get(key)
+            if hit and hit[0] > now:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return hit
+            if hit:
+                del self._tokens[key]
+
+        try:
+            payload = jwt.decode(token, secret, algorithms=[algorithm])
+            sub = int(payload["sub"])
+            kind = payload.get("kind", "tg")
+        except (JWTError, KeyError, TypeError, ValueError):
+            return None
+        until = now + self.ttl
+        if payload.get("exp"):
+            until = min(until, float(payload["exp"]))
+        if kind not in ("id", "tg"):
+            return None
+        claims = (until, kind, sub)
+        with self._lock:
+            self.misses += 1
+            self._tokens[key] = claims
+            while len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+        return claims
+
+    def resolve(self, token: str, secret: str, algorithm: str):
+        """{"id": users.id, "role"} или None: токен невалиден, истёк или его пользователя нет в users"""
+        claims = self._claims(token, secret, algorithm)
+        if claims is None:
+            return None
+        _, kind, sub = claims
+        found = self.users.find(kind, sub)
+        if found is None:
+            return None
+        return {"id": found[0], "role": found[1]}
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+PRINCIPALS = PrincipalCache()
+
+
+def users_changed():
+    """Звать после commit любого изменения users/managers: сбрасывает кэши в памяти"""
+    RECIPIENTS.invalidate()
+    MANAGERS.invalidate()
+    PRINCIPALS.users.invalidate()
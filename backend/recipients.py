@@ -0,0 +1,108 @@
+import threading
+
+from backend.db import get_conn
+
+# === Граф получателей Telegram-уведомлений ===
+# менеджер → его ассистенты → админы его группы → супер-админы.
+# Менеджер — managers.id (protections.manager_id); его Telegram-аккаунт —
+# managers.user_id, связь ставит админ (PATCH /api/admin/managers/{id}).
+# По именам users.first_name получателей не ищем: тёзки не должны получать
+# чужие уведомления. Строится одним SELECT по users и одним по managers и
+# живёт в памяти процесса, так что рассылка уведомлений не ходит в базу.
+# Любой эндпоинт, меняющий users/managers, после commit зовёт
+# users_changed() (backend/principal.py) — граф пересоберётся при следующем
+# обращении.
+
+
+class _Graph:
+    def __init__(self, users, links):
+        self.accounts = {}      # users.id -> (tg_id, group_tag)
+        self.owners = {}        # managers.id -> users.id его Telegram-аккаунта
+        self.assistants = {}    # users.id менеджера -> [tg_id]
+        self.group_admins = {}  # group_tag -> [tg_id]
+        self.superadmins = []
+        for u in users:
+            role = u["role"]
+            tg_id = u["tg_id"]
+            self.accounts[u["id"]] = (tg_id, u["group_tag"])
+            if role == "assistant" and tg_id:
+                self.assistants.setdefault(u["manager_id"], []).append(tg_id)
+            elif role == "admin" and tg_id:
+                self.group_admins.setdefault(u["group_tag"], []).append(tg_id)
+            elif role == "superadmin" and tg_id:
+                self.superadmins.append(tg_id)
+        for manager_id, user_id in links:
+            if user_id in self.accounts:
+                self.owners[manager_id] = user_id
+
+    def own(self, manager_id) -> list:
+        """Аккаунт менеджера и его ассистенты"""
+        user_id = self.owners.get(manager_id)
+        if user_id is None:
+            return []
+        tg_id, _ = self.accounts[user_id]
+        return ([tg_id] if tg_id else []) + self.assistants.get(user_id, [])
+
+
+class RecipientGraph:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._graph = None
+        self._generation = 0
+        self.loads = 0
+
+    def invalidate(self):
+        """Звать после commit любого изменения users/managers"""
+        with self._lock:
+            self._generation += 1
+            self._graph = None
+
+    def _get(self) -> _Graph:
+        graph = self._graph
+        if graph is not None:
+            return graph
+        with self._lock:
+            generation = self._generation
+        conn = get_conn()
+        users = conn.execute(
+            "SELECT id, tg_id, role, manager_id, group_tag FROM users ORDER BY id"
+        ).fetchall()
+        links = conn.execute("SELECT id, user_id FROM managers WHERE user_id IS NOT NULL").fetchall()
+        conn.close()
+        graph = _Graph(users, links)
+        with self._lock:
+            self.loads += 1
+            # пока читали, могли успеть поменять users — такой граф не кэшируем
+            if generation == self._generation:
+                self._graph = graph
+        return graph
+
+    # --- уведомления о защитах ---
+    def for_manager(self, manager_id) -> list:
+        """
+        tg_id для уведомлений по защите менеджера (managers.id):
+        менеджер, его ассистенты, админы той же группы и все супер-админы
+        """
+        return self.for_managers([manager_id]).get(manager_id, [])
+
+    def for_managers(self, manager_ids) -> dict:
+        graph = self._get()
+        out = {}
+        for mid in manager_ids:
+            tg_ids = graph.own(mid)
+            user_id = graph.owners.get(mid)
+            group_tag = graph.accounts[user_id][1] if user_id is not None else None
+            if group_tag:
+                tg_ids += graph.group_admins.get(group_tag, [])
+            tg_ids += graph.superadmins
+            out[mid] = list(dict.fromkeys(tg_ids))
+        return out
+
+    # --- напоминания об истечении ---
+    def owners(self, manager_ids) -> dict:
+        """managers.id -> [tg_id]: аккаунт менеджера и его ассистенты"""
+        graph = self._get()
+        return {mid: list(dict.fromkeys(graph.own(mid))) for mid in manager_ids}
+
+
+RECIPIENTS = RecipientGraph()
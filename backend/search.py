@@ -0,0 +1,101 @@
+import sqlite3
+import sys
+
+from backend.db import get_conn
+
+# === Полнотекстовый поиск по защитам (FTS5, trigram) ===
+# protections_fts — external-content таблица поверх protections, триграммный
+# токенайзер даёт поиск по подстроке и нормально сворачивает регистр кириллицы.
+# Синхронизация — триггерами, так что любой INSERT/UPDATE/DELETE её обновляет.
+
+# имени менеджера здесь нет: оно живёт в managers (переименование не трогает
+# protections), поиск по нему — через MANAGERS.matching в protections_query
+FTS_COLUMNS = (
+    "client", "partner", "partner_city",
+    "sku", "last4", "object_city", "address",
+)
+MIN_QUERY_LEN = 3  # триграммам нужно хотя бы 3 символа
+
+FTS_ENABLED = False
+
+
+def _cols(prefix: str = "") -> str:
+    return ", ".join(prefix + c for c in FTS_COLUMNS)
+
+
+def init_search(cur) -> bool:
+    """Создаёт protections_fts и триггеры. Возвращает False, если FTS5 недоступен"""
+    global FTS_ENABLED
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='protections_fts'"
+    ).fetchone()
+    try:
+        cur.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS protections_fts USING fts5(
+                {_cols()},
+                content='protections', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print("⚠️ FTS5 недоступен, поиск будет через LIKE:", e)
+        FTS_ENABLED = False
+        return False
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_fts_ai AFTER INSERT ON protections BEGIN
+            INSERT INTO protections_fts(rowid, {_cols()}) VALUES (new.id, {_cols("new.")});
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_fts_ad AFTER DELETE ON protections BEGIN
+            INSERT INTO protections_fts(protections_fts, rowid, {_cols()})
+            VALUES ('delete', old.id, {_cols("old.")});
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_fts_au AFTER UPDATE OF {_cols()} ON protections BEGIN
+            INSERT INTO protections_fts(protections_fts, rowid, {_cols()})
+            VALUES ('delete', old.id, {_cols("old.")});
+            INSERT INTO protections_fts(rowid, {_cols()}) VALUES (new.id, {_cols("new.")});
+        END
+    """)
+    if not exists:
+        # таблица только что появилась — проиндексируем то, что уже лежит в базе
+        cur.execute("INSERT INTO protections_fts(protections_fts) VALUES ('rebuild')")
+    FTS_ENABLED = True
+    return True
+
+
+def index_new_rows(cur, after_id: int):
+    """То же, что protections_fts_ai, одним запросом для пачки строк с id > after_id"""
+    cur.execute(
+        f"INSERT INTO protections_fts(rowid, {_cols()}) SELECT id, {_cols()} FROM protections WHERE id > ?",
+        (after_id,),
+    )
+
+
+def fts_query(search: str):
+    """Строка поиска → MATCH-выражение (фраза = поиск подстроки) или None"""
+    s = (search or "").strip()
+    if not FTS_ENABLED or len(s) < MIN_QUERY_LEN:
+        return None
+    return '"' + s.replace('"', '""') + '"'
+
+
+def rebuild_search_index():
+    conn = get_conn()
+    cur = conn.cursor()
+    if init_search(cur):
+        cur.execute("INSERT INTO protections_fts(protections_fts) VALUES ('rebuild')")
+        cur.execute("INSERT INTO protections_fts(protections_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+
+# python -m backend.search rebuild
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python -m backend.search rebuild")
+        sys.exit(1)
+    rebuild_search_index()
+    print("✅ Поисковый индекс protections_fts перестроен")
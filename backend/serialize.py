@@ -0,0 +1,74 @@
+from backend.managers import name_sql
+
+# === Быстрая выдача списков защит ===
+# row_to_out на каждую строку строит ProtectionOut, а
+# FastAPI потом ещё раз валидирует List[ProtectionOut]. Для списков
+# (тысячи строк) это основная цена ответа. Здесь:
+#   - days_left считает SQLite по expires_ts (секунды Unix, backend/migrations.py),
+#     с округлением вниз — как timedelta.days;
+#   - NULL в текстовых полях заменяется на "" прямо в SELECT, имя менеджера
+#     берётся из managers по manager_id (backend/managers.py);
+#   - строка -> dict по номерам колонок, без Pydantic;
+#   - JSON собирает orjson (ORJSONResponse), FastAPI второй раз не валидирует.
+# Формат ответа тот же, что у ProtectionOut, включая порядок полей.
+
+WARN_TEXT = "⏰ Через 2 дня истекает — напомни менеджеру."
+
+# текущее время в секундах Unix с долями — как time.time()
+_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+_DAYS = "(({a}expires_ts - " + _NOW + ") / 86400.0)"
+# (поле, SQL-выражение); {a} — алиас таблицы вида "p." или ""
+_OUT = [
+    ("id", "{a}id"),
+    ("manager", name_sql("{a}")),
+    ("client", "IFNULL({a}client, '')"),
+    ("partner", "IFNULL({a}partner, '')"),
+    ("partner_city", "IFNULL({a}partner_city, '')"),
+    ("sku", "IFNULL({a}sku, '')"),
+    ("area_m2", "{a}area_m2"),
+    ("last4", "IFNULL({a}last4, '')"),
+    ("object_city", "IFNULL({a}object_city, '')"),
+    ("address", "IFNULL({a}address, '')"),
+    ("comment", "IFNULL({a}comment, '')"),
+    ("status", "{a}status"),
+    ("created_at", "{a}created_at"),
+    ("expires_at", "{a}expires_at"),
+    ("closed_at", "{a}closed_at"),
+    # floor без math-функций (они есть не в каждой сборке SQLite): CAST режет
+    # к нулю, поэтому сдвигаем в положительные числа и обратно
+    ("days_left", f"CAST({_DAYS} + 1000000 AS INTEGER) - 1000000"),
+    ("extend_count", "{a}extend_count"),
+]
+
+
+def out_columns(alias: str = "") -> str:
+    """Список колонок SELECT для encode_row; дальше в SELECT можно добавлять свои"""
+    return ", ".join(f"{expr.format(a=alias)} AS {name}" for name, expr in _OUT)
+
+
+def encode_row(r) -> dict:
+    """Строка SELECT out_columns(...) (кортеж или sqlite3.Row) -> dict как ProtectionOut"""
+    days = r[15]
+    warn = r[11] == "active" and days is not None and days <= 2
+    return {
+        "id": r[0],
+        "manager": r[1],
+        "client": r[2],
+        "partner": r[3],
+        "partner_city": r[4],
+        "sku": r[5],
+        "area_m2": r[6],
+        "last4": r[7],
+        "object_city": r[8],
+        "address": r[9],
+        "comment": r[10],
+        "status": r[11],
+        "created_at": r[12],
+        "expires_at": r[13],
+        "closed_at": r[14],
+        "days_left": days,
+        "warn2d": warn,
+        "warn_text": WARN_TEXT if warn else None,
+        "extend_count": r[16],
+    }
+
@@ -0,0 +1,121 @@
+import sys
+
+from backend.db import get_conn
+
+# === Свёртка статистики по менеджерам ===
+# manager_stats хранит (managers.id, статус) → количество и сумму площадей.
+# Триггеры на protections поддерживают её в актуальном виде при любом
+# INSERT/UPDATE/DELETE, так что /api/stats и /api/admin/managers читают
+# O(менеджеров) строк вместо GROUP BY по всей таблице защит. Защиты без
+# менеджера (manager_id NULL) копятся под id 0.
+
+_UPSERT_NEW = """
+    INSERT INTO manager_stats(manager_id, status, cnt, area)
+    VALUES (IFNULL(new.manager_id, 0), new.status, 1, IFNULL(new.area_m2, 0))
+    ON CONFLICT(manager_id, status) DO UPDATE SET
+        cnt = cnt + 1,
+        area = area + excluded.area;
+"""
+_DROP_OLD = """
+    UPDATE manager_stats
+    SET cnt = cnt - 1, area = area - IFNULL(old.area_m2, 0)
+    WHERE manager_id = IFNULL(old.manager_id, 0) AND status = old.status;
+"""
+
+_FROM_PROTECTIONS = """
+    SELECT IFNULL(manager_id, 0), status, COUNT(*), IFNULL(SUM(area_m2), 0)
+    FROM protections
+    GROUP BY 1, status
+"""
+
+
+def init_stats(cur):
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='manager_stats'"
+    ).fetchone()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS manager_stats(
+            manager_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            area REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (manager_id, status)
+        ) WITHOUT ROWID
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS manager_stats_ai AFTER INSERT ON protections BEGIN
+            {_UPSERT_NEW}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS manager_stats_ad AFTER DELETE ON protections BEGIN
+            {_DROP_OLD}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS manager_stats_au
+        AFTER UPDATE OF manager_id, status, area_m2 ON protections BEGIN
+            {_DROP_OLD}
+            {_UPSERT_NEW}
+        END
+    """)
+    if not exists:
+        rebuild_stats(cur)
+
+
+def add_new_rows(cur, after_id: int):
+    """То же, что manager_stats_ai, одним запросом для пачки строк с id > after_id"""
+    cur.execute("""
+        INSERT INTO manager_stats(manager_id, status, cnt, area)
+        SELECT IFNULL(manager_id, 0), status, COUNT(*), IFNULL(SUM(area_m2), 0)
+        FROM protections WHERE id > ?
+        GROUP BY 1, status
+        ON CONFLICT(manager_id, status) DO UPDATE SET
+            cnt = cnt + excluded.cnt,
+            area = area + excluded.area
+    """, (after_id,))
+
+
+def rebuild_stats(cur):
+    cur.execute("DELETE FROM manager_stats")
+    cur.execute(f"INSERT INTO manager_stats(manager_id, status, cnt, area) {_FROM_PROTECTIONS}")
+
+
+def check_stats(cur) -> list:
+    """Расхождения свёртки с protections: [(manager_id, status, ожидалось, есть), ...]"""
+    expected = {(m, s): (c, a) for m, s, c, a in cur.execute(_FROM_PROTECTIONS)}
+    actual = {
+        (m, s): (c, a)
+        for m, s, c, a in cur.execute("SELECT manager_id, status, cnt, area FROM manager_stats")
+        if c
+    }
+    diffs = []
+    for key in sorted(set(expected) | set(actual)):
+        exp = expected.get(key, (0, 0))
+        got = actual.get(key, (0, 0))
+        if exp[0] != got[0] or abs(exp[1] - got[1]) > 0.01:
+            diffs.append((key[0], key[1], exp, got))
+    return diffs
+
+
+# python -m backend.stats check | rebuild
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd not in ("check", "rebuild"):
+        print("Использование: python -m backend.stats check|rebuild")
+        sys.exit(1)
+    conn = get_conn()
+    cur = conn.cursor()
+    init_stats(cur)
+    if cmd == "rebuild":
+        rebuild_stats(cur)
+        conn.commit()
+        print("✅ manager_stats пересобрана")
+    else:
+        conn.commit()
+        diffs = check_stats(cur)
+        for manager_id, status, exp, got in diffs:
+            print(f"⚠️ менеджер #{manager_id} / {status}: ожидалось {exp}, в свёртке {got}")
+        print("✅ manager_stats совпадает с protections" if not diffs else f"❌ расхождений: {len(diffs)}")
+    conn.close()
+    sys.exit(1 if cmd == "check" and diffs else 0)
@@ -0,0 +1,167 @@
+import secrets
+
+from fastapi import HTTPException
+
+from backend.managers import filter_sql
+
+# === Дельта-синхронизация защит (GET /api/protections/changes) ===
+# У каждой защиты есть change_version — номер последнего изменения. Номера
+# выдаёт счётчик sync_state, а ставят их триггеры на protections, поэтому
+# любой путь записи (создание, правка, продление, закрытие, одобрение,
+# авто-закрытие, передача другому менеджеру) учтён без правок в обработчиках.
+# Жёсткие DELETE оставляют запись в protections_tombstones. Переименование
+# менеджера строки protections не трогает — оно сбрасывает копии клиентов
+# (reset_sync).
+#
+# Токен синхронизации — "<id базы>:<версия>". Клиент присылает последний
+# полученный токен и получает только то, что изменилось после него. Токен
+# от другой базы (восстановили бэкап, пересоздали) или «из будущего» даёт
+# reset=true: локальную копию нужно заменить, выдача идёт с нуля.
+# Записи коммитятся строго по порядку версий (SQLite пишет в один поток),
+# поэтому «дыр» между выданным токеном и следующей дельтой не бывает.
+
+SYNC_LIMIT = 500
+
+
+def init_sync(cur):
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sync_state'"
+    ).fetchone()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            db_id TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS protections_tombstones(
+            id INTEGER PRIMARY KEY,
+            change_version INTEGER NOT NULL
+        )
+    """)
+    if not exists:
+        # первая инициализация: пронумеруем то, что уже лежит в базе
+        cur.execute("UPDATE protections SET change_version = id")
+        cur.execute(
+            "INSERT INTO sync_state(id, db_id, version) SELECT 1, ?, IFNULL(MAX(id), 0) FROM protections",
+            (secrets.token_hex(4),),
+        )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_protections_change_version ON protections(change_version)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_change_version ON protections_tombstones(change_version)")
+
+    bump = "UPDATE sync_state SET version = version + 1 WHERE id = 1;"
+    current = "(SELECT version FROM sync_state WHERE id = 1)"
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_sync_ai AFTER INSERT ON protections BEGIN
+            {bump}
+            UPDATE protections SET change_version = {current} WHERE id = new.id;
+        END
+    """)
+    # WHEN — чтобы собственный UPDATE change_version не считался новым изменением
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_sync_au AFTER UPDATE ON protections
+        WHEN new.change_version IS old.change_version BEGIN
+            {bump}
+            UPDATE protections SET change_version = {current} WHERE id = new.id;
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS protections_sync_ad AFTER DELETE ON protections BEGIN
+            {bump}
+            INSERT OR REPLACE INTO protections_tombstones(id, change_version) VALUES (old.id, {current});
+        END
+    """)
+
+
+def reset_sync(cur):
+    """Новый id базы: все выданные токены станут чужими, клиенты получат reset=true"""
+    cur.execute("UPDATE sync_state SET db_id = ? WHERE id = 1", (secrets.token_hex(4),))
+
+
+def number_new_rows(cur, after_id: int):
+    """То же, что protections_sync_ai, для пачки строк с id > after_id (id идут подряд)"""
+    base = cur.execute("SELECT version FROM sync_state WHERE id = 1").fetchone()[0]
+    n = cur.execute(
+        "UPDATE protections SET change_version = ? + (id - ?) WHERE id > ?", (base, after_id, after_id)
+    ).rowcount
+    cur.execute("UPDATE sync_state SET version = version + ? WHERE id = 1", (n,))
+
+
+def _state(cur) -> tuple:
+    row = cur.execute("SELECT db_id, version FROM sync_state WHERE id = 1").fetchone()
+    return row["db_id"], row["version"]
+
+
+def make_token(db_id: str, version: int) -> str:
+    return f"{db_id}:{version}"
+
+
+def parse_token(token: str, db_id: str, current: int):
+    """Версия из токена; None — токен не от этой базы, нужна полная синхронизация"""
+    if not token:
+        return None
+    tid, sep, version = token.partition(":")
+    if not sep or not version.isdigit():
+        raise HTTPException(status_code=400, detail="Некорректный since")
+    version = int(version)
+    if tid != db_id or version > current:
+        return None
+    return version
+
+
+def changes_since(cur, since: str, manager: str = "", limit: int = SYNC_LIMIT, columns: str = "*") -> dict:
+    """
+    Изменения после токена since: {"rows", "deleted", "token", "has_more", "reset"}.
+    rows — живые защиты (sqlite3.Row из колонок columns), deleted — id удалённых
+    (status='deleted' или стёртых из таблицы). С manager — только его защиты;
+    передачу защиты другому менеджеру прежний владелец так не увидит, для
+    этого есть resync в /api/events.
+    """
+    # версию читаем до выборки: всё, что закоммичено до неё, выборка увидит
+    db_id, current = _state(cur)
+    version = parse_token(since, db_id, current)
+    reset = version is None
+    if reset:
+        version = 0
+
+    sql = f"SELECT {columns}, change_version FROM protections WHERE change_version > ?"
+    params: list = [version]
+    if manager:
+        sql += " AND " + filter_sql()
+        params.append(manager)
+    sql += " ORDER BY change_version LIMIT ?"
+    changed = cur.execute(sql, params + [limit + 1]).fetchall()
+    # стёртые строки без менеджера не отфильтровать — они редкие, отдаём всем
+    gone = [] if reset else cur.execute(
+        "SELECT id, change_version FROM protections_tombstones WHERE change_version > ? "
+        "ORDER BY change_version LIMIT ?",
+        (version, limit + 1),
+    ).fetchall()
+
+    merged = sorted(
+        [(r["change_version"], r) for r in changed] + [(g["change_version"], g["id"]) for g in gone],
+        key=lambda x: x[0],
+    )
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    if has_more:
+        token_version = merged[-1][0]
+    else:
+        token_version = max([current] + [v for v, _ in merged])
+
+    rows, deleted = [], []
+    for _, item in merged:
+        if isinstance(item, int):
+            deleted.append(item)
+        elif item["status"] != "deleted":
+            rows.append(item)
+        elif not reset:
+            deleted.append(item["id"])   # при reset клиент и так заменяет копию
+    return {
+        "rows": rows,
+        "deleted": deleted,
+        "token": make_token(db_id, token_version),
+        "has_more": has_more,
+        "reset": reset,
+    }
@@ -0,0 +1,283 @@
+import asyncio
+import html
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from backend.db import get_conn, run_db, now_iso
+from backend.writer import WRITER
+
+# === Исходящие Telegram-сообщения через таблицу tg_outbox ===
+# Обработчики только кладут сообщения в tg_outbox в своей же транзакции
+# (ничего не теряется при рестарте), а отправляет их фоновый OutboxWorker:
+# параллельно, с учётом лимитов Telegram и retry_after, а tg_notifications
+# пишет пачками.
+
+OUTBOX_CONCURRENCY = int(os.getenv("TG_OUTBOX_CONCURRENCY", "8"))
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))          # сообщений/сек на бота
+PER_CHAT_INTERVAL = float(os.getenv("TG_PER_CHAT_INTERVAL", "1"))  # сек между сообщениями в один чат
+MAX_ATTEMPTS = 5
+BATCH_SIZE = 100
+POLL_INTERVAL = 1.0
+
+
+def init_outbox(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tg_outbox(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            protection_id INTEGER,
+            chat_id INTEGER NOT NULL,
+            method TEXT NOT NULL DEFAULT 'send',   -- send | edit
+            text TEXT NOT NULL,
+            reply_markup TEXT,                     -- JSON InlineKeyboardMarkup
+            message_id INTEGER,                    -- для edit
+            status TEXT NOT NULL DEFAULT 'pending', -- pending | sent | failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            error TEXT
+        )
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_outbox_due ON tg_outbox(status, next_attempt_at)"
+    )
+
+
+def esc(value) -> str:
+    """Значение для текста сообщения: всё уходит с parse_mode=HTML, и < > & в именах и артикулах ломали бы разметку"""
+    return html.escape(str(value), quote=False)
+
+
+def enqueue(cur, chat_ids, text: str, protection_id=None, reply_markup=None,
+            method: str = "send", message_id=None) -> int:
+    """
+    Кладёт сообщение для каждого chat_id в очередь (в транзакции вызывающего).
+    reply_markup — aiogram-разметка или уже готовый JSON.
+    После commit стоит позвать OUTBOX.wake(), иначе воркер заметит через POLL_INTERVAL.
+    """
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = reply_markup.model_dump_json(exclude_none=True)
+    now = time.time()
+    rows = [
+        (protection_id, chat_id, method, text, reply_markup, message_id, now, now)
+        for chat_id in dict.fromkeys(chat_ids)
+        if chat_id
+    ]
+    cur.executemany("""
+        INSERT INTO tg_outbox(protection_id, chat_id, method, text, reply_markup,
+                              message_id, next_attempt_at, created_at)
+        VALUES (?,?,?,?,?,?,?,?)
+    """, rows)
+    return len(rows)
+
+
+# === Лимиты ===
+class RateLimiter:
+    """Общий token bucket на бота + не чаще PER_CHAT_INTERVAL в один чат"""
+
+    def __init__(self, rate: float, per_chat_interval: float):
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._chat_locks = {}
+        self._chat_last = {}
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """retry_after от Telegram — ограничение на весь бот"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int):
+        """Держит чат на время отправки: сообщения в один чат идут строго по очереди"""
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            wait = self._chat_last.get(chat_id, 0.0) + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._take_token()
+            try:
+                yield
+            finally:
+                self._chat_last[chat_id] = time.monotonic()
+        if not lock.locked() and len(self._chat_locks) > 10_000:
+            self._chat_locks.pop(chat_id, None)
+            self._chat_last.pop(chat_id, None)
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# === Воркер ===
+class OutboxWorker:
+    def __init__(self):
+        self.bot = None
+        self._loop = None
+        self._event = None
+        self._inflight = set()
+        self._sent_times = deque(maxlen=10_000)
+        self.sent_total = 0
+        self.failed_total = 0
+        self.limiter = RateLimiter(GLOBAL_RATE, PER_CHAT_INTERVAL)
+        self.sem = None
+
+    def wake(self):
+        """Можно звать из любого потока: новые сообщения в очереди"""
+        if self._loop and self._event:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def run(self, bot):
+        self.bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self.sem = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        print("📤 Telegram outbox запущен")
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                print("❌ Ошибка в tg_outbox:", e)
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+
+    async def drain(self):
+        """Отправляет всё, что уже пора отправлять"""
+        while True:
+            rows = await run_db(_claim_due, BATCH_SIZE)
+            if not rows:
+                return
+            for r in rows:
+                self._inflight.add(r["id"])
+            try:
+                results = await asyncio.gather(*(self._deliver(r) for r in rows))
+                await WRITER.run(_store_results_tx, results)
+            finally:
+                for r in rows:
+                    self._inflight.discard(r["id"])
+
+    async def _deliver(self, r: dict) -> dict:
+        from aiogram.exceptions import (
+            TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+        )
+        from aiogram.types import InlineKeyboardMarkup
+
+        markup = (
+            InlineKeyboardMarkup.model_validate_json(r["reply_markup"])
+            if r["reply_markup"] else None
+        )
+        async with self.limiter.slot(r["chat_id"]), self.sem:
+            try:
+                if r["method"] == "edit":
+                    await self.bot.edit_message_text(
+                        chat_id=r["chat_id"], message_id=r["message_id"],
+                        text=r["text"], parse_mode="HTML", reply_markup=markup,
+                    )
+                    message_id = r["message_id"]
+                else:
+                    msg = await self.bot.send_message(
+                        r["chat_id"], r["text"], parse_mode="HTML", reply_markup=markup,
+                    )
+                    message_id = msg.message_id
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                return {**r, "result": "retry", "delay": e.retry_after, "error": str(e), "count": False}
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                print(f"⚠️ Telegram отклонил сообщение в чат {r['chat_id']}: {e}")
+                self.failed_total += 1
+                return {**r, "result": "failed", "error": str(e)}
+            except Exception as e:
+                print(f"⚠️ Ошибка отправки в чат {r['chat_id']}: {e}")
+                if r["attempts"] + 1 >= MAX_ATTEMPTS:
+                    self.failed_total += 1
+                    return {**r, "result": "failed", "error": str(e)}
+                return {**r, "result": "retry", "delay": 2 ** r["attempts"], "error": str(e), "count": True}
+        self.sent_total += 1
+        self._sent_times.append(time.time())
+        return {**r, "result": "sent", "message_id": message_id}
+
+    # --- метрики ---
+    def throughput(self, window: float = 60.0) -> float:
+        border = time.time() - window
+        return sum(1 for t in self._sent_times if t >= border) / window
+
+    async def metrics(self) -> dict:
+        depth, oldest, failed = await run_db(_queue_state)
+        return {
+            "depth": depth,
+            "lag_sec": round(time.time() - oldest, 1) if oldest else 0,
+            "failed": failed,
+            "inflight": len(self._inflight),
+            "sent_since_start": self.sent_total,
+            "failed_since_start": self.failed_total,
+            "throughput_per_sec": round(self.throughput(), 2),
+        }
+
+
+# === Синхронная часть (чтение — через run_db, запись — через WRITER) ===
+def _claim_due(limit: int) -> list:
+    conn = get_conn()
+    rows = [dict(r) for r in conn.execute(
+        "SELECT * FROM tg_outbox WHERE status='pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (time.time(), limit),
+    ).fetchall()]
+    conn.close()
+    return rows
+
+
+def _store_results_tx(conn, results: list):
+    """Итоги отправки — в транзакции писателя (backend/writer.py)"""
+    now = time.time()
+    sent = [r for r in results if r["result"] == "sent"]
+    retry = [r for r in results if r["result"] == "retry"]
+    failed = [r for r in results if r["result"] == "failed"]
+    conn.executemany(
+        "UPDATE tg_outbox SET status='sent', sent_at=?, message_id=?, attempts=attempts+1 WHERE id=?",
+        [(now, r["message_id"], r["id"]) for r in sent],
+    )
+    conn.executemany(
+        "INSERT INTO tg_notifications(protection_id, chat_id, message_id, created_at) VALUES (?,?,?,?)",
+        [
+            (r["protection_id"], r["chat_id"], r["message_id"], now_iso())
+            for r in sent
+            if r["method"] == "send" and r["protection_id"]
+        ],
+    )
+    conn.executemany(
+        "UPDATE tg_outbox SET next_attempt_at=?, attempts=attempts+?, error=? WHERE id=?",
+        [(now + r["delay"], 1 if r["count"] else 0, r["error"], r["id"]) for r in retry],
+    )
+    conn.executemany(
+        "UPDATE tg_outbox SET status='failed', attempts=attempts+1, error=? WHERE id=?",
+        [(r["error"], r["id"]) for r in failed],
+    )
+
+
+def _queue_state():
+    conn = get_conn()
+    depth, oldest = conn.execute(
+        "SELECT COUNT(*), MIN(created_at) FROM tg_outbox WHERE status='pending'"
+    ).fetchone()
+    failed = conn.execute("SELECT COUNT(*) FROM tg_outbox WHERE status='failed'").fetchone()[0]
+    conn.close()
+    return depth, oldest, failed
+
+
+OUTBOX = OutboxWorker()
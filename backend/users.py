@@ -4,6 +4,8 @@ from pydantic import BaseModel
 from datetime import datetime
 
 from backend.db import get_conn, now_iso
+from backend.principal import users_changed
+from backend.writer import WRITER
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
@@ -46,16 +48,17 @@ def init_users_table():
 
 
 # === Добавить пользователя ===
-@router.post("/")
-def add_user(data: UserCreate):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
+def _add_user_tx(conn, data: UserCreate):
+    conn.execute(
         "INSERT OR REPLACE INTO users (tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
         (data.tg_id, data.tg_username, data.first_name, data.role, now_iso()),
     )
-    conn.commit()
-    conn.close()
+    conn.on_commit(users_changed)
+
+
+@router.post("/")
+def add_user(data: UserCreate):
+    WRITER.call(_add_user_tx, data)
     return {"ok": True}
 
 
@@ -70,21 +73,22 @@ def list_users():
 
 
 # === Привязать помощника к менеджеру ===
-@router.post("/link-assistant")
-def link_assistant(data: LinkAssistant):
-    conn = get_conn()
+def _link_assistant_tx(conn, data: LinkAssistant):
     cur = conn.cursor()
     # Проверяем, что оба пользователя есть
     mgr = cur.execute("SELECT * FROM users WHERE id=?", (data.manager_id,)).fetchone()
     asst = cur.execute("SELECT * FROM users WHERE id=?", (data.assistant_id,)).fetchone()
 
     if not mgr or not asst:
-        conn.close()
         raise HTTPException(status_code=404, detail="Manager or Assistant not found")
 
     cur.execute("UPDATE users SET manager_id=? WHERE id=?", (data.manager_id, data.assistant_id))
-    conn.commit()
-    conn.close()
+    conn.on_commit(users_changed)
+
+
+@router.post("/link-assistant")
+def link_assistant(data: LinkAssistant):
+    WRITER.call(_link_assistant_tx, data)
     return {"ok": True, "msg": "Assistant linked to manager"}
 
 
@@ -100,9 +104,7 @@ from fastapi import Depends
 from backend.auth import require_admin  # ⚠️ если функция require_admin в main.py — оставь так
 
 # === Обновить пользователя (роль, группа, менеджер, регион) ===
-@router.patch("/{user_id}")
-def update_user(user_id: int, data: dict, user=Depends(require_admin)):
-    conn = get_conn()
+def _update_user_tx(conn, user_id: int, data: dict):
     cur = conn.cursor()
 
     exists = cur.execute("SELECT id FROM users WHERE id=?", (user_id,)).fetchone()
@@ -120,19 +122,24 @@ def update_user(user_id: int, data: dict, user=Depends(require_admin)):
         """,
         {**data, "user_id": user_id},
     )
-    conn.commit()
-    conn.close()
+    conn.on_commit(users_changed)
+
+
+@router.patch("/{user_id}")
+def update_user(user_id: int, data: dict, user=Depends(require_admin)):
+    WRITER.call(_update_user_tx, user_id, data)
     return {"ok": True, "message": "✅ Пользователь обновлён"}
 
 
 # === Удалить пользователя ===
+def _delete_user_tx(conn, user_id: int):
+    conn.execute("DELETE FROM users WHERE id=?", (user_id,))
+    conn.on_commit(users_changed)
+
+
 @router.delete("/{user_id}")
 def delete_user(user_id: int, user=Depends(require_admin)):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    WRITER.call(_delete_user_tx, user_id)
     return {"ok": True, "message": "🗑 Пользователь удалён"}
 
 
@@ -152,6 +159,14 @@ from datetime import timedelta
 SECRET_KEY = "supersecretkey"  # потом можно вынести в .env
 ALGORITHM = "HS256"
 
+def _auth_telegram_tx(conn, tg_id, username, first_name):
+    conn.execute(
+        "INSERT OR IGNORE INTO users (tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
+        (tg_id, username, first_name, "manager", now_iso()),
+    )
+    conn.on_commit(users_changed)
+
+
 @router.post("/auth/telegram")
 def auth_telegram(user: dict):
     """
@@ -166,14 +181,7 @@ def auth_telegram(user: dict):
         raise HTTPException(status_code=400, detail="Missing Telegram user ID")
 
     # 1️⃣ Создаём или обновляем пользователя в БД
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR IGNORE INTO users (tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
-        (tg_id, username, first_name, "manager", now_iso()),
-    )
-    conn.commit()
-    conn.close()
+    WRITER.call(_auth_telegram_tx, tg_id, username, first_name)
 
     # 2️⃣ Генерируем JWT токен
     payload = {
@@ -0,0 +1,109 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+from backend.db import get_conn
+
+# === Единственный писатель: очередь изменений и групповой commit ===
+# Все изменения базы (защиты, users, managers, tg_outbox) идут через
+# WRITER: обработчик отдаёт функцию fn(conn, *args) и ждёт её результат
+# (await WRITER.run(...) из корутин, WRITER.call(...) из потоков). Поток писателя забирает из очереди всё, что
+# успело накопиться, и выполняет одной транзакцией BEGIN IMMEDIATE … COMMIT:
+# каждое изменение — в своём savepoint, так что исключение (404, 409, …)
+# откатывает только его, а остальные группы попадают в тот же commit.
+# Писатель один, поэтому «проверить — записать» (дубли в create_protection,
+# срок в auto_close) внутри fn не гоняется с другими запросами, а
+# «database is locked» между обработчиками не бывает.
+# fn не должна звать conn.commit()/close(); то, что нужно сделать после
+# записи, — conn.on_commit(...), выполнится после commit группы.
+
+GROUP_MAX = 256   # изменений в одной транзакции
+
+
+class Writer:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None   # соединение открытой группы (для вложенных вызовов)
+        self.groups = 0
+        self.jobs = 0
+
+    # --- постановка в очередь ---
+    def submit(self, fn, *args) -> Future:
+        fut = Future()
+        if threading.current_thread() is self._thread:
+            # вызов изнутри изменения — в той же транзакции, очередь ждать нельзя
+            fut.set_running_or_notify_cancel()
+            try:
+                with self._conn.savepoint():
+                    fut.set_result(fn(self._conn, *args))
+            except BaseException as e:
+                fut.set_exception(e)
+            return fut
+        self._queue.put((fn, args, fut))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+        return fut
+
+    def call(self, fn, *args):
+        """Из обычного потока: ставит изменение и ждёт результат"""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn, *args):
+        """Из корутины: event loop не блокируется, пока изменение ждёт своей группы"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    # --- поток писателя ---
+    def _loop(self):
+        while True:
+            group = [self._queue.get()]
+            while len(group) < GROUP_MAX:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(group)
+            except BaseException as e:
+                print("❌ Ошибка писателя:", e)
+                for _, _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _apply(self, group: list):
+        conn = self._conn = get_conn()
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, fut in group:
+                if not fut.set_running_or_notify_cancel():
+                    continue   # ждать результат уже некому
+                try:
+                    with conn.savepoint():
+                        done.append((fut, fn(conn, *args), None))
+                except BaseException as e:
+                    done.append((fut, None, e))
+            conn.commit()
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.rollback()
+            done = [(fut, None, err or e) for fut, _, err in done]
+            raise
+        finally:
+            self._conn = None
+            conn.close()
+            with self._lock:
+                self.groups += 1
+                self.jobs += len(done)
+            for fut, result, err in done:
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(result)
+
+
+WRITER = Writer()
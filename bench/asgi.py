@@ -0,0 +1,61 @@
+"""
+Минимальный in-process клиент ASGI для бенчмарков: гоняет запросы прямо
+через app(scope, receive, send), без сети и без httpx.
+"""
+import asyncio
+import json
+from urllib.parse import urlencode
+
+
+async def call(app, method: str, path: str, params=None, body=None, headers=None):
+    """Возвращает (status, headers: dict, body: bytes)"""
+    raw_body = b""
+    hdrs = [(b"host", b"bench")]
+    if body is not None:
+        raw_body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        hdrs.append((b"content-type", b"application/json"))
+        hdrs.append((b"content-length", str(len(raw_body)).encode()))
+    for k, v in (headers or {}).items():
+        hdrs.append((k.lower().encode(), str(v).encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method.upper(),
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(params or {}, doseq=True).encode(),
+        "headers": hdrs,
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+
+    done = asyncio.Event()
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": raw_body, "more_body": False}
+        await done.wait()  # «клиент» не отключается, пока ответ не дочитан
+        return {"type": "http.disconnect"}
+
+    status, resp_headers, chunks = 0, {}, []
+
+    async def send(message):
+        nonlocal status, resp_headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            resp_headers = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status, resp_headers, b"".join(chunks)
@@ -0,0 +1,129 @@
+"""
+Цена авторизации на запрос: проверка JWT и роль пользователя.
+
+Запуск:  python -m bench.bench_auth [итераций]
+
+Сравнивает прежние get_current_user (jwt.decode на каждый вызов) и
+auth.require_admin (запрос в users на каждый вызов) с кэшем из
+backend/principal.py. Затем проверяет, что смена роли через
+PATCH /api/users/{id} видна сразу, без перевыпуска токена.
+"""
+import asyncio
+import sys
+import time
+
+from fastapi import HTTPException
+from jose import jwt
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+
+def per_call_us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    with bench_db():
+        from backend import main as api, auth
+        from backend.principal import PRINCIPALS
+
+        conn = db.get_conn()
+        conn.executemany(
+            "INSERT INTO users(tg_id, first_name, role, created_at) VALUES (?,?,?,?)",
+            [(1000 + i, f"Пользователь {i}", "superadmin" if i == 0 else "manager", db.now_iso()) for i in range(2000)],
+        )
+        conn.commit()
+        conn.close()
+        token = api.create_token(1, "superadmin")
+
+        def legacy_current_user():
+            payload = jwt.decode(token, api.SECRET_KEY, algorithms=[api.ALGORITHM])
+            return {"id": int(payload["sub"]), "role": payload.get("role", "manager")}
+
+        def legacy_auth_admin():
+            conn = db.get_conn()
+            row = conn.execute("SELECT role FROM users ORDER BY id LIMIT 1").fetchone()
+            conn.close()
+            return {"role": row[0]}
+
+        rows = [
+            ("get_current_user", legacy_current_user, lambda: api.require_admin(api.get_current_user(token))),
+            ("auth.require_admin", legacy_auth_admin, lambda: auth.require_admin(None)),
+        ]
+        for name, before, after in rows:
+            old = per_call_us(before, n)
+            new = per_call_us(after, n)
+            print(f"{name:20} было {old:8.1f} мкс   с кэшем {new:6.2f} мкс   (x{old / new:.0f})")
+        print(f"Кэш токенов: попаданий {PRINCIPALS.hits}, промахов {PRINCIPALS.misses}")
+
+        # смена роли через PATCH сразу действует на уже выданный токен
+        async def demote():
+            status, _, _ = await call(api.app, "PATCH", "/api/users/1", body={"role": "manager"})
+            assert status == 200, status
+
+        assert api.get_current_user(token)["role"] == "superadmin"
+        asyncio.run(demote())
+        assert api.get_current_user(token)["role"] == "manager", "роль не обновилась после PATCH"
+        try:
+            api.require_admin(api.get_current_user(token))
+            raise AssertionError("понижённый пользователь прошёл require_admin")
+        except HTTPException as e:
+            assert e.status_code == 403
+        print("✅ PATCH /api/users/{id} меняет роль уже выданного токена")
+
+        expired = jwt.encode({"sub": "1", "role": "superadmin", "exp": int(time.time()) - 1},
+                             api.SECRET_KEY, algorithm=api.ALGORITHM)
+        try:
+            api.get_current_user(expired)
+            raise AssertionError("истёкший токен принят")
+        except HTTPException as e:
+            assert e.status_code == 401
+        print("✅ истёкший токен отклонён")
+
+        # tg_id одного пользователя совпадает с users.id другого
+        conn = db.get_conn()
+        conn.execute("INSERT INTO users(tg_id, first_name, role, created_at) VALUES (1, 'Тёзка id', 'assistant', ?)",
+                     (db.now_iso(),))
+        conn.commit()
+        conn.close()
+        from backend.principal import users_changed
+        users_changed()
+        legacy_tg = jwt.encode({"sub": "1", "role": "manager"}, api.SECRET_KEY, algorithm=api.ALGORITHM)
+        assert api.get_current_user(legacy_tg)["role"] == "assistant", "старый токен Telegram — только по tg_id"
+        assert api.get_current_user(legacy_tg)["id"] != 1
+        assert api.get_current_user(token) == {"id": 1, "role": "manager"}, "токен с kind=id — только по users.id"
+        forged = jwt.encode({"sub": "1", "kind": "admin", "role": "superadmin"}, api.SECRET_KEY, algorithm=api.ALGORITHM)
+        try:
+            api.get_current_user(forged)
+            raise AssertionError("токен с неизвестным kind принят")
+        except HTTPException as e:
+            assert e.status_code == 401
+        # старый токен супер-админа/dev-login: sub — users.id без kind, exp нет
+        stale = jwt.encode({"sub": "987654321", "role": "superadmin"}, api.SECRET_KEY, algorithm=api.ALGORITHM)
+        try:
+            api.get_current_user(stale)
+            raise AssertionError("токен без kind с чужим sub принят с ролью из токена")
+        except HTTPException as e:
+            assert e.status_code == 401
+        gone = api.create_token(987654321, "superadmin")
+        try:
+            api.get_current_user(gone)
+            raise AssertionError("токен удалённого пользователя принят")
+        except HTTPException as e:
+            assert e.status_code == 401
+        print("✅ sub ищется ровно в одной карте: tg_id не достаёт роль пользователя с таким users.id; "
+              "токен без пользователя в users — 401, роль из токена не действует")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as e:
+        print("❌", e)
+        sys.exit(1)
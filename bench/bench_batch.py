@@ -0,0 +1,176 @@
+"""
+Пакетные действия админа: POST /api/admin/protections/batch против тех же
+действий по одному HTTP-вызову.
+
+Запуск:  python -m bench.bench_batch [действий]
+
+1. Одинаковые наборы действий (approve / reject / extend / close / delete)
+   над разными защитами: сначала по одному через старые эндпоинты, затем
+   одним пакетом. Итоговые статусы и сроки совпадают.
+2. Пакет: ошибочные элементы (нет защиты, не тот статус, нет причины)
+   получают свою ошибку и ничего не меняют; approve и extend одной защиты
+   в одном пакете работают по порядку; history — по записи на применённое
+   действие; заявки на продление закрыты; manager_stats и индекс дублей
+   согласованы; в tg_outbox ровно одно сводное сообщение на получателя.
+3. Без токена админа — отказ, больше BATCH_MAX_ITEMS — 413.
+"""
+import asyncio
+import json
+import random
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+ACTIONS = ("approve", "reject", "extend", "close", "delete")
+
+
+def plan(ids_by_status: dict, n: int, rnd) -> list:
+    """n действий поровну по видам над защитами подходящего статуса"""
+    items = []
+    for i in range(n):
+        action = ACTIONS[i % len(ACTIONS)]
+        pool = ids_by_status["pending" if action in ("approve", "reject") else "active"]
+        pid = pool.pop(rnd.randrange(len(pool)))
+        params = {"approve": {}, "reject": {"reason": "нет документов"}, "extend": {"days": 7},
+                  "close": {"reason": "клиент ушёл"}, "delete": {"reason": "дубль"}}[action]
+        items.append({"id": pid, "action": action, "params": params})
+    return items
+
+
+async def one_by_one(app, admin, item) -> int:
+    pid, action, params = item["id"], item["action"], item["params"]
+    if action == "approve":
+        status, _, _ = await call(app, "POST", f"/api/admin/pending/{pid}/approve", headers=admin)
+    elif action == "reject":
+        status, _, _ = await call(app, "POST", f"/api/admin/pending/{pid}/reject", body=params, headers=admin)
+    elif action == "extend":
+        status, _, _ = await call(app, "POST", f"/api/admin/protections/{pid}/extend-any",
+                                  params={"days": params["days"]}, headers=admin)
+    elif action == "close":
+        status, _, _ = await call(app, "POST", f"/api/protections/{pid}/close", body=params)
+    else:
+        status, _, _ = await call(app, "DELETE", f"/api/protections/{pid}", params=params)
+    return status
+
+
+def state(ids) -> dict:
+    conn = db.get_conn()
+    marks = ",".join("?" * len(ids))
+    out = {r["id"]: (r["status"], r["expires_at"]) for r in
+           conn.execute(f"SELECT id, status, expires_at FROM protections WHERE id IN ({marks})", list(ids))}
+    conn.close()
+    return out
+
+
+def count(sql: str, *params) -> int:
+    conn = db.get_conn()
+    n = conn.execute(sql, params).fetchone()[0]
+    conn.close()
+    return n
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with bench_db(protections=max(50_000, n * 40), managers=50, users=200, history_per_protection=1):
+        from backend import main as api
+        from backend.dup_index import DUP_INDEX, DuplicateIndex
+        from backend.principal import users_changed
+        from backend.stats import check_stats
+
+        users_changed()
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+        api.OUTBOX.wake = lambda: None   # воркер не запущен — сообщения остаются в очереди для проверки
+
+        conn = db.get_conn()
+        ids_by_status = {"pending": [], "active": []}
+        for r in conn.execute("SELECT id, status FROM protections WHERE status IN ('pending', 'active')"):
+            ids_by_status[r["status"]].append(r["id"])
+        conn.close()
+        rnd = random.Random(7)
+        singles, batch = plan(ids_by_status, n, rnd), plan(ids_by_status, n, rnd)
+
+        # --- 1. по одному и пакетом ---
+        t0 = time.perf_counter()
+        for item in singles:
+            assert await one_by_one(app, admin, item) == 200, item
+        single_took = time.perf_counter() - t0
+
+        history_before = count("SELECT COUNT(*) FROM history")
+        outbox_before = count("SELECT COUNT(*) FROM tg_outbox")
+        extend_pid = ids_by_status["pending"].pop()
+        broken = [
+            {"id": 10 ** 9, "action": "close", "params": {"reason": "x"}},            # нет такой
+            {"id": batch[0]["id"], "action": "reject", "params": {}},                 # уже одобрена этим же пакетом
+            {"id": ids_by_status["active"].pop(), "action": "close", "params": {}},   # нет причины
+            {"id": ids_by_status["active"].pop(), "action": "approve", "params": {}}, # не на проверке
+        ]
+        chained = [{"id": extend_pid, "action": "approve", "params": {}},
+                   {"id": extend_pid, "action": "extend", "params": {"days": 3}}]
+        t0 = time.perf_counter()
+        status, _, body = await call(app, "POST", "/api/admin/protections/batch", body=batch + broken + chained, headers=admin)
+        batch_took = time.perf_counter() - t0
+        assert status == 200, (status, body[:300])
+        out = json.loads(body)
+        assert out["applied"] == n + 2 and out["failed"] == 4, (out["applied"], out["failed"])
+        codes = [r.get("status_code") for r in out["results"][n:n + 4]]
+        assert codes == [404, 409, 400, 409], codes
+        assert all(r["ok"] and r["protection"]["id"] == r["id"] for r in out["results"][:n])
+        assert out["results"][-1]["protection"]["status"] == "active"
+
+        def summary(items):
+            got = state([i["id"] for i in items])
+            return sorted((i["action"], got[i["id"]][0]) for i in items)
+
+        assert summary(singles) == summary(batch), "статусы после пакета и по одному расходятся"
+        extended = [i for i in batch if i["action"] == "extend"]
+        conn = db.get_conn()
+        cur = conn.cursor()
+        for i in extended[:50]:
+            created = cur.execute("SELECT expires_at FROM protections WHERE id=?", (i["id"],)).fetchone()[0]
+            resp = next(r for r in out["results"] if r["id"] == i["id"])
+            assert resp["protection"]["expires_at"] == created
+        assert check_stats(cur) == [], check_stats(cur)
+        fresh = DuplicateIndex()
+        fresh.rebuild(cur)
+        conn.close()
+        assert len(fresh) == len(DUP_INDEX), (len(fresh), len(DUP_INDEX))
+        assert count("SELECT COUNT(*) FROM history") - history_before == n + 2
+        marks = ",".join("?" * len(extended))
+        assert count(f"SELECT COUNT(*) FROM extend_requests WHERE status='pending' AND protection_id IN ({marks})",
+                     *[i["id"] for i in extended]) == 0
+
+        conn = db.get_conn()
+        chats = [r[0] for r in conn.execute("SELECT chat_id FROM tg_outbox WHERE id > ?", (outbox_before,))]
+        managers = {r[0] for r in conn.execute(
+            f"SELECT DISTINCT manager_id FROM protections WHERE id IN ({','.join('?' * (n + 1))})",
+            [i["id"] for i in batch] + [extend_pid])}
+        conn.close()
+        expected = set()
+        for tg_ids in api.RECIPIENTS.for_managers(managers).values():
+            expected.update(tg_ids)
+        assert len(chats) == len(set(chats)) and set(chats) == expected, (len(chats), len(expected))
+        print(f"✅ пакет из {n + 6}: {out['applied']} применено, {out['failed']} с ошибкой; статусы как по одному; "
+              f"history, manager_stats, индекс дублей и заявки согласованы; в tg_outbox {len(chats)} сводок "
+              f"(по одной на получателя)")
+        text, _ = api._new_protection_message({"id": 1, "manager": "Иванов & Ко", "partner": "<Пол>", "sku": "4031"})
+        assert "Иванов &amp; Ко" in text and "&lt;Пол&gt;" in text and "<b>Новая защита" in text, text
+        print("✅ имена и артикулы в тексте для parse_mode=HTML экранированы, разметка шаблона — нет")
+
+        # --- 3. права и лимит ---
+        status, _, _ = await call(app, "POST", "/api/admin/protections/batch", body=batch[:1])
+        assert status in (401, 403), status
+        too_many = [{"id": 1, "action": "delete"}] * (api.BATCH_MAX_ITEMS + 1)
+        status, _, _ = await call(app, "POST", "/api/admin/protections/batch", body=too_many, headers=admin)
+        assert status == 413, status
+        print("✅ без админа — отказ, сверх лимита — 413")
+
+        print(f"{n} действий по одному: {single_took * 1000:.0f} мс; одним пакетом: {batch_took * 1000:.0f} мс "
+              f"({single_took / batch_took:.0f}×)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Экономия от ETag/304 и gzip для клиента, который постоянно перезапрашивает
+списки (как App.jsx / AdminPage.jsx в Telegram WebApp).
+
+Запуск:  python -m bench.bench_conditional [опросов] [защит]
+
+Один и тот же набор запросов гоняется дважды: «как раньше» (без
+If-None-Match, без сжатия) и «как браузер с кэшем» (gzip + If-None-Match
+из прошлого ответа). Между опросами иногда создаётся защита — ETag должен
+смениться и клиент получить свежие данные. Кроме серверного времени
+печатается оценка для мобильной сети (RTT + полоса, см. MOBILE_*).
+"""
+import asyncio
+import gzip
+import json
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db, manager_names
+
+MOBILE_RTT_MS = 150          # 3G/слабый LTE
+MOBILE_KBIT_PER_SEC = 1500
+MUTATE_EVERY = 10
+
+
+def mobile_ms(nbytes: int) -> float:
+    return MOBILE_RTT_MS + nbytes * 8 / MOBILE_KBIT_PER_SEC
+
+
+async def poll(app, requests: list, rounds: int, cached: bool) -> dict:
+    etags = {}
+    stats = {"bytes": 0, "server_ms": 0.0, "mobile_ms": 0.0, "304": 0, "requests": 0}
+    for i in range(rounds):
+        if i and i % MUTATE_EVERY == 0:
+            status, _, _ = await call(app, "POST", "/api/protections", body={
+                "manager": "Менеджер 0000",
+                "sku_data": [{"sku": f"POLL-{cached}-{i}", "type": "замок", "area": 120}],
+            })
+            assert status == 200, status
+        for path, params in requests:
+            key = (path, tuple(sorted((params or {}).items())))
+            headers = {"accept-encoding": "gzip" if cached else "identity"}
+            if cached and key in etags:
+                headers["if-none-match"] = etags[key]
+            t0 = time.perf_counter()
+            status, resp_headers, body = await call(app, "GET", path, params=params, headers=headers)
+            took = (time.perf_counter() - t0) * 1000
+            assert status in (200, 304), (path, status)
+            if status == 200 and resp_headers.get("content-encoding") == "gzip":
+                json.loads(gzip.decompress(body))
+            if status == 304:
+                stats["304"] += 1
+            if "etag" in resp_headers:
+                etags[key] = resp_headers["etag"]
+            stats["requests"] += 1
+            stats["bytes"] += len(body)
+            stats["server_ms"] += took
+            stats["mobile_ms"] += mobile_ms(len(body))
+    return stats
+
+
+async def check_invalidation(app):
+    params = {"manager": "Менеджер 0001"}
+    _, h1, _ = await call(app, "GET", "/api/protections", params=params)
+    status, _, _ = await call(app, "GET", "/api/protections", params=params, headers={"if-none-match": h1["etag"]})
+    assert status == 304, status
+    status, _, _ = await call(app, "POST", "/api/protections", body={
+        "manager": "Менеджер 0001", "sku_data": [{"sku": "INVALIDATE-1", "type": "клей", "area": 300}],
+    })
+    assert status == 200, status
+    status, h2, body = await call(app, "GET", "/api/protections", params=params, headers={"if-none-match": h1["etag"]})
+    assert status == 200 and h2["etag"] != h1["etag"], (status, h2.get("etag"))
+    assert any(p["sku"].startswith("INVALIDATE-1") for p in json.loads(body))
+    print("✅ после создания защиты ETag сменился, клиент получил новые данные")
+
+
+async def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    protections = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    with bench_db(protections=protections, managers=50, users=200):
+        from backend import main as api
+
+        manager = manager_names(50)[0]
+        requests = [
+            ("/api/protections", {"manager": manager}),
+            ("/api/stats", None),
+            ("/api/managers", None),
+            ("/api/history", {"protection_id": 1}),
+            ("/api/skus", None),
+        ]
+        before = await poll(api.app, requests, rounds, cached=False)
+        after = await poll(api.app, requests, rounds, cached=True)
+
+        print(f"{rounds} опросов × {len(requests)} запросов, защит в базе: {protections}, мутация каждые {MUTATE_EVERY}")
+        print(f"{'':24}{'без кэша':>14}{'ETag + gzip':>14}")
+        print(f"{'байт передано':24}{before['bytes']:>14,}{after['bytes']:>14,}")
+        print(f"{'время сервера, мс':24}{before['server_ms']:>14.0f}{after['server_ms']:>14.0f}")
+        print(f"{'оценка мобильной сети, с':24}{before['mobile_ms'] / 1000:>14.1f}{after['mobile_ms'] / 1000:>14.1f}")
+        print(f"{'ответов 304':24}{before['304']:>14}{after['304']:>14}")
+        print(f"Экономия трафика: {100 - after['bytes'] / before['bytes'] * 100:.1f}%")
+        await check_invalidation(api.app)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
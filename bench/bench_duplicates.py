@@ -0,0 +1,122 @@
+"""
+Бенчмарк проверки дублей: старый полный проход vs индекс DUP_INDEX.
+
+Запуск:  python -m bench.bench_duplicates [кол-во активных защит]
+
+Заодно сверяет результаты обеих реализаций на случайных запросах —
+если хоть один ответ разошёлся, скрипт падает с AssertionError.
+Многоартикульные защиты сравниваются по каждому артикулу (protection_items).
+"""
+import random
+import sys
+import time
+
+import backend.db as db
+from bench.data import bench_db
+
+
+def legacy_check_duplicate(cur, sku_data, area_m2=None):
+    """Старая логика check_duplicate: все активные строки + regex на каждую"""
+    from backend.dup_index import normalize_sku
+    from backend.items import dup_pairs, parse_display
+
+    rows = cur.execute(
+        "SELECT id, manager, partner, sku, area_m2, expires_at, status FROM protections WHERE status = 'active'"
+    ).fetchall()
+    results = []
+    for item in sku_data:
+        sku = item.get("sku")
+        area = item.get("area") or area_m2
+        if not sku or not area:
+            continue
+        sku_norm = normalize_sku(sku)
+        for row in rows:
+            _, p_manager, p_partner, p_sku, p_area, p_expires, _ = row
+            if not p_area:
+                continue
+            if not any(sku_norm == key and key_area * 0.9 <= float(area) <= key_area * 1.1
+                       for key, key_area in dup_pairs(parse_display(p_sku, p_area), p_area)):
+                continue
+            results.append({
+                "manager": p_manager,
+                "partner": p_partner,
+                "sku": p_sku,
+                "area_m2": p_area,
+                "expires_at": p_expires,
+            })
+    return results
+
+
+def fill(n: int):
+    from backend.items import parse_display, write_items
+
+    skus = [s["sku"] for s in db.load_skus()] or [str(4000 + i) for i in range(300)]
+    conn = db.get_conn()
+    cur = conn.cursor()
+    now = db.now_iso()
+    rows = []
+    for i in range(n):
+        sku = random.choice(skus)
+        kind = random.random()
+        if kind < 0.7:
+            sku_text = f"{sku} (замок)"
+        elif kind < 0.9:
+            sku_text = sku
+        else:
+            sku_text = f"{sku} (клей) — 120 м²; {random.choice(skus)} (замок) — 80 м²"
+        rows.append((
+            f"Менеджер {i % 50}", "", f"Партнёр {i % 300}", "", sku_text,
+            round(random.uniform(50, 2000), 1), "", "", "", "",
+            "active" if random.random() < 0.85 else "closed", now, db.add_days(now, 10),
+        ))
+    cur.executemany("""
+        INSERT INTO protections(manager, client, partner, partner_city, sku, area_m2, last4,
+                                object_city, address, comment, status, created_at, expires_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, rows)
+    write_items(cur, [(pid, parse_display(row[4], row[5])) for pid, row in enumerate(rows, start=1)], replace=False)
+    conn.commit()
+    conn.close()
+    return skus
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    random.seed(42)
+    with bench_db():
+        from backend import main as api
+        from backend.dup_index import DUP_INDEX
+
+        skus = fill(n)
+        conn = db.get_conn()
+        cur = conn.cursor()
+
+        t0 = time.perf_counter()
+        DUP_INDEX.rebuild(cur)
+        print(f"Индекс: {len(DUP_INDEX)} активных защит, построен за {time.perf_counter() - t0:.2f} с")
+
+        queries = []
+        for _ in range(200):
+            k = random.randint(1, 3)
+            queries.append([
+                {"sku": f"{random.choice(skus)} (замок)", "area": round(random.uniform(50, 2000), 1)}
+                for _ in range(k)
+            ])
+
+        t0 = time.perf_counter()
+        legacy = [legacy_check_duplicate(cur, q) for q in queries[:20]]
+        legacy_ms = (time.perf_counter() - t0) / 20 * 1000
+
+        t0 = time.perf_counter()
+        indexed = [api.check_duplicate({"sku_data": q}) for q in queries]
+        indexed_ms = (time.perf_counter() - t0) / len(queries) * 1000
+
+        assert legacy == indexed[:20], "результаты индекса расходятся со старой логикой"
+        print(f"Старый проход:  {legacy_ms:8.2f} мс / запрос")
+        print(f"Индекс:         {indexed_ms:8.3f} мс / запрос")
+        print(f"Ускорение:      x{legacy_ms / indexed_ms:.0f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Время в секундах Unix (*_ts) рядом с ISO-строками: миграция и выборки по срокам.
+
+Запуск:  python -m bench.bench_epoch [защит]
+
+1. База «как до миграции» (user_version 0: без *_ts, со всеми триггерами,
+   FTS и заявками, часть users.created_at в местном времени) мигрирует при
+   init_storage: данные, AUTOINCREMENT, индексы и триггеры на месте, FTS
+   и manager_stats целы, *_ts совпадают со строками, users.created_at в UTC.
+   Второй старт миграцию не повторяет.
+2. После миграции вставки и правки сами заполняют *_ts; days_left в
+   /api/protections и row_to_out совпадает с прежним расчётом по строке.
+3. Скорость: выборка «истекает в ближайшие 2 дня» по строке и по
+   expires_ts, days_left по строке (julianday) и по expires_ts, загрузка
+   планировщика сроков (разбор строк против готовых секунд).
+"""
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+
+import backend.db as db
+import backend.migrations as migrations
+from bench.asgi import call
+from bench.data import bench_db, manager_names
+
+ROUNDS = 5
+
+
+def best(fn, rounds: int = ROUNDS) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def snapshot(conn) -> dict:
+    return {
+        "protections": conn.execute("SELECT * FROM protections ORDER BY id").fetchall(),
+        "history": conn.execute("SELECT COUNT(*), MAX(id), SUM(LENGTH(at)) FROM history").fetchone(),
+        "seq": sorted(tuple(r) for r in conn.execute("SELECT name, seq FROM sqlite_sequence")),
+        "triggers": sorted(r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger'")),
+    }
+
+
+def iso_ts(value: str) -> int:
+    return int(datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc).timestamp())
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    # --- 1. база до миграции ---
+    applied, migrations.MIGRATIONS = migrations.MIGRATIONS, []
+    with bench_db(protections=protections, managers=50, users=200) as sizes:
+        from backend import main as api
+        from backend.expiry import EXPIRY, iso_to_ts
+        from backend.stats import check_stats
+
+        conn = db.get_conn()
+        # индекс по строке, который раньше создавал _safe_migrate
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_protections_status_expires ON protections(status, expires_at)")
+        conn.execute("UPDATE users SET created_at = datetime('now', 'localtime') WHERE id % 10 = 0")
+        conn.execute("DELETE FROM protections WHERE id = (SELECT MAX(id) FROM protections)")   # хвост для AUTOINCREMENT
+        conn.commit()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+        before = snapshot(conn)
+        local = conn.execute("SELECT COUNT(*) FROM users WHERE created_at NOT LIKE '%Z'").fetchone()[0]
+        old_expiring_sql = "SELECT COUNT(*) FROM protections WHERE status='active' AND expires_at <= ?"
+        border_iso = db.add_days(db.now_iso(), 2)
+        old_expiring = conn.execute(old_expiring_sql, (border_iso,)).fetchone()[0]
+        old_days_sql = (
+            "SELECT CAST(julianday(expires_at) - julianday('now') + 1000000 AS INTEGER) - 1000000 "
+            "FROM protections WHERE status != 'deleted'"
+        )
+        t_old_range = best(lambda: conn.execute(old_expiring_sql, (border_iso,)).fetchone())
+        t_old_days = best(lambda: conn.execute(old_days_sql).fetchall())
+        conn.close()
+
+        migrations.MIGRATIONS = applied
+        t0 = time.perf_counter()
+        api.init_storage()
+        took = time.perf_counter() - t0
+        conn = db.get_conn()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(applied)
+        after = snapshot(conn)
+        width = len(before["protections"][0])
+        assert [tuple(r)[:width] for r in after["protections"]] == [tuple(r) for r in before["protections"]]
+        assert after["history"] == before["history"] and after["seq"] == before["seq"], (after["seq"], before["seq"])
+        assert after["triggers"] == before["triggers"], set(after["triggers"]) ^ set(before["triggers"])
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        conn.execute("INSERT INTO protections_fts(protections_fts) VALUES('integrity-check')")
+        assert check_stats(conn.cursor()) == []
+        bad = [r for r in conn.execute("SELECT created_at, created_ts, expires_at, expires_ts, closed_at, closed_ts "
+                                       "FROM protections")
+               if r[1] != iso_ts(r[0]) or r[3] != iso_ts(r[2]) or (r[4] and r[5] != iso_ts(r[4]))]
+        assert not bad, bad[:3]
+        assert conn.execute("SELECT COUNT(*) FROM history WHERE at_ts IS NULL").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM users WHERE created_at NOT LIKE '%Z'").fetchone()[0] == 0
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM protections WHERE status='active' AND expires_ts <= ?", (0,)))
+        assert "idx_protections_status_expires_ts" in plan, plan
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='idx_protections_status_expires'").fetchone()[0] == 0
+        conn.close()
+        api.init_storage()   # второй старт — без миграции
+        print(f"✅ миграция {sizes['protections']:,} защит и {sizes['history']:,} записей истории за {took:.1f} с: "
+              f"данные, AUTOINCREMENT, триггеры, FTS и manager_stats целы; {local} users.created_at переведены в UTC")
+
+        # --- 2. запись заполняет *_ts, API не изменился ---
+        status, _, body = await call(api.app, "POST", "/api/protections", body={
+            "manager": manager_names(1)[0], "sku_data": [{"sku": "EPOCH-1", "type": "замок", "area": 120}],
+        })
+        assert status == 200, body
+        created = json.loads(body)
+        status, _, body = await call(api.app, "POST", f"/api/protections/{created['id']}/extend",
+                                     params={"days": 3, "actor": "admin"})
+        extended = json.loads(body)
+        conn = db.get_conn()
+        row = conn.execute("SELECT * FROM protections WHERE id=?", (created["id"],)).fetchone()
+        assert row["expires_ts"] == iso_ts(extended["expires_at"]) and row["created_ts"] == iso_ts(row["created_at"])
+        assert extended["days_left"] == (datetime.fromisoformat(row["expires_at"][:-1]) - datetime.utcnow()).days
+        status, _, body = await call(api.app, "GET", "/api/protections", params={"limit": 1000})
+        for p in json.loads(body):
+            assert p["days_left"] == (datetime.fromisoformat(p["expires_at"][:-1]) - datetime.utcnow()).days, p
+        print("✅ вставка и продление заполняют *_ts; days_left в списке и в ответе на запись — как по строке")
+
+        # --- 3. скорость ---
+        new_expiring_sql = "SELECT COUNT(*) FROM protections WHERE status='active' AND expires_ts <= ?"
+        border = time.time() + 2 * 86400
+        assert conn.execute(new_expiring_sql, (border,)).fetchone()[0] >= old_expiring
+        new_days_sql = (
+            "SELECT CAST((expires_ts - (julianday('now') - 2440587.5) * 86400.0) / 86400.0 + 1000000 AS INTEGER) "
+            "- 1000000 FROM protections WHERE status != 'deleted'"
+        )
+        t_new_range = best(lambda: conn.execute(new_expiring_sql, (border,)).fetchone())
+        t_new_days = best(lambda: conn.execute(new_days_sql).fetchall())
+        active = conn.execute("SELECT id, expires_at, expires_ts FROM protections WHERE status='active'").fetchall()
+        conn.close()
+        t_load_old = best(lambda: [iso_to_ts(r["expires_at"]) for r in active])
+        t_load_new = best(lambda: [float(r["expires_ts"]) for r in active])
+        t_scheduler = best(EXPIRY.load, 3)
+        print(f"«истекает в 2 дня»: по строке {t_old_range * 1000:.2f} мс, по expires_ts {t_new_range * 1000:.2f} мс")
+        print(f"days_left по всем строкам: julianday(expires_at) {t_old_days * 1000:.0f} мс, "
+              f"expires_ts {t_new_days * 1000:.0f} мс ({t_old_days / t_new_days:.1f}×)")
+        print(f"сроки {len(active):,} активных для планировщика: разбор строк {t_load_old * 1000:.0f} мс, "
+              f"готовые секунды {t_load_new * 1000:.0f} мс; EXPIRY.load целиком {t_scheduler * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
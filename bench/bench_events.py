@@ -0,0 +1,178 @@
+"""
+Лента /api/events (SSE): фильтрация, докачка по Last-Event-ID и цена
+простаивающих подписчиков.
+
+Запуск:  python -m bench.bench_events [подписчиков]
+
+1. Через настоящий эндпоинт (с Accept-Encoding: gzip) проверяет, что менеджер
+   видит только свои защиты, а админ — все, и что события не застревают в gzip.
+2. Переподключение с Last-Event-ID досылает ровно пропущенное; id из
+   прошлого запуска процесса даёт «resync».
+3. Держит N подписчиков без событий и меряет процессорное время, затем
+   одно изменение — и время, за которое его получили все.
+"""
+import asyncio
+import sys
+import time
+from urllib.parse import urlencode
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db, manager_names
+
+
+class SSEClient:
+    """Открывает GET /api/events прямо в ASGI-приложении и читает события"""
+
+    def __init__(self, app, params: dict, headers: dict = None):
+        self.app = app
+        self.params = params
+        self.headers = headers or {}
+        self.status = None
+        self.response_headers = {}
+        self.events = []       # (id, event, data)
+        self._buf = b""
+        self._closed = asyncio.Event()
+        self._task = None
+
+    async def _receive(self):
+        await self._closed.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.response_headers = {k.decode(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            self._buf += message.get("body", b"")
+            while b"\n\n" in self._buf:
+                frame, self._buf = self._buf.split(b"\n\n", 1)
+                fields = dict(
+                    line.split(": ", 1) for line in frame.decode().split("\n") if ": " in line and not line.startswith(":")
+                )
+                if "event" in fields:
+                    self.events.append((fields.get("id"), fields["event"], fields.get("data")))
+
+    async def open(self):
+        hdrs = [(b"host", b"bench")] + [(k.encode(), v.encode()) for k, v in self.headers.items()]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/api/events", "raw_path": b"/api/events", "root_path": "",
+            "query_string": urlencode(self.params).encode(), "headers": hdrs,
+            "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        self._task = asyncio.create_task(self.app(scope, self._receive, self._send))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if self.status:
+                break
+        return self
+
+    async def close(self):
+        self._closed.set()
+        await asyncio.wait_for(self._task, 5)
+
+    def kinds(self) -> list:
+        return [e for _, e, _ in self.events]
+
+
+async def wait_for(cond, timeout: float = 3.0):
+    t0 = time.perf_counter()
+    while not cond():
+        if time.perf_counter() - t0 > timeout:
+            raise AssertionError("не дождались событий")
+        await asyncio.sleep(0.01)
+
+
+async def create(app, manager: str, n: int):
+    status, _, _ = await call(app, "POST", "/api/protections", body={
+        "manager": manager, "sku_data": [{"sku": f"EV-{n}", "type": "замок", "area": 100}],
+    })
+    assert status == 200, status
+
+
+async def main():
+    n_subs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with bench_db(protections=2000, managers=20, users=100):
+        from backend import main as api
+        from backend.events import EVENTS, Subscriber
+
+        app = api.app
+        m0, m1 = manager_names(2)
+
+        # токены: супер-админ (users.id=1) и менеджер m0 (users.id=2, managers.user_id у m0)
+        admin_token = api.create_token(1, "superadmin")
+        m0_token = api.create_token(2, "manager")
+
+        # --- 1. фильтрация через настоящий эндпоинт ---
+        gz = {"accept-encoding": "gzip"}
+        admin = await SSEClient(app, {"token": admin_token}, gz).open()
+        mine = await SSEClient(app, {"token": m0_token}, gz).open()
+        status, _, _ = await call(app, "GET", "/api/events", params={"token": "bad"})
+        assert status == 401, status
+        assert admin.status == 200 and admin.response_headers.get("content-encoding") == "identity"
+
+        await create(app, m0, 1)
+        await create(app, m1, 2)
+        await wait_for(lambda: admin.kinds().count("protection") == 2)
+        await wait_for(lambda: mine.kinds().count("protection") == 1)
+        await asyncio.sleep(0.05)
+        assert mine.kinds() == ["protection", "stats"], mine.kinds()
+        assert f'"manager":"{m0}"' in mine.events[0][2]
+        print("✅ менеджер видит только свои события, админ — все; gzip не мешает")
+
+        # --- 2. докачка ---
+        last_id = admin.events[-1][0]
+        await admin.close()
+        await mine.close()
+        for i in range(3):
+            await create(app, m1, 10 + i)
+        again = await SSEClient(app, {"token": admin_token}, {"last-event-id": last_id}).open()
+        await wait_for(lambda: again.kinds().count("protection") == 3)
+        assert again.kinds() == ["protection", "stats"] * 3, again.kinds()
+        await again.close()
+        stale = await SSEClient(app, {"token": admin_token, "last_event_id": "0:5"}).open()
+        await wait_for(lambda: stale.kinds() == ["resync"])
+        await stale.close()
+        print("✅ Last-Event-ID досылает пропущенное, чужой id — resync")
+
+        # --- 3. много простаивающих подписчиков ---
+        got = [0]
+        target = [None]
+
+        async def consume(sub):
+            async for frame in EVENTS.stream(sub):
+                if target[0] and frame.startswith(b"id:"):
+                    got[0] += 1
+
+        conn = db.get_conn()
+        ids = dict(conn.execute("SELECT name, id FROM managers"))
+        conn.close()
+        names = manager_names(20)
+        subs = [Subscriber(None if i % 50 == 0 else {ids[names[i % 20]]}) for i in range(n_subs)]
+        tasks = [asyncio.create_task(consume(s)) for s in subs]
+        await asyncio.sleep(0.2)
+        cpu0 = time.process_time()
+        await asyncio.sleep(2)
+        idle_cpu = (time.process_time() - cpu0) / 2 * 100
+        print(f"{n_subs} подписчиков без событий: CPU {idle_cpu:.1f}% (подписчиков на шине: {EVENTS.subscribers})")
+
+        expected = sum(1 for s in subs if s.managers is None or ids[m0] in s.managers) * 2  # protection + stats
+        target[0] = m0
+        t0 = time.perf_counter()
+        await create(app, m0, 99)
+        await wait_for(lambda: got[0] >= expected, timeout=10)
+        print(f"Изменение доставлено {expected // 2} заинтересованным подписчикам за {(time.perf_counter() - t0) * 1000:.1f} мс")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert EVENTS.subscribers == 0, EVENTS.subscribers
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except AssertionError as e:
+        print("❌", e)
+        sys.exit(1)
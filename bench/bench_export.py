@@ -0,0 +1,167 @@
+"""
+Потоковая выгрузка /api/export и /api/export/history: миллион строк при
+фиксированном потолке памяти.
+
+Запуск:  python -m bench.bench_export [защит] [потолок МБ]
+
+Ответ читается из ASGI-приложения кусками и пишется во временный файл —
+как браузер, который качает файл. Во время выгрузки снимается RssAnon
+процесса (без страниц mmap самой базы); рост сверх
+потолка — ошибка. Затем файл разбирается обратно: число строк, кириллица,
+BOM у CSV, корректный XML листа у XLSX. Фильтры сверяются с /api/protections.
+"""
+import asyncio
+import csv
+import json
+import sys
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from urllib.parse import urlencode
+from xml.etree.ElementTree import iterparse
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db, manager_names
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def rss_anon_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def download(app, path: str, params: dict, out: Path) -> dict:
+    """GET в файл (gzip распаковывается на лету); возвращает заголовки, размер и пик памяти"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": urlencode(params).encode(),
+        "headers": [(b"host", b"bench"), (b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    info = {"bytes": 0, "chunks": 0}
+    base = rss_anon_mb()
+    peak = [base]
+    done = asyncio.Event()
+    gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    async def receive():
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    with open(out, "wb") as f:
+        async def send(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+                info["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                info["bytes"] += len(body)
+                if info["headers"].get("content-encoding") == "gzip":
+                    body = gunzip.decompress(body)
+                f.write(body)
+                info["chunks"] += 1
+                if info["chunks"] % 50 == 0:
+                    peak[0] = max(peak[0], rss_anon_mb())
+
+        t0 = time.perf_counter()
+        await app(scope, receive, send)
+        info["seconds"] = time.perf_counter() - t0
+        done.set()
+    info["rss_growth_mb"] = max(peak[0], rss_anon_mb()) - base
+    return info
+
+
+def csv_rows(path: Path, sample: int = 3) -> tuple:
+    """(число строк без заголовка, первые sample строк, все id)"""
+    with open(path, "rb") as f:
+        assert f.read(3) == b"\xef\xbb\xbf", "нет BOM"
+    rows, first, ids = 0, [], set()
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f, delimiter=";"):
+            if len(first) < sample:
+                first.append(row)
+            if rows:
+                ids.add(int(row[0]))
+            rows += 1
+    return rows - 1, first, ids
+
+
+def xlsx_count(path: Path, sample: int = 3) -> tuple:
+    """(число строк листа, первые sample строк как списки текстов)"""
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        names = set(zf.namelist())
+        assert {"[Content_Types].xml", "xl/workbook.xml", "xl/worksheets/sheet1.xml"} <= names, names
+        rows, first = 0, []
+        with zf.open("xl/worksheets/sheet1.xml") as sheet:
+            for _, el in iterparse(sheet):
+                if el.tag == SHEET_NS + "row":
+                    rows += 1
+                    if len(first) < sample:
+                        first.append(["".join(c.itertext()) for c in el])
+                    el.clear()
+    return rows, first
+
+
+def report(name: str, info: dict, rows: int, ceiling: float):
+    ok = info["rss_growth_mb"] <= ceiling
+    print(f"{'✅' if ok else '❌'} {name}: {rows:,} строк, {info['bytes'] / 2 ** 20:.1f} МБ по сети за {info['seconds']:.1f} с; "
+          f"рост RssAnon {info['rss_growth_mb']:.1f} МБ (потолок {ceiling:.0f})")
+    return ok
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ceiling = float(sys.argv[2]) if len(sys.argv) > 2 else 64
+    t0 = time.perf_counter()
+    # без init_storage: FTS по миллиону строк выгрузке без поиска не нужен
+    with bench_db(protections=total, managers=200, users=300, history_per_protection=1, storage=False) as sizes:
+        from backend import main as api
+
+        print(f"📦 База: {sizes} за {time.perf_counter() - t0:.0f} с")
+        app = api.app
+        out = db.DB_PATH.parent
+        ok = True
+
+        info = await download(app, "/api/export", {"format": "csv"}, out / "p.csv")
+        assert info["status"] == 200 and info["headers"]["content-type"].startswith("text/csv"), info
+        n_csv, first, _ = csv_rows(out / "p.csv")
+        assert first[0][:3] == ["ID", "Менеджер", "Клиент"], first[0]
+        assert first[1][1].startswith("Менеджер"), first[1]
+        ok &= report("CSV защит", info, n_csv, ceiling)
+
+        info = await download(app, "/api/export", {}, out / "p.xlsx")
+        assert info["status"] == 200 and info["headers"].get("content-encoding") == "identity", info["headers"]
+        assert "attachment" in info["headers"]["content-disposition"]
+        n_rows, first = xlsx_count(out / "p.xlsx")
+        assert first[0][:2] == ["ID", "Менеджер"] and first[1][1].startswith("Менеджер"), first
+        assert n_rows - 1 == min(n_csv, 1_048_575), (n_rows, n_csv)
+        ok &= report("XLSX защит", info, n_rows - 1, ceiling)
+
+        info = await download(app, "/api/export/history", {"format": "csv"}, out / "h.csv")
+        n_hist, _, _ = csv_rows(out / "h.csv")
+        assert n_hist == sizes["history"], (n_hist, sizes["history"])
+        ok &= report("CSV истории", info, n_hist, ceiling)
+
+        # фильтры те же, что у списка
+        manager = manager_names(200)[7]
+        status, _, body = await call(app, "GET", "/api/protections", params={"manager": manager, "status": "active"})
+        expected = {p["id"] for p in json.loads(body)}
+        await download(app, "/api/export", {"format": "csv", "manager": manager, "status": "active"}, out / "m.csv")
+        _, _, got = csv_rows(out / "m.csv")
+        assert got == expected, (len(got), len(expected))
+        print(f"✅ фильтры manager/status совпадают с /api/protections ({len(got)} строк)")
+        status, _, _ = await call(app, "GET", "/api/export", params={"format": "pdf"})
+        assert status == 422, status
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,125 @@
+"""
+Очередь заявок на продление: старый перебор history против extend_requests.
+
+Запуск:  python -m bench.bench_extend_requests [защит]
+
+1. Перенос заявок из history при первом старте: открытыми остаются только
+   заявки по активным защитам, которые админ после них не продлевал.
+2. Жизненный цикл: заявка появляется в списке, продление админом
+   (extend-any) и отказ (deny) её закрывают, закрытие защиты — тоже.
+3. Время списка для админа: как раньше (все extend_request из history +
+   json.loads) и выборка открытых по индексу.
+"""
+import asyncio
+import json
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from backend.extend_requests import open_requests
+from bench.data import bench_db, manager_names
+
+ROUNDS = 20
+
+
+def legacy_list(cur) -> list:
+    """Прежний admin_extend_requests"""
+    rows = cur.execute(
+        """
+        SELECT h.id as hid, h.protection_id, h.at, h.payload,
+               p.manager, p.partner, p.sku, p.expires_at
+        FROM history h
+        JOIN protections p ON p.id = h.protection_id
+        WHERE h.action='extend_request'
+        ORDER BY h.at DESC
+        """
+    ).fetchall()
+    return [{**dict(r), **json.loads(r["payload"] or "{}")} for r in rows]
+
+
+async def open_ids(app, admin) -> set:
+    status, _, body = await call(app, "GET", "/api/admin/extend-requests", headers=admin)
+    assert status == 200, status
+    return {r["protection_id"] for r in json.loads(body)}
+
+
+async def request(app, pid: int) -> int:
+    status, _, body = await call(app, "POST", f"/api/protections/{pid}/request-extend",
+                                 body={"days": 7, "reason": "клиент думает"})
+    assert status == 200, status
+    return json.loads(body)["request_id"]
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with bench_db(protections=protections, managers=50, users=200):
+        from backend import main as api
+
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+
+        # --- 1. перенос ---
+        conn = db.get_conn()
+        cur = conn.cursor()
+        legacy = legacy_list(cur)
+        counts = dict(cur.execute("SELECT status, COUNT(*) FROM extend_requests GROUP BY status").fetchall())
+        assert sum(counts.values()) == len(legacy), (counts, len(legacy))
+        bad = cur.execute("""
+            SELECT COUNT(*) FROM extend_requests r JOIN protections p ON p.id = r.protection_id
+            WHERE r.status = 'pending' AND p.status != 'active'
+        """).fetchone()[0]
+        assert bad == 0, bad
+        conn.close()
+        print(f"✅ перенесено из history: {len(legacy)} заявок, по статусам {counts}")
+
+        # --- 2. жизненный цикл ---
+        pids = []
+        for n in range(3):
+            status, _, body = await call(app, "POST", "/api/protections", body={
+                "manager": manager_names(1)[0], "sku_data": [{"sku": f"EXT-L{n}", "type": "замок", "area": 100}],
+            })
+            assert status == 200, status
+            pids.append(json.loads(body)["id"])
+        granted, denied, closed = pids
+        rids = {pid: await request(app, pid) for pid in pids}
+        assert set(pids) <= await open_ids(app, admin)
+
+        status, _, _ = await call(app, "POST", f"/api/admin/protections/{granted}/extend-any", params={"days": 7}, headers=admin)
+        assert status == 200, status
+        status, _, _ = await call(app, "POST", f"/api/admin/extend-requests/{rids[denied]}/deny", headers=admin)
+        assert status == 200, status
+        status, _, _ = await call(app, "POST", f"/api/admin/extend-requests/{rids[denied]}/deny", headers=admin)
+        assert status == 404, status
+        status, _, _ = await call(app, "POST", f"/api/protections/{closed}/close", body={"reason": "не актуально"})
+        assert status == 200, status
+        assert not set(pids) & await open_ids(app, admin)
+        conn = db.get_conn()
+        final = dict(conn.execute(
+            f"SELECT protection_id, status FROM extend_requests WHERE id IN ({','.join('?' * 3)})", list(rids.values())
+        ).fetchall())
+        conn.close()
+        assert final == {granted: "granted", denied: "denied", closed: "denied"}, final
+        print("✅ заявка видна до решения; extend-any → granted, deny → denied, закрытие защиты → denied")
+
+        # --- 3. время ---
+        conn = db.get_conn()
+        t0 = time.perf_counter()
+        for _ in range(ROUNDS):
+            legacy_list(conn.cursor())
+        old_ms = (time.perf_counter() - t0) / ROUNDS * 1000
+        t0 = time.perf_counter()
+        for _ in range(ROUNDS):
+            n_open = len(open_requests(conn.cursor()))
+        new_ms = (time.perf_counter() - t0) / ROUNDS * 1000
+        plan = " ".join(r["detail"] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM extend_requests WHERE status = 'pending' ORDER BY requested_at DESC"
+        ))
+        conn.close()
+        print(f"запрос списка: было {old_ms:.1f} мс ({len(legacy)} строк, растёт всегда), "
+              f"стало {new_ms:.1f} мс ({n_open} открытых)")
+        print(f"план: {plan}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""
+Повторы POST с заголовком Idempotency-Key (backend/idempotency.py).
+
+Запуск:  python -m bench.bench_idempotency [защит]
+
+1. Повтор создания, «на проверке», продления, успешной, закрытия,
+   одобрения и отклонения с тем же ключом — тот же ответ, изменение
+   выполнено один раз (одна строка, одна запись history, срок +N один раз).
+   Без ключа — как раньше: повтор создания получает 409.
+2. 20 одновременных повторов с одним ключом — одна защита, у всех один ответ.
+   Тот же ключ с другим телом — 422; после 4xx ключ не занят; запись
+   старше TTL не действует и вычищается.
+3. Скорость: повтор создания с ключом (ответ из idempotency_keys) против
+   повтора без ключа (проверка дублей по индексу и 409).
+"""
+import asyncio
+import json
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+ROUNDS = 200
+
+
+def create_body(sku: str, area: float = 300) -> dict:
+    return {"manager": "Менеджер 0001", "sku_data": [{"sku": sku, "type": "замок", "area": area}]}
+
+
+def count(sql: str, *params) -> int:
+    conn = db.get_conn()
+    n = conn.execute(sql, params).fetchone()[0]
+    conn.close()
+    return n
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with bench_db(protections=protections, managers=50, users=100, history_per_protection=1):
+        from backend import idempotency
+        from backend import main as api
+        from backend.writer import WRITER
+
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+
+        async def post(path, body=None, key=None, params=None, headers=None):
+            hdrs = dict(headers or {})
+            if key:
+                hdrs["Idempotency-Key"] = key
+            status, _, raw = await call(app, "POST", path, params=params, body=body, headers=hdrs)
+            return status, json.loads(raw)
+
+        # --- 1. повторы ---
+        first = await post("/api/protections", create_body("IDEM-1"), key="k-create")
+        again = await post("/api/protections", create_body("IDEM-1"), key="k-create")
+        assert first[0] == again[0] == 200 and first == again, (first, again)
+        pid = first[1]["id"]
+        assert count("SELECT COUNT(*) FROM protections WHERE sku LIKE 'IDEM-1%'") == 1
+        status, _ = await post("/api/protections", create_body("IDEM-1"))
+        assert status == 409, "без ключа повтор — по-прежнему дубль"
+
+        ext = [await post(f"/api/protections/{pid}/extend", params={"days": 7}, key="k-extend") for _ in range(3)]
+        assert ext[0] == ext[1] == ext[2] and ext[0][0] == 200
+        assert ext[0][1]["expires_at"] == db.add_days(first[1]["expires_at"], 7), "продлено один раз"
+        assert count("SELECT COUNT(*) FROM history WHERE protection_id=? AND action='extend'", pid) == 1
+        done = [await post(f"/api/protections/{pid}/success", {"doc_1c": "Р-1"}, key="k-success") for _ in range(2)]
+        assert done[0] == done[1] and done[0][1]["status"] == "success"
+        assert count("SELECT COUNT(*) FROM history WHERE protection_id=? AND action='success'", pid) == 1
+
+        other = (await post("/api/protections", create_body("IDEM-2"), key="k-create-2"))[1]["id"]
+        closed = [await post(f"/api/protections/{other}/close", {"reason": "отказ"}, key="k-close") for _ in range(2)]
+        assert closed[0] == closed[1] and closed[0][1]["status"] == "closed"
+        assert count("SELECT COUNT(*) FROM history WHERE protection_id=? AND action='close'", other) == 1
+
+        pending = [await post("/api/protections/pending", create_body("IDEM-3"), key="k-pending") for _ in range(2)]
+        assert pending[0] == pending[1] and pending[0][0] == 200
+        assert count("SELECT COUNT(*) FROM protections WHERE sku LIKE 'IDEM-3%'") == 1
+        approved = [await post(f"/api/admin/pending/{pending[0][1]['id']}/approve", key="k-approve", headers=admin)
+                    for _ in range(2)]
+        assert approved[0] == approved[1] == (200, {"ok": True}), "повтор одобрения — не 404"
+        second = (await post("/api/protections/pending", create_body("IDEM-4"), key="k-pending-2"))[1]["id"]
+        outbox = count("SELECT COUNT(*) FROM tg_outbox")
+        assert (await post("/api/protections/pending", create_body("IDEM-4"), key="k-pending-2"))[1]["id"] == second
+        rejected = [await post(f"/api/admin/pending/{second}/reject", {"reason": "нет"}, key="k-reject", headers=admin)
+                    for _ in range(2)]
+        assert rejected[0] == rejected[1] and rejected[0][0] == 200
+        assert count("SELECT COUNT(*) FROM tg_outbox") == outbox, "повтор не ставит уведомление ещё раз"
+        print("✅ создание, «на проверке», продление, успешная, закрытие, одобрение и отклонение: повтор с ключом — "
+              "тот же ответ, изменение выполнено один раз; без ключа — 409 как раньше")
+
+        # --- 2. одновременные повторы, чужое тело, ошибки, TTL ---
+        jobs = WRITER.jobs
+        burst = await asyncio.gather(*(post("/api/protections", create_body("IDEM-5"), key="k-burst") for _ in range(20)))
+        assert all(r == burst[0] for r in burst) and burst[0][0] == 200, burst
+        assert count("SELECT COUNT(*) FROM protections WHERE sku LIKE 'IDEM-5%'") == 1
+        queued = WRITER.jobs - jobs   # остальные получили ответ до очереди писателя
+        status, body = await post("/api/protections", create_body("IDEM-6"), key="k-burst")
+        assert status == 422, body
+        status, _ = await post(f"/api/protections/{pid}/extend", key="k-burst")
+        assert status == 422, "ключ другого маршрута"
+
+        status, _ = await post("/api/protections", create_body("IDEM-5"), key="k-dup")
+        assert status == 409
+        assert count("SELECT COUNT(*) FROM idempotency_keys WHERE key='k-dup'") == 0, "4xx не сохраняется"
+        status, _ = await post("/api/protections", create_body("IDEM-7", 10), key="k-small")
+        assert status == 400
+        status, _ = await post("/api/protections", create_body("IDEM-7"), key="k-small")
+        assert status == 200, "после 4xx ключ свободен"
+
+        conn = db.get_conn()
+        conn.execute("UPDATE idempotency_keys SET created_ts = created_ts - ? WHERE key='k-small'",
+                     (idempotency.TTL_SECONDS + 1,))
+        conn.commit()
+        conn.close()
+        status, _ = await post("/api/protections", create_body("IDEM-7"), key="k-small")
+        assert status == 409, "ключ старше TTL не действует — повтор снова проверяется на дубли"
+        idempotency._purged_at = 0
+        status, _ = await post("/api/protections", create_body("IDEM-8"), key="k-purge")
+        assert status == 200
+        assert count("SELECT COUNT(*) FROM idempotency_keys WHERE key='k-small'") == 0
+        print(f"✅ 20 одновременных повторов — одна защита ({queued} из 20 дошли до писателя); чужое тело "
+              f"или маршрут — 422; после 4xx ключ свободен; запись старше TTL не действует и вычищается")
+
+        # --- 3. скорость повтора ---
+        async def timed(key):
+            t0 = time.perf_counter()
+            for _ in range(ROUNDS):
+                status, _ = await post("/api/protections", create_body("IDEM-5"), key=key)
+                assert status == (200 if key else 409)
+            return (time.perf_counter() - t0) / ROUNDS
+
+        t_dup = await timed(None)
+        t_replay = await timed("k-burst")
+        print(f"повтор создания на {protections:,} защитах: без ключа (проверка дублей, 409) {t_dup * 1000:.2f} мс, "
+              f"с ключом (ответ из idempotency_keys) {t_replay * 1000:.2f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
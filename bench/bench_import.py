@@ -0,0 +1,196 @@
+"""
+Массовый импорт защит: POST /api/admin/import против POST /api/protections
+по одной строке.
+
+Запуск:  python -m bench.bench_import [строк]
+
+1. Исходная база выгружается через /api/export в CSV и XLSX — это и есть
+   импортируемые файлы (заодно проверяется, что выгрузка читается обратно).
+2. В другую базу (с уже существующими защитами) импортируются оба файла:
+   итоги сходятся, у каждой созданной строки есть запись history, свёртка
+   manager_stats и индекс дублей согласованы с таблицей. Второй импорт того
+   же файла даёт только дубли.
+3. Маленький файл через HTTP: TTL по площади, минимум 50 м², дубль внутри
+   файла, dry_run ничего не пишет, без токена админа — отказ. XLSX с
+   sharedStrings (как сохраняет Excel) читается так же. Защита, созданная
+   обычным запросом между разбором строки и записью её пачки, делает
+   строку дублем (перепроверка в писателе).
+4. Скорость: строк в секунду у импорта и у POST /api/protections.
+"""
+import asyncio
+import io
+import json
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import backend.db as db
+from bench.asgi import call
+from bench.bench_export import download
+from bench.data import bench_db, manager_names
+
+SINGLE_POSTS = 300
+
+
+def count(sql: str, *params) -> int:
+    conn = db.get_conn()
+    n = conn.execute(sql, params).fetchone()[0]
+    conn.close()
+    return n
+
+
+def shared_strings_xlsx(rows: list) -> bytes:
+    """XLSX со строками в sharedStrings.xml и координатами ячеек — как у Excel"""
+    strings, index = [], {}
+
+    def cell(col: int, row: int, value) -> str:
+        ref = f"{chr(65 + col)}{row}"
+        if isinstance(value, (int, float)):
+            return f'<c r="{ref}"><v>{value}</v></c>'
+        if value not in index:
+            index[value] = len(strings)
+            strings.append(value)
+        return f'<c r="{ref}" t="s"><v>{index[value]}</v></c>'
+
+    body = "".join(
+        f'<row r="{r}">' + "".join(cell(c, r, v) for c, v in enumerate(row) if v is not None) + "</row>"
+        for r, row in enumerate(rows, start=1)
+    )
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    sst = f'<sst {ns}>' + "".join(f"<si><t>{s}</t></si>" for s in strings) + "</sst>"
+    out = Path(tempfile.mkstemp(suffix=".xlsx")[1])
+    with zipfile.ZipFile(out, "w") as zf:
+        zf.writestr("xl/worksheets/sheet1.xml", f"<worksheet {ns}><sheetData>{body}</sheetData></worksheet>")
+        zf.writestr("xl/sharedStrings.xml", sst)
+    return out.read_bytes()
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+    from backend import main as api
+    from backend.principal import users_changed
+
+    # --- 1. файлы из выгрузки исходной базы ---
+    with bench_db(protections=total, managers=50, users=100, history_per_protection=1):
+        users_changed()
+        root = db.DB_PATH.parent
+        await download(api.app, "/api/export", {"format": "csv"}, root / "in.csv")
+        await download(api.app, "/api/export", {"format": "xlsx"}, root / "in.xlsx")
+        files = {fmt: (root / f"in.{fmt}").read_bytes() for fmt in ("csv", "xlsx")}
+        exported = count("SELECT COUNT(*) FROM protections WHERE status != 'deleted'")
+
+    # --- 2. импорт в другую базу ---
+    with bench_db(protections=2_000, managers=50, users=100, history_per_protection=1):
+        users_changed()
+        admin = {"token": api.create_token(1, "superadmin")}
+        from backend.bulk_import import iter_rows
+        from backend.dup_index import DUP_INDEX, DuplicateIndex
+        from backend.stats import check_stats
+
+        results = {}
+        for fmt in ("csv", "xlsx"):
+            before = count("SELECT COUNT(*) FROM protections")
+            with io.BytesIO(files[fmt]) as f:
+                t0 = time.perf_counter()
+                report = api.import_protections(iter_rows(f), actor="admin")
+                took = time.perf_counter() - t0
+            assert report["total"] == exported, (report["total"], exported)
+            assert report["created"] + report["duplicates"] + report["invalid"] == report["total"], report
+            created = count("SELECT COUNT(*) FROM protections") - before
+            assert created == report["created"], (created, report["created"])
+            results[fmt] = (report, took)
+            print(f"✅ {fmt.upper()}: {report['total']:,} строк за {took:.2f} с ({report['total'] / took:,.0f} строк/с): "
+                  f"создано {report['created']:,}, дублей {report['duplicates']:,}, ошибок {report['invalid']}")
+        assert results["xlsx"][0]["created"] == 0, "второй импорт тех же строк должен дать только дубли"
+
+        conn = db.get_conn()
+        cur = conn.cursor()
+        assert count("SELECT COUNT(*) FROM history WHERE action='import'") == results["csv"][0]["created"]
+        assert check_stats(cur) == [], check_stats(cur)
+        fresh = DuplicateIndex()
+        fresh.rebuild(cur)
+        conn.close()
+        assert len(fresh) == len(DUP_INDEX), (len(fresh), len(DUP_INDEX))
+        print("✅ history, manager_stats и индекс дублей согласованы; повторный импорт — только дубли")
+
+        # --- 3. правила на маленьком файле через HTTP ---
+        m = manager_names(1)[0]
+        csv_body = "\n".join([
+            "Менеджер;Клиент;Артикул;Площадь, м²;Город объекта",
+            f"{m};Тест 1;IMP-60;60;Москва",
+            f"{m};Тест 2;IMP-150;150,5;Казань",
+            f"{m};Тест 3;IMP-300;300;Омск",
+            f"{m};Тест 4;IMP-800;800;Томск",
+            f"{m};Маленькая;IMP-20;20;Сочи",
+            f"{m};Кривая;IMP-X;много;Сочи",
+            f"{m};Повтор;IMP-800;820;Томск",
+            ";;;;",
+        ]).encode("utf-8-sig")
+        status, _, body = await call(api.app, "POST", "/api/admin/import", body=csv_body)
+        assert status in (401, 403), status
+        status, _, body = await call(api.app, "POST", "/api/admin/import", params={"dry_run": 1}, body=csv_body, headers=admin)
+        report = json.loads(body)
+        assert status == 200 and report["created"] == 4 and count("SELECT COUNT(*) FROM protections WHERE sku LIKE 'IMP-%'") == 0
+        status, _, body = await call(api.app, "POST", "/api/admin/import", body=csv_body, headers=admin)
+        report = json.loads(body)
+        assert status == 200, (status, body[:300])
+        by_row = {r["row"]: r for r in report["rows"]}
+        assert [by_row[n]["status"] for n in range(2, 9)] == ["created"] * 4 + ["invalid", "invalid", "duplicate"], by_row
+        assert by_row[8]["duplicate_of_row"] == 5, by_row[8]
+        conn = db.get_conn()
+        ttl = {}
+        for r in conn.execute("SELECT sku, created_at, expires_at FROM protections WHERE sku LIKE 'IMP-%'"):
+            ttl[r["sku"]] = (datetime.fromisoformat(r["expires_at"][:-1]) - datetime.fromisoformat(r["created_at"][:-1])).days
+        conn.close()
+        assert ttl == {"IMP-60": 5, "IMP-150": 10, "IMP-300": 15, "IMP-800": 30}, ttl
+        xlsx_body = shared_strings_xlsx([
+            ["Менеджер", "Артикул", "Тип", "Площадь"],
+            [m, "IMPX-1", "замок", 120],
+            [m, 771234, "клей", 95.5],
+            [m, "IMP-60", None, 61],
+        ])
+        status, _, body = await call(api.app, "POST", "/api/admin/import", body=xlsx_body, headers=admin)
+        report = json.loads(body)
+        assert status == 200 and [r["status"] for r in report["rows"]] == ["created", "created", "duplicate"], report
+        assert count("SELECT COUNT(*) FROM protections WHERE sku = '771234 (клей) — 95.5 м²'") == 1
+        status, _, body = await call(api.app, "GET", "/api/protections", params={"search": "IMPX-1"})
+        assert status == 200 and [p["sku"] for p in json.loads(body)] == ["IMPX-1 (замок) — 120 м²"], body[:300]
+        status, _, _ = await call(api.app, "POST", "/api/admin/import", params={"format": "xlsx"}, body=b"not a zip", headers=admin)
+        assert status == 400, status
+
+        from backend.writer import WRITER
+
+        def racing_rows():
+            yield 2, {"manager": m, "sku_data": [{"sku": "IMP-RACE", "type": "замок", "area": 200}]}
+            # строка 2 уже разобрана и ждёт в пачке — такую же защиту создаёт обычный запрос
+            racer = WRITER.call(api._create_protection_tx, api.ProtectionCreate(
+                manager=m, sku_data=[{"sku": "IMP-RACE", "type": "замок", "area": 210}]))
+            assert racer.status == "active"
+            yield 3, {"manager": m, "sku_data": [{"sku": "IMP-RACE-2", "type": "замок", "area": 200}]}
+
+        report = api.import_protections(racing_rows(), actor="admin")
+        assert [r["status"] for r in report["rows"]] == ["duplicate", "created"], report
+        assert report["created"] == 1 and report["duplicates"] == 1, report
+        assert count("SELECT COUNT(*) FROM protections WHERE sku LIKE 'IMP-RACE (%'") == 1
+        print("✅ TTL 5/10/15/30, минимум 50 м², дубль внутри файла, dry_run, sharedStrings, поиск по новым строкам, "
+              "права админа; дубль, созданный во время импорта, ловится в писателе")
+
+        # --- 4. по одной строке ---
+        t0 = time.perf_counter()
+        for n in range(SINGLE_POSTS):
+            status, _, _ = await call(api.app, "POST", "/api/protections", body={
+                "manager": m, "sku_data": [{"sku": f"ONE-{n}", "type": "замок", "area": 200}],
+            })
+            assert status == 200, status
+        single = SINGLE_POSTS / (time.perf_counter() - t0)
+        report, took = results["csv"]
+        print(f"POST /api/protections по одной: {single:,.0f} строк/с; импорт CSV: {report['total'] / took:,.0f} строк/с "
+              f"({report['total'] / took / single:.0f}×)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,225 @@
+"""
+Артикулы защиты отдельными строками: protection_items вместо разбора
+protections.sku регуляркой.
+
+Запуск:  python -m bench.bench_items [защит]
+
+1. Миграция 3 на базе с пустой protection_items (плюс строки в форматах "; ",
+   " + ", свободный текст и "—"): каждый артикул — своя строка, площадь
+   под артикулом, у общей площади — NULL, коллекция из каталога; индекс
+   (sku, area_m2) на месте. Та же миграция на копии backend/data.sqlite3.
+2. Запись: создание, редактирование, защита «на проверке», импорт и
+   одобрение пакетом пишут и заменяют артикулы; дубль по одному артикулу
+   многоартикульной защиты теперь ловится (по целой строке — нет); индекс
+   дублей совпадает с пересобранным с нуля.
+3. Спрос: /api/admin/demand/skus и /collections сходятся с подсчётом по
+   разобранным строкам; скорость — разбор всех строк против GROUP BY.
+"""
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+
+import backend.db as db
+import backend.migrations as migrations
+from bench.asgi import call
+from bench.data import bench_db, repo_db_copy
+
+ROUNDS = 5
+MAX_SKUS = 1000
+
+
+def best(fn, rounds: int = ROUNDS) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def items_of(conn, pid) -> list:
+    return [tuple(r) for r in conn.execute(
+        "SELECT sku, type, collection, area_m2 FROM protection_items WHERE protection_id=? ORDER BY id", (pid,))]
+
+
+def legacy_demand(conn) -> dict:
+    """Как считали бы без protection_items: каждая строка protections.sku — регуляркой"""
+    from backend.items import parse_display
+
+    out = defaultdict(set)
+    for pid, sku, area in conn.execute("SELECT id, sku, area_m2 FROM protections WHERE status != 'deleted'"):
+        for item in parse_display(sku, area):
+            out[item[0]].add(pid)
+    return {sku: len(pids) for sku, pids in out.items()}
+
+
+def check_index():
+    from backend.dup_index import DUP_INDEX, DuplicateIndex
+
+    conn = db.get_conn()
+    fresh = DuplicateIndex()
+    fresh.rebuild(conn.cursor())
+    conn.close()
+    assert {p: sorted(e) for p, e in fresh._by_pid.items()} == {p: sorted(e) for p, e in DUP_INDEX._by_pid.items()}
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    from backend import main as api
+    from backend.catalog import CATALOG
+
+    # --- 1. миграция ---
+    with repo_db_copy():
+        api.init_storage()
+        conn = db.get_conn()
+        repo_rows = conn.execute("SELECT COUNT(*) FROM protections").fetchone()[0]
+        repo_items = conn.execute("SELECT COUNT(DISTINCT protection_id) FROM protection_items").fetchone()[0]
+        assert repo_items == repo_rows, (repo_items, repo_rows)
+        conn.close()
+
+    applied, migrations.MIGRATIONS = migrations.MIGRATIONS, migrations.MIGRATIONS[:2]
+    with bench_db(protections=protections, managers=200, users=400, history_per_protection=1):
+        conn = db.get_conn()
+        assert conn.execute("SELECT COUNT(*) FROM protection_items").fetchone()[0] == 0
+        a, b = CATALOG.items[0], CATALOG.items[-1]
+        samples = {
+            f"{a['sku']} ({a['type']}) — 120 м²; {b['sku']} ({b['type']}) — 80.5 м²": 200.5,
+            f"{a['sku']} ({a['type']}) + {b['sku']} ({b['type']})": 300,
+            f"{b['sku']} ({b['type']})": 90,
+            "AF 4010 SPC": 150,
+            "—": 70,
+        }
+        sample_ids = {}
+        for text, area in samples.items():
+            cur = conn.execute(
+                "INSERT INTO protections(manager, sku, area_m2, status, created_at, expires_at) "
+                "VALUES ('', ?, ?, 'active', ?, ?)", (text, area, db.now_iso(), db.add_days(db.now_iso(), 10)))
+            sample_ids[text] = cur.lastrowid
+        conn.commit()
+        conn.close()
+
+        migrations.MIGRATIONS = applied
+        t0 = time.perf_counter()
+        api.init_storage()
+        took = time.perf_counter() - t0
+        conn = db.get_conn()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(applied)
+        got = {text: items_of(conn, pid) for text, pid in sample_ids.items()}
+        ta, tb = (a["sku"], a["type"], a["collection"]), (b["sku"], b["type"], b["collection"])
+        assert list(got.values()) == [
+            [(*ta, 120.0), (*tb, 80.5)],
+            [(*ta, None), (*tb, None)],
+            [(*tb, 90.0)],
+            [("AF4010SPC", "", "", 150.0)],
+            [],
+        ], got
+        total = conn.execute("SELECT COUNT(*) FROM protection_items").fetchone()[0]
+        no_items = conn.execute(
+            "SELECT COUNT(*) FROM protections p WHERE NOT EXISTS "
+            "(SELECT 1 FROM protection_items i WHERE i.protection_id = p.id)").fetchone()[0]
+        assert no_items == 1, no_items   # только "—"
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT protection_id FROM protection_items WHERE sku = ? AND area_m2 BETWEEN ? AND ?",
+            ("4031", 100, 120)))
+        assert "idx_protection_items_sku_area" in plan, plan
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        conn.close()
+        print(f"✅ миграция {protections + len(samples):,} защит за {took:.1f} с: {total:,} артикулов, форматы "
+              f"\"; \", \" + \", свободный текст и \"—\" разобраны; копия backend/data.sqlite3 ({repo_rows} защит) — тоже")
+
+        # --- 2. запись ---
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+        check_index()
+        status, _, body = await call(app, "POST", "/api/protections", body={
+            "manager": "Менеджер 0001",
+            "sku_data": [{"sku": "ITM-1", "type": "замок", "area": 400}, {"sku": a["sku"], "type": a["type"], "area": 7777}],
+        })
+        assert status == 200, body
+        pid = json.loads(body)["id"]
+        conn = db.get_conn()
+        assert items_of(conn, pid) == [("ITM-1", "замок", "", 400.0), (*ta, 7777.0)]
+        conn.close()
+        # по целой строке "ITM-1 (замок) — 400 м²; …" этот дубль не находился
+        status, _, body = await call(app, "POST", "/api/protections", body={
+            "manager": "Менеджер 0002", "sku_data": [{"sku": "ITM-1", "type": "замок", "area": 420}],
+        })
+        assert status == 409, (status, body)
+        status, _, body = await call(app, "POST", "/api/protections/check-duplicate", body={
+            "sku_data": [{"sku": "ITM-1 (замок)", "area": 380}]})
+        assert [d["sku"] for d in json.loads(body)] == ["ITM-1 (замок) — 400 м²; " + f"{a['sku']} ({a['type']}) — 7777 м²"]
+
+        status, _, body = await call(app, "PUT", f"/api/protections/{pid}", body={
+            "sku_data": [{"sku": "ITM-2", "type": "клей"}, {"sku": "ITM-3", "type": "замок"}], "area_m2": 500})
+        assert status == 200, body
+        conn = db.get_conn()
+        assert items_of(conn, pid) == [("ITM-2", "клей", "", None), ("ITM-3", "замок", "", None)]
+        conn.close()
+        status, _, _ = await call(app, "POST", "/api/protections", body={
+            "manager": "Менеджер 0002", "sku_data": [{"sku": "ITM-1", "type": "замок", "area": 420}]})
+        assert status == 200, "после правки ITM-1 свободен"
+        status, _, body = await call(app, "POST", "/api/protections", body={
+            "manager": "Менеджер 0003", "sku_data": [{"sku": "ITM-3", "type": "замок", "area": 510}]})
+        assert status == 409, "общая площадь засчитывается каждому артикулу"
+
+        status, _, body = await call(app, "POST", "/api/protections/pending", body={
+            "manager": "Менеджер 0004", "sku_data": [{"sku": "ITM-4", "type": "клей", "area": 90}]})
+        pending = json.loads(body)["id"]
+        conn = db.get_conn()
+        assert items_of(conn, pending) == [("ITM-4", "клей", "", 90.0)]
+        conn.close()
+        status, _, body = await call(app, "POST", "/api/protections/check-duplicate", body={
+            "sku_data": [{"sku": "ITM-4", "area": 90}]})
+        assert json.loads(body) == [], "на проверке — не дубль"
+        status, _, body = await call(app, "POST", "/api/admin/protections/batch",
+                                     body=[{"id": pending, "action": "approve"}], headers=admin)
+        assert status == 200 and json.loads(body)["applied"] == 1, body
+        status, _, body = await call(app, "POST", "/api/protections/check-duplicate", body={
+            "sku_data": [{"sku": "ITM-4", "area": 90}]})
+        assert len(json.loads(body)) == 1, "одобрена пакетом — в индексе дублей"
+
+        csv_body = "Менеджер;Артикул;Площадь, м²\nИмпортный;ITM-5;300\nИмпортный;ITM-5;310\n".encode("utf-8-sig")
+        status, _, body = await call(app, "POST", "/api/admin/import", params={"format": "csv"}, body=csv_body,
+                                     headers=admin)
+        report = json.loads(body)
+        assert report["created"] == 1 and report["rows"][1]["duplicate_of_row"] == report["rows"][0]["row"], report
+        conn = db.get_conn()
+        assert items_of(conn, report["rows"][0]["id"]) == [("ITM-5", "", "", 300.0)]
+        conn.close()
+        check_index()
+        print("✅ создание, правка, «на проверке», импорт и пакетное одобрение пишут артикулы; дубль по одному "
+              "артикулу многоартикульной защиты ловится; индекс дублей совпадает с пересобранным")
+
+        # --- 3. спрос ---
+        by_sku = {r["sku"]: r for r in json.loads((await call(
+            app, "GET", "/api/admin/demand/skus", params={"limit": MAX_SKUS}, headers=admin))[2])}
+        conn = db.get_conn()
+        legacy = legacy_demand(conn)
+        assert {sku: r["protections"] for sku, r in by_sku.items()} == legacy
+        assert by_sku["ITM-3"]["shared_area_m2"] == 500 and by_sku["ITM-4"]["area_m2"] == 90
+        assert by_sku[a["sku"]]["in_catalog"] and a["collection"] in by_sku[a["sku"]]["collections"]
+        assert not by_sku["ITM-1"]["in_catalog"]
+        collections = {r["collection"]: r for r in json.loads((await call(
+            app, "GET", "/api/admin/demand/collections", headers=admin))[2])}
+        assert {it["collection"] for it in CATALOG.items} <= set(collections)
+        assert collections[""]["skus"] >= 5 and collections[""]["catalog_skus"] == 0
+        active = json.loads((await call(app, "GET", "/api/admin/demand/skus",
+                                        params={"status": "active", "days": 7}, headers=admin))[2])
+        assert 0 < sum(r["protections"] for r in active) < sum(legacy.values())
+        status, _, _ = await call(app, "GET", "/api/admin/demand/skus")
+        assert status == 401
+
+        t_old = best(lambda: legacy_demand(conn), 3)
+        t_new = best(lambda: api._demand("sku", None, None))
+        conn.close()
+        print(f"✅ /api/admin/demand/skus и /collections сходятся с разбором строк; каталог подмешан, "
+              f"коллекции без спроса — в ответе")
+        print(f"спрос по {len(legacy):,} артикулам: разбор {protections:,} строк {t_old * 1000:.0f} мс, "
+              f"GROUP BY по protection_items {t_new * 1000:.0f} мс ({t_old / t_new:.1f}×)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Задержка event loop во время медленного запроса к SQLite.
+
+Запуск:  python -m bench.bench_loop_lag
+
+Сравнивает запрос прямо в корутине и через db.run_db(). Во втором случае
+максимальная задержка loop должна оставаться в пределах нескольких мс (порог MAX_LAG_MS) —
+иначе скрипт завершается с ошибкой.
+"""
+import asyncio
+import sys
+import time
+
+import backend.db as db
+from bench.data import bench_db
+
+SLOW_SQL = """
+    WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 3000000)
+    SELECT SUM(x) FROM c
+"""
+MAX_LAG_MS = 10.0
+
+
+def slow_query():
+    conn = db.get_conn()
+    value = conn.execute(SLOW_SQL).fetchone()[0]
+    conn.close()
+    return value
+
+
+async def measure(fn) -> tuple:
+    lags = []
+    stop = False
+
+    async def monitor():
+        while not stop:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - t0) * 1000 - 1)
+
+    task = asyncio.create_task(monitor())
+    await asyncio.sleep(0.05)
+    t0 = time.perf_counter()
+    await fn()
+    took = (time.perf_counter() - t0) * 1000
+    stop = True
+    await task
+    return max(lags), took
+
+
+async def main():
+    with bench_db():
+        async def blocking():
+            slow_query()
+
+        async def offloaded():
+            await db.run_db(slow_query)
+
+        lag_blocking, took = await measure(blocking)
+        print(f"Запрос в корутине:  {took:7.0f} мс, макс. задержка loop {lag_blocking:7.1f} мс")
+        lag_offloaded, took = await measure(offloaded)
+        print(f"Через run_db():     {took:7.0f} мс, макс. задержка loop {lag_offloaded:7.1f} мс")
+    if lag_offloaded > MAX_LAG_MS:
+        print(f"❌ задержка loop больше {MAX_LAG_MS} мс")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
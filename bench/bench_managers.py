@@ -0,0 +1,228 @@
+"""
+Связь защит с менеджерами по protections.manager_id вместо имени.
+
+Запуск:  python -m bench.bench_managers [защит]
+
+1. Миграция: база, где manager_id пуст или забит users.id, а часть имён
+   из protections не заведена в managers. После старта у каждой защиты с
+   менеджером manager_id = managers.id с тем же именем, недостающие имена
+   заведены, manager_stats и FTS пересобраны и сходятся с protections,
+   change_version не тронут. Та же миграция на копии backend/data.sqlite3.
+2. Поведение: фильтры /api/protections, /changes, /api/export/history,
+   /api/admin/manager-protections и /api/stats — по id; переименование
+   не трогает protections, но новое имя сразу видно в списке, поиске,
+   статистике, а у клиентов дельта-синхронизации — reset; удаление с
+   переводом защит; незаведённое имя при создании и «на проверке» — 400,
+   новое имя из импорта заводится в managers.
+3. Скорость: выборка защит менеджера, свёртка /api/admin/managers и
+   переименование — по имени (как было) против manager_id.
+"""
+import asyncio
+import json
+import sys
+import time
+
+import backend.db as db
+import backend.migrations as migrations
+from bench.asgi import call
+from bench.data import bench_db, repo_db_copy
+
+ROUNDS = 5
+
+
+def best(fn, rounds: int = ROUNDS) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def check_links(conn):
+    """manager_id защиты — managers с её именем, а если имя не заведено — NULL"""
+    bad = conn.execute("""
+        SELECT COUNT(*) FROM protections p
+        LEFT JOIN managers m ON m.id = p.manager_id
+        LEFT JOIN managers n ON n.name = p.manager
+        WHERE TRIM(p.manager) != '' AND m.id IS NOT n.id
+    """).fetchone()[0]
+    assert bad == 0, f"{bad} защит без верного manager_id"
+
+
+def check_derived(conn):
+    from backend.stats import check_stats
+    assert check_stats(conn.cursor()) == []
+    conn.execute("INSERT INTO protections_fts(protections_fts) VALUES('integrity-check')")
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+
+def migrate_repo_copy():
+    """Миграция копии боевой базы из репозитория (старые manager_stats и FTS по имени)"""
+    from backend import main as api
+
+    with repo_db_copy():
+        api.init_storage()
+        conn = db.get_conn()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(migrations.MIGRATIONS)
+        check_links(conn)
+        check_derived(conn)
+        n = conn.execute("SELECT COUNT(*) FROM protections").fetchone()[0]
+        conn.close()
+    return n
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    from backend import main as api
+
+    repo_rows = migrate_repo_copy()
+
+    # --- 1. база «до миграции 2» ---
+    applied, migrations.MIGRATIONS = migrations.MIGRATIONS, migrations.MIGRATIONS[:1]
+    with bench_db(protections=protections, managers=200, users=400, history_per_protection=1):
+        conn = db.get_conn()
+        conn.execute("UPDATE protections SET manager_id = NULL")
+        conn.execute("UPDATE protections SET manager_id = 1 + id % 50 WHERE id % 7 = 0")   # users.id, как писал create
+        orphans = [r[0] for r in conn.execute("SELECT name FROM managers ORDER BY id DESC LIMIT 5")]
+        conn.execute(f"DELETE FROM managers WHERE name IN ({','.join('?' * len(orphans))})", orphans)
+        conn.commit()
+        name = conn.execute("SELECT name FROM managers ORDER BY id LIMIT 1").fetchone()[0]
+        by_name = "SELECT id FROM protections WHERE status != 'deleted' AND manager = ? ORDER BY created_at DESC"
+        expected = [r[0] for r in conn.execute(by_name, (name,))]
+        versions = conn.execute("SELECT SUM(change_version), MAX(change_version) FROM protections").fetchone()
+        t_old_filter = best(lambda: conn.execute(by_name, (name,)).fetchall())
+        old_rollup = """
+            SELECT m.id, m.name, IFNULL(t.total, 0) FROM managers m
+            LEFT JOIN (SELECT manager, COUNT(*) AS total FROM protections GROUP BY manager) t ON t.manager = m.name
+        """
+        t_old_rollup = best(lambda: conn.execute(old_rollup).fetchall(), 3)
+
+        def old_rename():
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE managers SET name = name || '*' WHERE name = ?", (name,))
+            conn.execute("UPDATE protections SET manager = manager || '*' WHERE manager = ?", (name,))
+            conn.rollback()
+        t_old_rename = best(old_rename, 3)
+        conn.close()
+
+        migrations.MIGRATIONS = applied
+        t0 = time.perf_counter()
+        api.init_storage()
+        took = time.perf_counter() - t0
+        conn = db.get_conn()
+        check_links(conn)
+        check_derived(conn)
+        assert conn.execute("SELECT SUM(change_version), MAX(change_version) FROM protections").fetchone() == versions
+        assert conn.execute(
+            f"SELECT COUNT(*) FROM managers WHERE name IN ({','.join('?' * len(orphans))})", orphans
+        ).fetchone()[0] == len(orphans)
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM protections p WHERE " + api.filter_sql("p."), (name,)))
+        assert "idx_protections_manager" in plan, plan
+        conn.close()
+        print(f"✅ миграция {protections:,} защит за {took:.1f} с: manager_id заполнен, {len(orphans)} имён "
+              f"заведены в managers, manager_stats и FTS сходятся, change_version не тронут; "
+              f"копия backend/data.sqlite3 ({repo_rows} защит) — тоже")
+
+        # --- 2. поведение ---
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+
+        async def get(path, **params):
+            status, _, body = await call(app, "GET", path, params=params, headers=admin)
+            assert status == 200, (path, status, body[:200])
+            return body
+
+        listed = json.loads(await get("/api/protections", manager=name))
+        assert sorted(p["id"] for p in listed) == sorted(expected) and all(p["manager"] == name for p in listed)
+        conn = db.get_conn()
+        mid = conn.execute("SELECT id FROM managers WHERE name=?", (name,)).fetchone()[0]
+        conn.close()
+        owned = json.loads(await get("/api/admin/manager-protections", manager_id=mid))
+        assert {p["id"] for p in owned} >= set(expected)
+        sync = json.loads(await get("/api/protections/changes", manager=name, limit=1000))
+        assert {p["id"] for p in sync["items"]} == set(expected) and all(p["manager"] == name for p in sync["items"])
+        history_csv = (await get("/api/export/history", manager=name, format="csv")).decode("utf-8-sig")
+        assert len(history_csv.splitlines()) > len(expected) and name in history_csv
+
+        conn = db.get_conn()
+        before = conn.execute("SELECT MAX(change_version), SUM(LENGTH(manager)) FROM protections").fetchone()
+        conn.close()
+        new_name = "Переименованный Менеджер"
+        status, _, _ = await call(app, "PATCH", f"/api/admin/managers/{mid}", body={"name": new_name}, headers=admin)
+        assert status == 200
+        conn = db.get_conn()
+        assert conn.execute("SELECT MAX(change_version), SUM(LENGTH(manager)) FROM protections").fetchone() == before
+        conn.close()
+        listed = json.loads(await get("/api/protections", manager=new_name))
+        assert sorted(p["id"] for p in listed) == sorted(expected) and all(p["manager"] == new_name for p in listed)
+        assert json.loads(await get("/api/protections", manager=name)) == []
+        found = json.loads(await get("/api/protections", search="переименованный"))
+        assert {p["id"] for p in found} == set(expected), "поиск по новому имени"
+        stats = {s["manager"]: s for s in json.loads(await get("/api/stats"))}
+        assert new_name in stats and name not in stats
+        managers = {m["id"]: m for m in json.loads(await get("/api/admin/managers"))}
+        assert managers[mid]["name"] == new_name and managers[mid]["total"] >= len(expected)
+        again = json.loads(await get("/api/protections/changes", since=sync["token"]))
+        assert again["reset"], "после переименования копия клиента должна пересобраться"
+
+        other = next(m for m in managers.values() if m["id"] != mid and m["total"])
+        status, _, _ = await call(app, "DELETE", f"/api/admin/managers/{mid}", params={"transfer_to": other["id"]},
+                                  headers=admin)
+        assert status == 200
+        moved = json.loads(await get("/api/protections", manager=other["name"]))
+        assert set(expected) <= {p["id"] for p in moved}
+
+        for path in ("/api/protections", "/api/protections/pending"):
+            status, _, body = await call(app, "POST", path, body={
+                "manager": "Новенький", "sku_data": [{"sku": "MGR-1", "type": "замок", "area": 120}],
+            })
+            assert status == 400, (path, status, body)
+        assert "Новенький" not in {m["name"] for m in json.loads(await get("/api/managers"))}, \
+            "создание защиты не заводит менеджера"
+        conn = db.get_conn()
+        assert conn.execute("SELECT COUNT(*) FROM protections WHERE manager='Новенький'").fetchone()[0] == 0
+        conn.close()
+        csv_body = "Менеджер;Артикул;Площадь, м²\nИмпортный;MGR-2;300\n".encode("utf-8-sig")
+        status, _, body = await call(app, "POST", "/api/admin/import", params={"format": "csv"}, body=csv_body,
+                                     headers=admin)
+        assert status == 200 and json.loads(body)["created"] == 1, body
+        assert [p["manager"] for p in json.loads(await get("/api/protections", manager="Импортный"))] == ["Импортный"]
+        conn = db.get_conn()
+        check_links(conn)
+        check_derived(conn)
+        conn.close()
+        print("✅ фильтры, выгрузка и дельта по id; переименование не трогает protections, новое имя — в списке, "
+              "поиске и статистике, клиентам дельты — reset; перевод защит; незаведённое имя при создании — 400, заводит только импорт")
+
+        # --- 3. скорость ---
+        conn = db.get_conn()
+        name = other["name"]
+        sql, params, order = api.protections_query(manager=name, columns="p.id")
+        t_new_filter = best(lambda: conn.execute(sql + order, params).fetchall())
+        new_rollup = """
+            SELECT m.id, m.name, IFNULL(t.total, 0) FROM managers m
+            LEFT JOIN (SELECT manager_id, SUM(cnt) AS total FROM manager_stats GROUP BY manager_id) t
+                   ON t.manager_id = m.id
+        """
+        t_new_rollup = best(lambda: conn.execute(new_rollup).fetchall())
+        n_rows = conn.execute("SELECT COUNT(*) FROM protections WHERE manager_id = ?", (other["id"],)).fetchone()[0]
+
+        def new_rename():
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE managers SET name = name || '*' WHERE id = ?", (other["id"],))
+            api.reset_sync(conn.cursor())
+            conn.rollback()
+        t_new_rename = best(new_rename, 3)
+        conn.close()
+        print(f"защиты менеджера ({n_rows:,} из {protections:,}): по имени {t_old_filter * 1000:.1f} мс, "
+              f"по manager_id {t_new_filter * 1000:.2f} мс ({t_old_filter / t_new_filter:.0f}×)")
+        print(f"счётчики для /api/admin/managers: GROUP BY имени {t_old_rollup * 1000:.1f} мс, "
+              f"manager_stats по id {t_new_rollup * 1000:.2f} мс")
+        print(f"переименование: UPDATE защит по имени {t_old_rename * 1000:.1f} мс, "
+              f"одна строка managers {t_new_rename * 1000:.2f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Доставка tg_outbox против локального фейкового Bot API сервера.
+
+Запуск:  python -m bench.bench_outbox [сообщений] [чатов]
+
+Фейковый сервер отвечает на sendMessage/editMessageText, иногда отдаёт
+429 с retry_after и запоминает время каждого сообщения по чатам. В конце
+проверяется, что всё доставлено, tg_notifications записаны, а интервал
+между сообщениями в один чат не меньше PER_CHAT_INTERVAL.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from aiohttp import web
+
+PORT = 8765
+os.environ.setdefault("TG_API_BASE", f"http://127.0.0.1:{PORT}")
+
+import backend.db as db  # noqa: E402
+from bench.data import bench_db  # noqa: E402
+
+
+class FakeBotAPI:
+    def __init__(self, flood_ratio: float = 0.02):
+        self.flood_ratio = flood_ratio
+        self.by_chat = {}
+        self.message_id = 0
+        self.floods = 0
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        if random.random() < self.flood_ratio:
+            self.floods += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })
+        chat_id = int(data["chat_id"])
+        self.by_chat.setdefault(chat_id, []).append(time.monotonic())
+        self.message_id += 1
+        result = {
+            "message_id": self.message_id if method == "sendMessage" else int(data["message_id"]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+        return web.json_response({"ok": True, "result": result})
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    random.seed(7)
+
+    with bench_db():
+        from backend import main as api
+        from backend.tg_outbox import OUTBOX, PER_CHAT_INTERVAL, enqueue
+
+        conn = db.get_conn()
+        for i in range(total):
+            enqueue(conn.cursor(), [1000 + i % chats], f"Сообщение {i}", protection_id=i + 1)
+        conn.commit()
+        conn.close()
+
+        fake = FakeBotAPI()
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", fake.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+        t0 = time.perf_counter()
+        worker = asyncio.create_task(OUTBOX.run(api.bot))
+        while True:
+            await asyncio.sleep(0.5)
+            m = await OUTBOX.metrics()
+            if m["depth"] == 0 and not m["inflight"]:
+                break
+        took = time.perf_counter() - t0
+        worker.cancel()
+        await api.bot.session.close()
+        await runner.cleanup()
+
+        conn = db.get_conn()
+        stored = conn.execute("SELECT COUNT(*) FROM tg_notifications").fetchone()[0]
+        conn.close()
+        gaps = [
+            b - a
+            for times in fake.by_chat.values()
+            for a, b in zip(times, times[1:])
+        ]
+        min_gap = min(gaps) if gaps else PER_CHAT_INTERVAL
+
+        print(f"Доставлено {OUTBOX.sent_total}/{total} за {took:.1f} с ({OUTBOX.sent_total / took:.1f} msg/s)")
+        print(f"429 от сервера: {fake.floods}, записей tg_notifications: {stored}")
+        print(f"Мин. интервал в один чат: {min_gap:.2f} с (лимит {PER_CHAT_INTERVAL} с)")
+        assert OUTBOX.sent_total == total and stored == total
+        assert min_gap >= PER_CHAT_INTERVAL * 0.95
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Бенчмарк пула соединений: запросы/сек через threadpool FastAPI
+со старым get_conn() (connect/close на каждый вызов) и с пулом.
+
+Запуск:  python -m bench.bench_pool [кол-во запросов] [параллельность]
+"""
+import asyncio
+import random
+import sqlite3
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+
+def legacy_get_conn():
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+async def run(app, total: int, concurrency: int) -> float:
+    paths = [
+        # лёгкие запросы — чтобы было видно цену самого соединения
+        ("GET", "/api/managers", None),
+        ("GET", "/api/user-managers", None),
+        ("GET", "/api/protections", {"limit": 20}),
+        ("GET", "/api/history", {"protection_id": 1}),
+        ("POST", "/api/protections/check-duplicate", None),
+    ]
+    queue = list(range(total))
+
+    async def worker():
+        while queue:
+            queue.pop()
+            method, path, params = random.choice(paths)
+            body = {"sku_data": [{"sku": "4031", "area": 120}]} if method == "POST" else None
+            status, _, _ = await call(app, method, path, params=params, body=body)
+            assert status == 200, (path, status)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - t0)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    random.seed(1)
+    with bench_db(protections=20_000, managers=40, users=200, history_per_protection=1):
+        from backend import main as api, users, auth
+
+        modules = (api, users, auth)
+        pooled = api.get_conn
+
+        for m in modules:
+            m.get_conn = legacy_get_conn
+        before = asyncio.run(run(api.app, total, concurrency))
+
+        for m in modules:
+            m.get_conn = pooled
+        after = asyncio.run(run(api.app, total, concurrency))
+
+        print(f"Без пула:  {before:8.0f} req/s")
+        print(f"С пулом:   {after:8.0f} req/s  (x{after / before:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Сериализация списка защит: row_to_out + response_model=List[ProtectionOut]
+(как было) против encode_row + ORJSONResponse.
+
+Запуск:  python -m bench.bench_serialize [защит]
+
+1. Контракт: /api/protections (весь список, страница, stream=1, страница
+   потоком с X-Next-Cursor) и /api/protections/changes отдают ровно то же,
+   что прежний путь через row_to_out и ProtectionOut, — те же поля, порядок,
+   значения days_left, warn2d, warn_text.
+2. Цена на 10 000 строк: только сериализация (строки уже выбраны) и весь
+   HTTP-запрос. Прежний путь повторяется отдельным эндпоинтом с тем же
+   SQL и response_model, что был у list_protections.
+"""
+import asyncio
+import json
+import sys
+import time
+from typing import List
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+ROWS = 10_000
+ROUNDS = 5
+
+
+def best(fn, rounds: int = ROUNDS) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+async def best_async(fn, rounds: int = ROUNDS) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with bench_db(protections=protections, managers=50, users=100, history_per_protection=1):
+        import orjson
+        from pydantic import TypeAdapter
+
+        from backend import main as api
+        from backend.serialize import encode_row, out_columns
+
+        app = api.app
+
+        # прежний list_protections (без пагинации) — для сравнения
+        @app.get("/bench/legacy-list", response_model=List[api.ProtectionOut])
+        def legacy_list(limit: int = ROWS):
+            sql, params, order = api.protections_query()
+            conn = db.get_conn()
+            rows = conn.execute(sql + order + " LIMIT ?", params + [limit]).fetchall()
+            conn.close()
+            return [api.row_to_out(r) for r in rows]
+
+        # --- 1. контракт ---
+        async def get(path, params=None):
+            status, headers, body = await call(app, "GET", path, params=params)
+            assert status == 200, (path, status, body[:200])
+            return headers, body
+
+        _, legacy_body = await get("/bench/legacy-list", {"limit": protections})
+        _, new_body = await get("/api/protections")
+        # при равных created_at порядок строк зависит от плана запроса — сравниваем по (created_at, id)
+        def keyset(items):
+            return sorted(items, key=lambda x: (x["created_at"], x["id"]), reverse=True)
+
+        # запросы идут друг за другом: у строки, чей срок «перешёл через сутки»
+        # между ними, days_left может отличаться на 1 — это не расхождение формата
+        def same(a, b):
+            if len(a) != len(b):
+                return False
+            for x, y in zip(a, b):
+                if x != y and not (abs(x["days_left"] - y["days_left"]) == 1 and
+                                   {**x, "days_left": 0, "warn2d": 0, "warn_text": 0} ==
+                                   {**y, "days_left": 0, "warn2d": 0, "warn_text": 0}):
+                    return False
+            return True
+
+        legacy, new = keyset(json.loads(legacy_body)), json.loads(new_body)
+        assert len(legacy) == len(new) > 0
+        assert same(keyset(new), legacy), next((a, b) for a, b in zip(legacy, keyset(new)) if a != b)
+        assert [list(x) for x in legacy[:50]] == [list(x) for x in keyset(new)[:50]], "порядок полей"
+        assert sum(1 for x in new if x["warn2d"]) > 0, "в выборке нет строк с warn2d"
+
+        _, streamed = await get("/api/protections", {"stream": 1})
+        assert same(keyset(json.loads(streamed)), legacy)
+        headers, page = await get("/api/protections", {"limit": 100})
+        assert same(json.loads(page), legacy[:100]) and "x-next-cursor" in headers
+        _, page2 = await get("/api/protections", {"limit": 100, "cursor": headers["x-next-cursor"]})
+        assert same(json.loads(page2), legacy[100:200])
+        sheaders, spage = await get("/api/protections", {"limit": 100, "stream": 1})
+        assert same(json.loads(spage), legacy[:100]) and sheaders.get("x-next-cursor") == headers["x-next-cursor"]
+        _, spage2 = await get("/api/protections", {"limit": 100, "stream": 1, "cursor": headers["x-next-cursor"]})
+        assert same(json.loads(spage2), legacy[100:200])
+        near_end = api.encode_cursor(legacy[-51]["created_at"], legacy[-51]["id"])
+        sheaders, last = await get("/api/protections", {"limit": 100, "stream": 1, "cursor": near_end})
+        assert same(json.loads(last), legacy[-50:]) and "x-next-cursor" not in sheaders
+
+        _, changes = await get("/api/protections/changes", {"limit": 1000})
+        changes = json.loads(changes)
+        conn = db.get_conn()
+        ids = [x["id"] for x in changes["items"]]
+        marks = ",".join("?" * len(ids))
+        rows = {r["id"]: r for r in conn.execute(f"SELECT * FROM protections WHERE id IN ({marks})", ids)}
+        conn.close()
+        assert same(changes["items"], [api.row_to_out(rows[i]).dict() for i in ids])
+        print(f"✅ ответы совпадают с row_to_out/ProtectionOut: весь список ({len(new):,}), stream, страницы (и потоком), changes")
+
+        # --- 2. цена на 10 000 строк ---
+        conn = db.get_conn()
+        sql, params, order = api.protections_query()
+        old_rows = conn.execute(sql + order + " LIMIT ?", params + [ROWS]).fetchall()
+        sql, params, order = api.protections_query(columns=out_columns("p."))
+        new_rows = conn.execute(sql + order + " LIMIT ?", params + [ROWS]).fetchall()
+        conn.close()
+        adapter = TypeAdapter(List[api.ProtectionOut])
+
+        def old_path():
+            # то, что делали row_to_out и FastAPI с response_model
+            out = [api.row_to_out(r) for r in old_rows]
+            content = adapter.dump_python(adapter.validate_python(out, from_attributes=True), mode="json")
+            return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+        def new_path():
+            return orjson.dumps([encode_row(r) for r in new_rows])
+
+        assert same(keyset(json.loads(old_path())), keyset(json.loads(new_path())))
+        t_old, t_new = best(old_path), best(new_path)
+        print(f"Сериализация 10k строк: было {t_old * 1000:.0f} мс, стало {t_new * 1000:.1f} мс ({t_old / t_new:.0f}×)")
+
+        # весь список без limit (MAX_LIMIT у страниц меньше 10k), в пересчёте на 10k строк
+        per_10k = ROWS / len(new)
+        h_old = await best_async(lambda: get("/bench/legacy-list", {"limit": protections}), 3) * per_10k
+        h_new = await best_async(lambda: get("/api/protections"), 3) * per_10k
+        print(f"GET всего списка (SQL + JSON + middleware), на 10k строк: было {h_old * 1000:.0f} мс, "
+              f"стало {h_new * 1000:.0f} мс ({h_old / h_new:.1f}×)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+"""
+Дельта-синхронизация /api/protections/changes против полного списка.
+
+Запуск:  python -m bench.bench_sync [защит]
+
+1. Полная синхронизация с нуля постранично (since пустой) — собирается
+   локальная копия, она должна совпасть с GET /api/protections.
+2. Изменения по всем путям записи: создание, правка, продление, успешная,
+   закрытие, удаление, заявка + одобрение/отказ, авто-закрытие и жёсткий
+   DELETE. Одна дельта должна привести копию к тому же состоянию, что и
+   полный список.
+3. Сравнение размера ответа «дельта» и «весь список» для клиента, который
+   синхронизируется после пары изменений.
+4. Переименование менеджера строки protections не трогает — клиент получает
+   reset, и копия после него снова совпадает с полным списком.
+"""
+import asyncio
+import json
+import sys
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db, manager_names
+
+
+async def sync(app, copy: dict, token: str = "", **params) -> tuple:
+    """Докачивает изменения в copy {id: защита}; возвращает (token, байт, запросов)"""
+    nbytes = requests = 0
+    while True:
+        status, _, body = await call(app, "GET", "/api/protections/changes", params={"since": token, **params})
+        assert status == 200, (status, body[:200])
+        nbytes += len(body)
+        requests += 1
+        res = json.loads(body)
+        if res["reset"]:
+            copy.clear()
+        for p in res["items"]:
+            copy[p["id"]] = p
+        for pid in res["deleted"]:
+            copy.pop(pid, None)
+        token = res["token"]
+        if not res["has_more"]:
+            return token, nbytes, requests
+
+
+async def full_list(app, **params) -> tuple:
+    status, _, body = await call(app, "GET", "/api/protections", params=params or None)
+    assert status == 200, status
+    return {p["id"]: p for p in json.loads(body)}, len(body)
+
+
+def same(copy: dict, full: dict) -> bool:
+    # days_left/warn считаются от текущего времени — сравниваем без них
+    strip = lambda d: {k: v for k, v in d.items() if k not in ("days_left", "warn2d", "warn_text")}
+    return copy.keys() == full.keys() and all(strip(copy[i]) == strip(full[i]) for i in copy)
+
+
+async def create(app, manager: str, sku: str, path: str = "/api/protections") -> int:
+    status, _, body = await call(app, "POST", path, body={
+        "manager": manager, "sku_data": [{"sku": sku, "type": "замок", "area": 150}],
+    })
+    assert status == 200, (status, body[:200])
+    data = json.loads(body)
+    return data.get("id") or data.get("protection_id") or data["protection"]["id"]
+
+
+async def main():
+    protections = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    with bench_db(protections=protections, managers=20, users=100):
+        from backend import main as api
+        from backend.expiry import auto_close
+
+        app = api.app
+        admin = {"token": api.create_token(1, "superadmin")}
+        m0, m1 = manager_names(2)
+
+        # --- 1. с нуля ---
+        copy = {}
+        token, nbytes, requests = await sync(app, copy)
+        full, full_bytes = await full_list(app)
+        assert same(copy, full), (len(copy), len(full))
+        print(f"✅ полная синхронизация: {len(copy)} защит за {requests} запросов, {nbytes:,} байт")
+
+        # --- 2. все пути записи ---
+        a = await create(app, m0, "SYNC-A")
+        b = await create(app, m0, "SYNC-B")
+        c = await create(app, m0, "SYNC-C")
+        d = await create(app, m0, "SYNC-D")
+        e = await create(app, m0, "SYNC-E")
+        steps = [
+            ("PUT", f"/api/protections/{a}", None, {"comment": "правка"}, None),
+            ("POST", f"/api/protections/{a}/extend", {"days": 5}, None, None),
+            ("POST", f"/api/protections/{b}/success", None, {"doc_1c": "1С-42"}, None),
+            ("POST", f"/api/protections/{c}/close", None, {"reason": "отказ клиента"}, None),
+            ("DELETE", f"/api/protections/{d}", {"reason": "дубль"}, None, None),
+        ]
+        for method, path, params, body, headers in steps:
+            status, _, resp = await call(app, method, path, params=params, body=body, headers=headers)
+            assert status == 200, (path, status, resp[:200])
+        p1 = await create(app, m1, "SYNC-P1", "/api/protections/pending")
+        p2 = await create(app, m1, "SYNC-P2", "/api/protections/pending")
+        status, _, _ = await call(app, "POST", f"/api/admin/pending/{p1}/approve", headers=admin)
+        assert status == 200, status
+        status, _, _ = await call(app, "POST", f"/api/admin/pending/{p2}/reject", body={"reason": "нет"}, headers=admin)
+        assert status == 200, status
+        conn = db.get_conn()
+        conn.execute("UPDATE protections SET expires_at = '2000-01-01T00:00:00Z' WHERE id = ?", (e,))
+        conn.commit()
+        conn.close()
+        assert await asyncio.to_thread(auto_close, [e]) == 1
+        conn = db.get_conn()
+        conn.execute("DELETE FROM protections WHERE id = ?", (d,))
+        conn.commit()
+        conn.close()
+
+        token2, delta_bytes, _ = await sync(app, copy, token)
+        full, full_bytes = await full_list(app)
+        assert same(copy, full), sorted(set(copy) ^ set(full))
+        assert d not in copy and c in copy and copy[a]["comment"] == "правка"
+        print(f"✅ одна дельта после всех путей записи: {delta_bytes:,} байт вместо {full_bytes:,}")
+
+        # --- 3. пара изменений и повторная синхронизация ---
+        _, same_bytes, _ = await sync(app, copy, token2)
+        await create(app, m0, "SYNC-F")
+        _, small_bytes, _ = await sync(app, copy, token2)
+        mine = {}
+        await sync(app, mine, manager=m0)
+        _, mine_full_bytes = await full_list(app, manager=m0)
+        print(f"без изменений: {same_bytes} байт; одна новая защита: {small_bytes} байт; весь список: {full_bytes:,} байт"
+              f" ({full_bytes / small_bytes:.0f}×)")
+        print(f"копия менеджера {m0}: {len(mine)} защит, весь его список {mine_full_bytes:,} байт")
+
+        status, _, _ = await call(app, "GET", "/api/protections/changes", params={"since": "мусор"})
+        assert status == 400, status
+        foreign = {}
+        await sync(app, foreign, "deadbeef:1")
+        full, _ = await full_list(app)
+        assert same(foreign, full), (len(foreign), len(full))
+        print("✅ токен другой базы — reset и полная выдача, мусор — 400")
+
+        # --- 4. переименование менеджера ---
+        token3, _, _ = await sync(app, copy, token2)
+        status, _, body = await call(app, "GET", "/api/admin/managers", headers=admin)
+        mid = next(m["id"] for m in json.loads(body) if m["name"] == m1)
+        status, _, _ = await call(app, "PATCH", f"/api/admin/managers/{mid}", body={"name": m1 + " (новый)"}, headers=admin)
+        assert status == 200, status
+        status, _, body = await call(app, "GET", "/api/protections/changes", params={"since": token3})
+        assert json.loads(body)["reset"], "после переименования нужен reset"
+        await sync(app, copy, token3)
+        full, _ = await full_list(app)
+        assert same(copy, full) and any(p["manager"] == m1 + " (новый)" for p in copy.values())
+        print("✅ переименование менеджера — reset, копия с новым именем совпадает с полным списком")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
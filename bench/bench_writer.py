@@ -0,0 +1,173 @@
+"""
+Единственный писатель (backend/writer.py) против транзакций в каждом
+обработчике: 50 одновременных создателей защит.
+
+Запуск:  python -m bench.bench_writer [создателей] [раундов]
+
+1. Гонка дублей: все создатели ставят один и тот же артикул и метраж.
+   По-старому (проверка дублей, затем INSERT и commit в потоке
+   обработчика) проходит больше одной защиты, без busy_timeout часть
+   запросов падает с «database is locked». Через /api/protections —
+   ровно одна 200, остальные 409, индекс дублей совпадает с базой.
+2. Откат внутри группы: 409 одного изменения не трогает соседние по
+   транзакции; после ошибки писатель продолжает работать.
+3. Пропускная способность: раунды по N разных артикулов — commit на
+   каждый запрос против групповых commit писателя.
+"""
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+DUP_SQL = """
+    SELECT 1 FROM protection_items i JOIN protections p ON p.id = i.protection_id
+    WHERE p.status = 'active' AND i.sku = ? AND i.area_m2 BETWEEN ? AND ?
+"""
+
+
+def legacy_create(connect, sku: str, area: float, barrier=None):
+    """Как create_protection до писателя: проверка и запись в своём соединении потока"""
+    conn = connect()
+    try:
+        if barrier:
+            barrier.wait()
+        cur = conn.cursor()
+        if cur.execute(DUP_SQL, (sku, area * 0.9, area * 1.1)).fetchone():
+            return 409
+        now = db.now_iso()
+        cur.execute(
+            "INSERT INTO protections(manager, sku, area_m2, status, created_at, expires_at) "
+            "VALUES ('Менеджер 0001', ?, ?, 'active', ?, ?)", (sku, area, now, db.add_days(now, 10)))
+        pid = cur.lastrowid
+        cur.execute("INSERT INTO protection_items(protection_id, sku, area_m2) VALUES (?,?,?)", (pid, sku, area))
+        cur.execute("INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,'manager','create','{}')",
+                    (pid, now))
+        conn.commit()
+        return 200
+    except sqlite3.OperationalError as e:
+        return str(e)
+    finally:
+        conn.close()
+
+
+def bare_connect():
+    """Соединение без busy_timeout — так открывал базу старый get_conn()"""
+    conn = sqlite3.connect(db.DB_PATH, timeout=0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_race(connect, n: int, sku: str) -> dict:
+    barrier = threading.Barrier(n)
+    with ThreadPoolExecutor(n) as pool:
+        results = list(pool.map(lambda _: legacy_create(connect, sku, 300.0, barrier), range(n)))
+    out = {}
+    for r in results:
+        key = r if isinstance(r, int) else "database is locked" if "locked" in r else r
+        out[key] = out.get(key, 0) + 1
+    return out
+
+
+def create_body(sku: str, area: float = 300) -> dict:
+    return {"manager": "Менеджер 0001", "sku_data": [{"sku": sku, "type": "замок", "area": area}]}
+
+
+def active_count(sku: str) -> int:
+    conn = db.get_conn()
+    n = conn.execute("SELECT COUNT(*) FROM protection_items i JOIN protections p ON p.id = i.protection_id "
+                     "WHERE p.status = 'active' AND i.sku = ?", (sku,)).fetchone()[0]
+    conn.close()
+    return n
+
+
+def check_index():
+    from backend.dup_index import DUP_INDEX, DuplicateIndex
+
+    conn = db.get_conn()
+    fresh = DuplicateIndex()
+    fresh.rebuild(conn.cursor())
+    DUP_INDEX.ensure_loaded(conn.cursor())
+    conn.close()
+    assert {p: sorted(e) for p, e in fresh._by_pid.items()} == {p: sorted(e) for p, e in DUP_INDEX._by_pid.items()}
+
+
+async def main():
+    creators = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with bench_db(protections=20_000, managers=50, users=100, history_per_protection=1):
+        from backend import main as api
+        from backend.dup_index import DUP_INDEX
+        from backend.writer import WRITER
+
+        app = api.app
+        loop = asyncio.get_running_loop()
+
+        # --- 1. гонка дублей ---
+        bare = await loop.run_in_executor(None, legacy_race, bare_connect, creators, "RACE-1")
+        pooled = await loop.run_in_executor(None, legacy_race, db.get_conn, creators, "RACE-2")
+        assert active_count("RACE-2") == pooled.get(200, 0)
+        DUP_INDEX.invalidate()   # старые обработчики писали мимо индекса
+
+        responses = await asyncio.gather(*(call(app, "POST", "/api/protections", body=create_body("RACE-3"))
+                                           for _ in range(creators)))
+        statuses = sorted(status for status, _, _ in responses)
+        assert statuses == [200] + [409] * (creators - 1), statuses
+        assert active_count("RACE-3") == 1
+        check_index()
+        print(f"гонка {creators} создателей одного артикула: по-старому без busy_timeout {bare}, "
+              f"с busy_timeout {pooled}")
+        print(f"✅ через писателя: одна 200, {creators - 1} × 409, «database is locked» нет, индекс дублей сходится")
+
+        # --- 2. откат внутри группы ---
+        groups = WRITER.groups
+        mixed = [create_body(f"MIX-{i}") for i in range(creators)]
+        mixed[::5] = [create_body("RACE-3")] * len(mixed[::5])   # каждая пятая — дубль
+        responses = await asyncio.gather(*(call(app, "POST", "/api/protections", body=b) for b in mixed))
+        assert [s for s, _, _ in responses] == [409 if i % 5 == 0 else 200 for i in range(creators)]
+        assert WRITER.groups - groups < creators, "409 не должна дробить группу"
+        status, _, _ = await call(app, "PUT", "/api/protections/999999999", body={"comment": "нет такой"})
+        assert status == 404
+        status, _, body = await call(app, "POST", "/api/protections", body=create_body("AFTER-404"))
+        assert status == 200, body
+        check_index()
+        print(f"✅ {creators} запросов вперемешку с дублями — {WRITER.groups - groups - 2} групп(ы): 409 откатывает "
+              f"только свой savepoint; после 404 писатель работает")
+
+        # --- 3. пропускная способность ---
+        def legacy_round(r: int):
+            with ThreadPoolExecutor(creators) as pool:
+                return list(pool.map(lambda i: legacy_create(db.get_conn, f"OLD-{r}-{i}", 300.0), range(creators)))
+
+        t0 = time.perf_counter()
+        for r in range(rounds):
+            results = await loop.run_in_executor(None, legacy_round, r)
+            assert results == [200] * creators, results
+        t_old = time.perf_counter() - t0
+        DUP_INDEX.invalidate()
+
+        groups, jobs = WRITER.groups, WRITER.jobs
+        t0 = time.perf_counter()
+        for r in range(rounds):
+            responses = await asyncio.gather(*(call(app, "POST", "/api/protections", body=create_body(f"NEW-{r}-{i}"))
+                                               for i in range(creators)))
+            assert all(s == 200 for s, _, _ in responses), [b for s, _, b in responses if s != 200][:1]
+        t_new = time.perf_counter() - t0
+        groups, jobs = WRITER.groups - groups, WRITER.jobs - jobs
+        check_index()
+        total = creators * rounds
+        print(f"{total} созданий ({rounds} раундов по {creators}): commit в каждом обработчике "
+              f"{total / t_old:.0f}/с ({total} commit), писатель {total / t_new:.0f}/с "
+              f"({groups} commit, {jobs / groups:.1f} изменений на группу)")
+        created = json.loads(responses[0][2])
+        assert created["status"] == "active"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
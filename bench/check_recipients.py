@@ -0,0 +1,153 @@
+"""
+Проверка графа получателей (backend/recipients.py) против прежних SQL-запросов.
+
+Запуск:  python -m bench.check_recipients
+
+Меняет users через настоящие эндпоинты (dev-login, POST/PATCH/DELETE
+/api/users, link-assistant, заведение менеджеров через /api/admin/managers
+с привязкой аккаунта по имени, явной и при входе)
+и после каждого шага сравнивает ответы графа с запросами к базе по
+managers.user_id. Тёзка менеджера уведомлений не получает. В конце
+проверяет, что повторные вызовы не перечитывают users (ноль обращений к
+базе на горячем пути).
+"""
+import asyncio
+import sys
+import time
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db
+
+
+# === Эталон: как получатели считались раньше, запросами к базе ===
+def sql_for_manager(cur, mid: int) -> list:
+    tg_ids = []
+    mgr = cur.execute(
+        "SELECT u.id, u.tg_id, u.group_tag FROM managers m JOIN users u ON u.id = m.user_id WHERE m.id=?", (mid,)
+    ).fetchone()
+    group_tag = None
+    if mgr:
+        if mgr["tg_id"]:
+            tg_ids.append(mgr["tg_id"])
+        group_tag = mgr["group_tag"]
+        tg_ids += [a["tg_id"] for a in cur.execute(
+            "SELECT tg_id FROM users WHERE role='assistant' AND manager_id=?", (mgr["id"],)
+        ) if a["tg_id"]]
+    if group_tag:
+        tg_ids += [a["tg_id"] for a in cur.execute(
+            "SELECT tg_id FROM users WHERE role='admin' AND group_tag=?", (group_tag,)
+        ) if a["tg_id"]]
+    tg_ids += [a["tg_id"] for a in cur.execute(
+        "SELECT tg_id FROM users WHERE role='superadmin'"
+    ) if a["tg_id"]]
+    return list(dict.fromkeys(tg_ids))
+
+
+def sql_owners(cur, mid: int) -> list:
+    tg_ids = []
+    for u in cur.execute(
+        "SELECT u.id, u.tg_id FROM managers m JOIN users u ON u.id = m.user_id WHERE m.id=?", (mid,)
+    ).fetchall():
+        if u["tg_id"]:
+            tg_ids.append(u["tg_id"])
+        tg_ids += [a["tg_id"] for a in cur.execute(
+            "SELECT tg_id FROM users WHERE manager_id=? AND role='assistant'", (u["id"],)
+        ) if a["tg_id"]]
+    return list(dict.fromkeys(tg_ids))
+
+
+def compare(step: str, ids: list):
+    from backend.recipients import RECIPIENTS
+
+    conn = db.get_conn()
+    cur = conn.cursor()
+    graph = RECIPIENTS.for_managers(ids)
+    owners = RECIPIENTS.owners(ids)
+    for mid in ids:
+        expected = sql_for_manager(cur, mid)
+        assert graph[mid] == expected, (step, mid, graph[mid], expected)
+        expected = sql_owners(cur, mid)
+        assert owners[mid] == expected, (step, "owners", mid, owners[mid], expected)
+    conn.close()
+    print(f"✅ {step}")
+
+
+async def main():
+    with bench_db():
+        from backend import main as api
+        from backend.recipients import RECIPIENTS
+
+        app = api.app
+
+        async def ok(method, path, **kw):
+            status, _, body = await call(app, method, path, **kw)
+            assert status == 200, (method, path, status, body)
+
+        async def user_id(tg_id: int) -> int:
+            conn = db.get_conn()
+            row = conn.execute("SELECT id FROM users WHERE tg_id=?", (tg_id,)).fetchone()
+            conn.close()
+            return row["id"]
+
+        await ok("POST", "/api/auth/dev-login", body={"tg_id": 1, "first_name": "Босс", "role": "superadmin"})
+        for tg_id, name in ((10, "Анна"), (20, "Борис")):
+            await ok("POST", "/api/auth/dev-login", body={"tg_id": tg_id, "first_name": name})
+        admin = {"token": api.create_token(1, "superadmin")}
+        # Анна — аккаунт найден по имени, Борис — передан явно, Вера — входит
+        # уже после заведения, «Нет аккаунта» — так и остаётся без аккаунта
+        await ok("POST", "/api/admin/managers", body={"name": "Анна"}, headers=admin)
+        await ok("POST", "/api/admin/managers", body={"name": "Борис", "user_id": await user_id(20)}, headers=admin)
+        await ok("POST", "/api/admin/managers", body={"name": "Вера"}, headers=admin)
+        await ok("POST", "/api/admin/managers", body={"name": "Нет аккаунта"}, headers=admin)
+        await ok("POST", "/api/auth/dev-login", body={"tg_id": 30, "first_name": "Вера"})
+        conn = db.get_conn()
+        ids, links = zip(*conn.execute("SELECT id, user_id FROM managers ORDER BY id").fetchall())
+        conn.close()
+        ids = list(ids)
+        assert list(links) == [await user_id(10), await user_id(20), await user_id(30), None], links
+        compare("менеджеры, их аккаунты и супер-админ", ids)
+
+        anna = await user_id(10)
+        await ok("PATCH", f"/api/users/{anna}", body={"group_tag": "north"})
+        await ok("POST", "/api/users/", body={"tg_id": 11, "first_name": "Ася"})
+        asya = await user_id(11)
+        await ok("PATCH", f"/api/users/{asya}", body={"role": "assistant", "manager_id": anna})
+        compare("ассистент через PATCH", ids)
+
+        await ok("POST", "/api/users/", body={"tg_id": 12, "first_name": "Арсений"})
+        arseny = await user_id(12)
+        await ok("PATCH", f"/api/users/{arseny}", body={"role": "assistant"})
+        await ok("POST", "/api/users/link-assistant", body={"manager_id": anna, "assistant_id": arseny})
+        compare("ассистент через link-assistant", ids)
+
+        await ok("POST", "/api/auth/dev-login", body={"tg_id": 40, "first_name": "Админ Север", "role": "admin"})
+        await ok("PATCH", f"/api/users/{await user_id(40)}", body={"group_tag": "north"})
+        compare("админ группы", ids)
+
+        await ok("PATCH", f"/api/users/{anna}", body={"group_tag": "south"})
+        await ok("DELETE", f"/api/users/{asya}")
+        compare("смена группы и удаление ассистента", ids)
+
+        # dev-login меняет роль существующего пользователя
+        await ok("POST", "/api/auth/dev-login", body={"tg_id": 20, "first_name": "Борис", "role": "admin"})
+        await ok("POST", "/api/auth/dev-login", body={"tg_id": 50, "first_name": "Вера"})
+        compare("смена роли и тёзка", ids)
+        vera_tg = RECIPIENTS.owners([ids[2]])[ids[2]]
+        assert vera_tg == [30], f"тёзка получает чужие напоминания: {vera_tg}"
+
+        loads = RECIPIENTS.loads
+        t0 = time.perf_counter()
+        for _ in range(10_000):
+            RECIPIENTS.for_manager(ids[0])
+        took = (time.perf_counter() - t0) / 10_000 * 1e6
+        assert RECIPIENTS.loads == loads, "граф перечитан без изменений users"
+        print(f"✅ 10000 вызовов без обращений к базе, {took:.1f} мкс на вызов")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except AssertionError as e:
+        print("❌", e)
+        sys.exit(1)
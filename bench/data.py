@@ -0,0 +1,175 @@
+"""
+Генератор синтетической базы для бенчмарков: защиты, пользователи,
+менеджеры и история в пропорциях, похожих на боевые. Артикулы берутся
+из backend/skus.csv.
+"""
+import json
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import backend.db as db
+from backend.items import parse_display, write_items
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск",
+          "Краснодар", "Самара", "Воронеж", "Пермь", "Уфа"]
+PARTNER_WORDS = ["Строй", "Пол", "Декор", "Ремонт", "Интерьер", "Дом", "Мастер", "Плюс"]
+STREETS = ["Ленина", "Мира", "Садовая", "Гагарина", "Советская", "Победы", "Лесная"]
+GROUPS = ["north", "south", "center", "east", "west"]
+STATUSES = ["active"] * 40 + ["success"] * 25 + ["closed"] * 30 + ["pending"] * 5
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(timespec="seconds") + "Z"
+
+
+def manager_names(n: int) -> list:
+    return [f"Менеджер {i:04d}" for i in range(n)]
+
+
+def partner_names(n: int) -> list:
+    rnd = random.Random(3)
+    return [
+        f"{rnd.choice(PARTNER_WORDS)}{rnd.choice(PARTNER_WORDS)} {i}"
+        for i in range(n)
+    ]
+
+
+def generate(protections: int = 100_000, managers: int = 1_000, users: int = 3_000,
+             history_per_protection: int = 3, seed: int = 42) -> dict:
+    """Наполняет текущую db.DB_PATH (схема уже создана) и возвращает размеры"""
+    rnd = random.Random(seed)
+    skus = db.load_skus()
+    names = manager_names(managers)
+    partners = partner_names(max(100, protections // 50))
+    now = datetime.utcnow().replace(microsecond=0)
+
+    conn = db.get_conn()
+    cur = conn.cursor()
+
+    cur.executemany(
+        "INSERT INTO managers(name, created_at) VALUES (?,?)",
+        [(name, _iso(now)) for name in names],
+    )
+    manager_ids = dict(cur.execute("SELECT name, id FROM managers").fetchall())
+
+    # users: менеджеры (по имени из managers), ассистенты, админы групп, супер-админ
+    cur.execute(
+        "INSERT INTO users(tg_id, tg_username, first_name, role, created_at) VALUES (?,?,?,?,?)",
+        (1, "boss", "Босс", "superadmin", _iso(now)),
+    )
+    user_rows = []
+    for i in range(users - 1):
+        tg_id = 100_000 + i
+        if i < managers:
+            user_rows.append((tg_id, f"m{i}", names[i], "manager", GROUPS[i % len(GROUPS)], None))
+        elif i < managers + len(GROUPS) * 4:
+            user_rows.append((tg_id, f"a{i}", f"Админ {i}", "admin", GROUPS[i % len(GROUPS)], None))
+        else:
+            # ассистент: manager_id — users.id менеджера (id 2..managers+1)
+            user_rows.append((tg_id, f"s{i}", f"Ассистент {i}", "assistant", None, rnd.randint(2, managers + 1)))
+    cur.executemany(
+        """
+        INSERT INTO users(tg_id, tg_username, first_name, role, group_tag, manager_id, created_at)
+        VALUES (?,?,?,?,?,?,?)
+        """,
+        [(*r, _iso(now)) for r in user_rows],
+    )
+    if "user_id" in {r[1] for r in cur.execute("PRAGMA table_info(managers)")}:
+        # Telegram-аккаунт менеджера names[i] — users.id i + 2 (после супер-админа)
+        cur.executemany("UPDATE managers SET user_id=? WHERE id=?",
+                        [(i + 2, manager_ids[name]) for i, name in enumerate(names[:users - 1])])
+
+    rows = []
+    for i in range(protections):
+        item = rnd.choice(skus)
+        area = float(rnd.randint(50, 2000))
+        created = now - timedelta(days=rnd.uniform(0, 365))
+        status = rnd.choice(STATUSES)
+        expires = created + timedelta(days=rnd.choice([5, 10, 20, 30]))
+        if status == "active":
+            expires = now + timedelta(days=rnd.uniform(-1, 30))
+        closed = _iso(expires) if status in ("success", "closed") else None
+        manager = rnd.choice(names)
+        rows.append((
+            manager, manager_ids[manager], f"Клиент {rnd.randint(1, 50_000)}", rnd.choice(partners),
+            rnd.choice(CITIES), f"{item['sku']} ({item['type']}) — {int(area)} м²", area,
+            f"{rnd.randint(0, 9999):04d}", rnd.choice(CITIES),
+            f"ул. {rnd.choice(STREETS)}, {rnd.randint(1, 150)}", "",
+            status, _iso(created), _iso(expires), closed,
+        ))
+    cur.executemany(
+        """
+        INSERT INTO protections(manager, manager_id, client, partner, partner_city, sku, area_m2, last4,
+                                object_city, address, comment, status, created_at, expires_at, closed_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """,
+        rows,
+    )
+
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name='protection_items'").fetchone():
+        # иначе их разберёт из protections.sku миграция 3
+        write_items(cur, [(pid, parse_display(row[5], row[6])) for pid, row in enumerate(rows, start=1)],
+                    replace=False)
+
+    history = []
+    for pid, row in enumerate(rows, start=1):
+        sku, area, created = row[5], row[6], row[12]
+        history.append((pid, created, "manager", "create", json.dumps({"sku": sku, "area_m2": area}, ensure_ascii=False)))
+        for _ in range(rnd.randint(0, 2 * history_per_protection - 2)):
+            action = rnd.choices(["extend", "update", "extend_request"], weights=[45, 45, 2])[0]
+            payload = {"days": 10} if action != "update" else {"comment": "правка"}
+            if action == "extend_request":
+                payload["reason"] = "клиент думает"
+            history.append((pid, created, rnd.choice(["manager", "admin"]), action,
+                            json.dumps(payload, ensure_ascii=False)))
+    cur.executemany(
+        "INSERT INTO history(protection_id, at, actor, action, payload) VALUES (?,?,?,?,?)",
+        history,
+    )
+    conn.commit()
+    conn.close()
+    return {
+        "protections": protections,
+        "managers": managers,
+        "users": users,
+        "history": len(history),
+        "skus": len(skus),
+    }
+
+
+@contextmanager
+def bench_db(storage: bool = True, **sizes):
+    """Временная база на время with: схема, generate(**sizes) (если размеры заданы)
+    и main.init_storage() — как при старте (storage=False — без него).
+    Отдаёт размеры; на выходе закрывает пул и удаляет каталог (он же db.DB_PATH.parent)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "data.sqlite3"
+        from backend import main as api
+        from backend.users import init_users_table
+
+        db.init_db()
+        init_users_table()
+        api._safe_migrate()
+        made = generate(**sizes) if sizes else {}
+        if storage:
+            api.init_storage()
+        try:
+            yield made
+        finally:
+            db.close_pool()
+
+
+@contextmanager
+def repo_db_copy():
+    """Копия backend/data.sqlite3 во временном каталоге: на время with db.DB_PATH указывает на неё"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "repo.sqlite3"
+        shutil.copy(Path(db.__file__).resolve().parent / "data.sqlite3", db.DB_PATH)
+        try:
+            yield db.DB_PATH
+        finally:
+            db.close_pool()
@@ -0,0 +1,250 @@
+"""
+Нагрузочный прогон API на синтетической базе.
+
+Запуск:
+    python -m bench.suite                              # 100k защит, результат в bench/results/<commit>.json
+    python -m bench.suite --protections 20000 --requests 100
+    python -m bench.suite --compare bench/results/abc1234.json   # сравнить с прошлым прогоном
+    python -m bench.suite --only stats,check_duplicate
+
+Создаёт временную data.sqlite3, наполняет её через bench/data.py, поднимает
+хранилище как при старте (main.init_storage) и гоняет запросы прямо в
+FastAPI-приложение (bench/asgi.py). По каждому сценарию — p50/p95/p99,
+среднее и пропускная способность. С --compare печатает разницу по p95 и
+завершается с кодом 1, если что-то стало медленнее порога --threshold.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import backend.db as db
+from bench.asgi import call
+from bench.data import bench_db, manager_names, partner_names
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+
+
+# === Сценарии ===
+# name -> (фабрика запроса, допустимые статусы, доля от --requests)
+def scenarios(ctx: dict) -> dict:
+    rnd = ctx["rnd"]
+    skus = ctx["skus"]
+    managers = ctx["managers"]
+    partners = ctx["partners"]
+    admin = {"token": ctx["admin_token"]}
+    max_pid = ctx["sizes"]["protections"]
+    counter = iter(range(10 ** 9))
+
+    def search_term():
+        kind = rnd.random()
+        if kind < 0.4:
+            return rnd.choice(skus)["sku"]
+        if kind < 0.8:
+            return rnd.choice(partners).split()[0][:6]
+        return rnd.choice(managers)
+
+    def new_protection():
+        # уникальный артикул, чтобы каждый запрос доходил до INSERT, а не до 409
+        n = next(counter)
+        return {
+            "manager": rnd.choice(managers),
+            "partner": rnd.choice(partners),
+            "client": f"Клиент bench {n}",
+            "sku_data": [{"sku": f"BENCH-{n}", "type": "замок", "area": float(rnd.randint(50, 2000))}],
+        }
+
+    return {
+        "protections_page": (
+            lambda: ("GET", "/api/protections", {"limit": 50}, None, None), {200}, 1.0),
+        "protections_manager": (
+            lambda: ("GET", "/api/protections", {"manager": rnd.choice(managers), "limit": 50}, None, None),
+            {200}, 1.0),
+        "protections_search": (
+            lambda: ("GET", "/api/protections", {"search": search_term(), "limit": 50}, None, None),
+            {200}, 1.0),
+        "protections_all": (
+            lambda: ("GET", "/api/protections", None, None, None), {200}, 0.05),
+        "stats": (
+            lambda: ("GET", "/api/stats", None, None, None), {200}, 1.0),
+        "admin_managers": (
+            lambda: ("GET", "/api/admin/managers", None, None, admin), {200}, 1.0),
+        "history": (
+            lambda: ("GET", "/api/history", {"protection_id": rnd.randint(1, max_pid)}, None, None),
+            {200}, 1.0),
+        "history_recent": (
+            lambda: ("GET", "/api/history", None, None, None), {200}, 0.5),
+        "extend_requests": (
+            lambda: ("GET", "/api/admin/extend-requests", None, None, admin), {200}, 0.25),
+        "check_duplicate": (
+            lambda: ("POST", "/api/protections/check-duplicate", None,
+                     {"sku_data": [{"sku": rnd.choice(skus)["sku"], "area": rnd.randint(50, 2000)}]}, None),
+            {200}, 1.0),
+        "skus": (
+            lambda: ("GET", "/api/skus", None, None, {"accept-encoding": "gzip"}), {200}, 1.0),
+        "skus_search": (
+            lambda: ("GET", "/api/skus/search", {"q": rnd.choice(skus)["sku"][:rnd.randint(1, 3)]}, None, None),
+            {200}, 1.0),
+        "create_protection": (
+            lambda: ("POST", "/api/protections", None, new_protection(), None), {200}, 1.0),
+    }
+
+
+# === Замеры ===
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+async def run_scenario(app, make_request, ok_statuses, total: int, concurrency: int) -> dict:
+    latencies = []
+    statuses = {}
+    left = [total]
+
+    async def worker():
+        while left[0] > 0:
+            left[0] -= 1
+            method, path, params, body, headers = make_request()
+            t0 = time.perf_counter()
+            status, _, _ = await call(app, method, path, params=params, body=body, headers=headers)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    for _ in range(min(3, total)):  # прогрев
+        method, path, params, body, headers = make_request()
+        await call(app, method, path, params=params, body=body, headers=headers)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "requests": total,
+        "ok": sum(c for s, c in statuses.items() if s in ok_statuses),
+        "statuses": {str(s): c for s, c in sorted(statuses.items())},
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "max_ms": round(latencies[-1], 2),
+        "rps": round(total / wall, 1),
+    }
+
+
+def git_commit() -> tuple:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+        dirty = bool(subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True
+        ).strip())
+        return commit, dirty
+    except Exception:
+        return "unknown", False
+
+
+def compare(base: dict, report: dict, threshold: float) -> list:
+    """Печатает p95 до/после; возвращает сценарии, ставшие медленнее порога (%)"""
+    worse = []
+    print(f"\nСравнение с {base['meta'].get('commit')} (p95, мс):")
+    for name, res in report["results"].items():
+        old = base["results"].get(name)
+        if not old:
+            print(f"  {name:22} {'—':>10} {res['p95_ms']:10.2f}")
+            continue
+        delta = (res["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        mark = ""
+        if delta > threshold:
+            mark = "  ❌"
+            worse.append(name)
+        print(f"  {name:22} {old['p95_ms']:10.2f} {res['p95_ms']:10.2f} {delta:+7.1f}%{mark}")
+    return worse
+
+
+async def main(args):
+    t0 = time.perf_counter()
+    with bench_db(protections=args.protections, managers=args.managers, users=args.users) as sizes:
+        from backend import main as api
+
+        print(f"📦 База: {sizes} за {time.perf_counter() - t0:.1f} с")
+
+        ctx = {
+            "rnd": random.Random(args.seed),
+            "skus": db.load_skus(),
+            "managers": manager_names(args.managers),
+            "partners": partner_names(max(100, args.protections // 50)),
+            "admin_token": api.create_token(1, "superadmin"),
+            "sizes": sizes,
+        }
+        only = set(args.only.split(",")) if args.only else None
+        results = {}
+        for name, (make_request, ok_statuses, share) in scenarios(ctx).items():
+            if only and name not in only:
+                continue
+            total = max(5, int(args.requests * share))
+            res = await run_scenario(api.app, make_request, ok_statuses, total, args.concurrency)
+            results[name] = res
+            print(
+                f"  {name:22} p50 {res['p50_ms']:8.2f}  p95 {res['p95_ms']:8.2f}  p99 {res['p99_ms']:8.2f} мс"
+                f"  {res['rps']:8.1f} req/s  ok {res['ok']}/{res['requests']}"
+            )
+
+    commit, dirty = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "date": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "dataset": sizes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{commit}{'-dirty' if dirty else ''}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"💾 Результат: {out}")
+
+    failed = [name for name, r in results.items() if r["ok"] != r["requests"]]
+    if failed:
+        print(f"❌ Неожиданные статусы в: {', '.join(failed)}")
+    worse = []
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        worse = compare(base, report, args.threshold)
+    return 1 if failed or worse else 0
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Бенчмарк API ProjectGuard на синтетических данных")
+    ap.add_argument("--protections", type=int, default=100_000)
+    ap.add_argument("--managers", type=int, default=1_000)
+    ap.add_argument("--users", type=int, default=3_000)
+    ap.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--only", help="сценарии через запятую")
+    ap.add_argument("--out", help="куда сохранить JSON (по умолчанию bench/results/<commit>.json)")
+    ap.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    ap.add_argument("--threshold", type=float, default=20.0, help="допустимый рост p95, %%")
+    return ap.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))